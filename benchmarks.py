@@ -0,0 +1,392 @@
+# Benchmarks of the hot paths on synthetic data, to compare runs across commits.
+#
+# Every benchmark runs at the sizes below, with fixed seeds, on the local NumPy engines
+# (flood_utils/local_toolbox.py, DuckDB, rasterio) or on the offline Earth Engine
+# stand-in (fake_ee.py), so no account or network is needed and every run reads the
+# same data. Each benchmark is repeated on a fresh fake world (empty caches) and the
+# results are written as JSON to {results_dir}/{commit}.json: the wall times of every
+# repeat, their minimum and median, the round trips made and a summary of the output,
+# which should not change between commits unless the results do.
+#
+#   python benchmarks.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import statistics
+import contextlib
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import ee_session
+
+# Run every Earth Engine call on the offline stand-in
+ee_session.configure(module='fake_ee')
+
+# Sizes to run, see SIZES
+sizes = ['small', 'medium', 'large']
+
+# Benchmarks to run, see BENCHMARKS; None for all of them
+benchmarks = None  # e.g. ['otsu_ee', 'refined_lee']
+
+# Timed repeats of every benchmark, after one untimed warm-up run
+repeats = 3
+
+# Folder of the result files, one per commit
+results_dir = 'benchmark_results'
+
+# Result file of an earlier run to compare with, e.g. 'benchmark_results/b5530b1.json'; None to skip
+baseline_path = None
+
+# Seed of the synthetic data
+seed = 0
+
+# Time budgets of the median run in microseconds per pixel (pixels x pixels); a benchmark
+# over its budget at any size makes the run fail after the results are written
+budgets = {'refined_lee': 0.6}
+
+# First day of the synthetic periods and the cumulative rainfall windows (minutes)
+start_day = '2023-08-20'
+time_list = [30, 60, 120, 240, 480, 960, 1440]
+
+# ROI and period sizes:
+#   shape        rows and columns of the fake world, i.e. of every Earth Engine image
+#   event_days   length of the rainfall and flood events
+#   rain_days    length of the period classified into rainy days
+#   period_days  length of the day lists grouped into events
+#   pixels       width and height of the local rasters (Refined Lee, histograms, tiles)
+#   rows         rows written to DuckDB
+SIZES = {
+    'small': {'shape': (40, 70), 'event_days': 2, 'rain_days': 7, 'period_days': 365, 'pixels': 256, 'rows': 1000},
+    'medium': {'shape': (80, 140), 'event_days': 4, 'rain_days': 30, 'period_days': 3650, 'pixels': 1024, 'rows': 10000},
+    'large': {'shape': (160, 280), 'event_days': 8, 'rain_days': 90, 'period_days': 36500, 'pixels': 2048, 'rows': 100000},
+}
+
+
+def fake_world(size):
+    """
+    Replaces the data of the offline stand-in with a fresh world of the given size, emptying its caches.
+    """
+    import fake_ee
+    fake_ee.configure(world=fake_ee.World(shape=size['shape'], seed=seed), latency=0, jitter=0)
+
+
+def shenzhen():
+    """
+    Returns:
+        tuple: (roi, bbox) of Shenzhen, as in rainfall_extract.py and flood_extract.py.
+    """
+    from ee_session import ee
+    from rainfall_utils.rainfall_toolbox import get_bbox
+    roi = ee.FeatureCollection("FAO/GAUL_SIMPLIFIED_500m/2015/level2").filter(ee.Filter.eq('ADM2_NAME', 'Shenzhen'))
+    return roi, get_bbox(roi)
+
+
+def bimodal(n, rng):
+    """
+    n values of a land/water mixture on the SWIR reflectance scale, wide enough for a 10000-bucket histogram.
+    """
+    water = rng.normal(600, 150, n // 3)
+    land = rng.normal(2200, 400, n - n // 3)
+    return np.concatenate([water, land])
+
+
+def speckled(pixels, rng):
+    """
+    A pixels x pixels backscatter image (linear power) with multiplicative speckle and a masked border.
+    """
+    y,x = np.mgrid[0:pixels, 0:pixels] / pixels
+    scene = 0.05 + 0.2 * (np.sin(8 * x) * np.cos(5 * y) > 0) + 0.02 * x
+    img = scene * rng.gamma(4.0, 1 / 4.0, (pixels, pixels))
+    img[:2, :] = np.nan
+    return img
+
+
+# ------------------------------------------------------------------ benchmarks
+# Each takes the size and a scratch folder and returns the function to time; the
+# function returns a small JSON summary of its output.
+
+def cumulative_rainfall(size, folder):
+    """RainfallEvent.calculate_cumulative_precipitation: moving-window sums over every time_list duration."""
+    from ee_session import ee
+    from rainfall_utils.rainfall_event import RainfallEvent
+    roi,bbox = shenzhen()
+    start = ee.Date(start_day)
+    event = RainfallEvent(start_date=start, end_date=start.advance(size['event_days'], 'day'), roi=roi, bbox=bbox,
+                          threshold=5, folder_path=folder + os.sep, resolution=1000, time_list=time_list)
+    def run():
+        paths,values = event.calculate_cumulative_precipitation(30, time_list)
+        return {str(k): round(v, 4) for k,v in values.items()}
+    return run
+
+
+def rainy_days(size, folder):
+    """RainfallPeriod.rainy_days: daily maximum rainfall against the threshold over the ROI."""
+    from ee_session import ee
+    from rainfall_utils.rainfall_period import RainfallPeriod
+    roi,bbox = shenzhen()
+    start = ee.Date(start_day)
+    period = RainfallPeriod(start_date=start, end_date=start.advance(size['rain_days'], 'day'), roi=roi, bbox=bbox,
+                            resolution=1000, time_list=time_list, rainy_day_threshold=5, folder_path=folder + os.sep)
+    def run():
+        return len(period.rainy_days())
+    return run
+
+
+def otsu_ee(size, folder):
+    """Public_methods.otsu1 on a 10000-bucket histogram, evaluated by the stand-in."""
+    from flood_utils.local_toolbox import histogram
+    from flood_utils.Public_methods import otsu1
+    values = bimodal(size['pixels'] ** 2, np.random.default_rng(seed))
+    counts,means = histogram(values[None], 10000, 0.01)
+    buckets = {'histogram': counts[0].tolist(), 'bucketMeans': means[0].tolist()}
+    def run():
+        return round(otsu1(buckets).getInfo(), 4)
+    return run
+
+
+def otsu_local(size, folder):
+    """local_toolbox.otsu: histogram and threshold of the same values with cumulative sums."""
+    from flood_utils.local_toolbox import otsu
+    values = bimodal(size['pixels'] ** 2, np.random.default_rng(seed))
+    def run():
+        return round(float(otsu(values[None], 10000, 0.01)[0]), 4)
+    return run
+
+
+def modis_dfo(size, folder):
+    """modis_main: MODIS compositing, Otsu thresholds and DFO water flags, reduced to the flooded share of the ROI."""
+    from ee_session import ee
+    from flood_utils.modis_extract_method import modis_main
+    roi,bbox = shenzhen()
+    start = ee.Date(start_day)
+    def run():
+        water = modis_main(start, start.advance(size['event_days'], 'day'), roi)
+        share = water.reduceRegion(reducer=ee.Reducer.mean(), geometry=roi.geometry(), scale=250).getInfo()
+        return {k: round(v, 4) for k,v in share.items() if v is not None}
+    return run
+
+
+def refined_lee(size, folder):
+    """local_toolbox.refined_lee on a speckled Sentinel-1 like image, on one thread."""
+    from flood_utils.local_toolbox import refined_lee
+    img = speckled(size['pixels'], np.random.default_rng(seed))
+    def run():
+        return round(float(np.nanmean(refined_lee(img, workers=1))), 6)
+    return run
+
+
+def event_grouping(size, folder):
+    """RainfallPeriod.rainfall_events and FloodPeriod.flood_events on day lists with seeded wet spells."""
+    from rainfall_utils.rainfall_period import RainfallPeriod
+    from flood_utils.flood_period import FloodPeriod
+    rng = np.random.default_rng(seed)
+    first = datetime.strptime(start_day, "%Y-%m-%d")
+    wet = rng.random(size['period_days']) < 0.3
+    days = [(first + timedelta(days=int(i))).strftime("%Y-%m-%d") for i in np.flatnonzero(wet)]
+    def run():
+        return {'rainfall_events': len(RainfallPeriod.rainfall_events(days)), 'flood_events': len(FloodPeriod.flood_events(days))}
+    return run
+
+
+def bulk_write(size, folder):
+    """BulkWriter upserts of FloodEvent and FloodDay rows into a new DuckDB database."""
+    import duckdb
+    from flood_utils.flood_toolbox import ininialize_database,BulkWriter
+    db_path = os.path.join(folder, 'bulk_write.db')
+    ininialize_database(db_path)
+    first = datetime.strptime(start_day, "%Y-%m-%d").date()
+    n_days = size['rows']
+    # Four days per event
+    events = [{'EventID': i, 'ParamHash': 'bench', 'StartDate': first + timedelta(days=i * 4), 'EndDate': first + timedelta(days=i * 4 + 4),
+               'FloodExtentValue': float(i % 97), 'FloodExtentMapPath': f'{folder}/event_{i}.tif'} for i in range(n_days // 4)]
+    days = [{'DayID': i, 'ParamHash': 'bench', 'EventID': i // 4, 'Date': first + timedelta(days=i),
+             'FloodExtentValue': float(i % 89), 'FloodExtentMapPath': f'{folder}/day_{i}.tif'} for i in range(n_days)]
+    def run():
+        con = duckdb.connect(db_path)
+        event_writer = BulkWriter(con, 'FloodEvent', 'EventID', key_columns=['EventID', 'ParamHash'])
+        day_writer = BulkWriter(con, 'FloodDay', 'DayID', after=event_writer, key_columns=['DayID', 'ParamHash'])
+        for event in events:
+            event_writer.add(event)
+        for day in days:
+            day_writer.add(day)
+        day_writer.flush()
+        count = con.execute("SELECT count(*) FROM FloodDay").fetchone()[0]
+        con.close()
+        return count
+    return run
+
+
+def tile_export(size, folder):
+    """rainfall_toolbox.to_cog and tile_pyramid.render_tiles on a synthetic rainfall map over Shenzhen."""
+    import rasterio
+    from rasterio.transform import from_bounds
+    from rainfall_utils.rainfall_toolbox import to_cog
+    from rainfall_utils.tile_pyramid import render_tiles
+    pixels = size['pixels']
+    rng = np.random.default_rng(seed)
+    y,x = np.mgrid[0:pixels, 0:pixels] / pixels
+    rain = (40 * np.exp(-((x - 0.6) ** 2 + (y - 0.4) ** 2) * 8) + rng.gamma(2.0, 2.0, (pixels, pixels))).astype(np.float32)
+    rain[:, :pixels // 10] = np.nan
+    source = os.path.join(folder, 'rainfall.tif')
+    profile = dict(driver='GTiff', width=pixels, height=pixels, count=1, dtype='float32', nodata=np.nan,
+                   crs='EPSG:4326', transform=from_bounds(113.75, 22.4, 114.65, 22.87, pixels, pixels))
+    with rasterio.open(source, 'w', **profile) as dst:
+        dst.write(rain, 1)
+    def run():
+        # A copy as exported by geemap, since to_cog rewrites the map in place
+        path = os.path.join(folder, 'rainfall_map.tif')
+        shutil.copyfile(source, path)
+        to_cog(path, resampling='AVERAGE')
+        return render_tiles(path, os.path.join(folder, 'tiles'))
+    return run
+
+
+BENCHMARKS = {
+    'cumulative_rainfall': cumulative_rainfall,
+    'rainy_days': rainy_days,
+    'otsu_ee': otsu_ee,
+    'otsu_local': otsu_local,
+    'modis_dfo': modis_dfo,
+    'refined_lee': refined_lee,
+    'event_grouping': event_grouping,
+    'bulk_write': bulk_write,
+    'tile_export': tile_export,
+}
+
+
+# ------------------------------------------------------------------ runner
+
+def git_commit():
+    """
+    Returns:
+        str: The short hash of HEAD, with a -dirty suffix for uncommitted changes, or 'unknown' outside git.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def run_benchmark(name, size_name):
+    """
+    Times one benchmark at one size: a warm-up run, then repeats on fresh worlds and scratch folders.
+
+    Returns:
+        dict: 'benchmark', 'size', 'params', 'seconds' (every repeat), 'min', 'median', 'round_trips' and 'result'.
+    """
+    import fake_ee
+    size = SIZES[size_name]
+    seconds = []
+    for i in range(repeats + 1):
+        folder = tempfile.mkdtemp(prefix=f'bench_{name}_')
+        # The progress messages of the toolkits are silenced, printing them is not timed
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                fake_world(size)
+                run = BENCHMARKS[name](size, folder)
+                fake_ee.reset()
+                start = time.perf_counter()
+                result = run()
+                elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        # The first run is a warm-up (imports, allocator, file cache)
+        if i:
+            seconds.append(elapsed)
+    return {
+        'benchmark': name,
+        'size': size_name,
+        'params': {k: list(v) if isinstance(v, tuple) else v for k,v in size.items()},
+        'seconds': seconds,
+        'min': min(seconds),
+        'median': statistics.median(seconds),
+        'round_trips': dict(sorted((kind, fake_ee.round_trips(kind)) for kind in ('getInfo', 'download', 'export', 'tasks'))),
+        'result': result,
+    }
+
+
+def over_budget(results):
+    """
+    Returns:
+        list: Messages for the results whose median time per pixel exceeds the budget of their benchmark.
+    """
+    messages = []
+    for r in results:
+        budget = budgets.get(r['benchmark'])
+        if budget is None:
+            continue
+        per_pixel = r['median'] / r['params']['pixels'] ** 2 * 1e6
+        if per_pixel > budget:
+            messages.append(f"{r['benchmark']} {r['size']}: {per_pixel:.3f} µs per pixel, budget {budget} µs")
+    return messages
+
+
+def compare(results, baseline):
+    """
+    Prints the median time of every benchmark next to the one of the baseline run.
+    """
+    before = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline['commit']}:")
+    print(f"{'Benchmark':<20}  {'Size':<6}  {'Before s':>9}  {'After s':>9}  {'Ratio':>6}  Result")
+    for r in results:
+        old = before.get((r['benchmark'], r['size']))
+        if old is None:
+            continue
+        same = 'same' if old['result'] == r['result'] else f"changed: {old['result']} -> {r['result']}"
+        print(f"{r['benchmark']:<20}  {r['size']:<6}  {old['median']:>9.4f}  {r['median']:>9.4f}  {r['median'] / old['median']:>6.2f}  {same}")
+
+
+if __name__ == '__main__':
+    ee_session.initialize()
+    names = benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS] + [name for name in sizes if name not in SIZES]
+    if unknown:
+        sys.exit(f"Unknown benchmarks or sizes: {', '.join(unknown)}")
+
+    # Read first, the baseline may be the file this run replaces
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = []
+    for name in names:
+        for size_name in sizes:
+            result = run_benchmark(name, size_name)
+            results.append(result)
+            print(f"{name:<20}  {size_name:<6}  median {result['median']:.4f} s  min {result['min']:.4f} s  "
+                  f"round trips {sum(result['round_trips'].values())}  result {result['result']}")
+
+    commit = git_commit()
+    document = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'repeats': repeats,
+        'results': results,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f'{commit}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=1, default=str)
+    print(f"Results written to {path}")
+
+    if baseline:
+        compare(results, baseline)
+
+    failures = over_budget(results)
+    if failures:
+        sys.exit('Over budget:\n' + '\n'.join(failures))
@@ -0,0 +1,138 @@
+# Earth Engine session shared by flood_utils and rainfall_utils.
+#
+# Importing a module of the toolkits does not touch the network: the modules use the
+# `ee` object below in place of the Earth Engine module. Its first use imports the
+# Earth Engine API and initialises the session, so only code that actually talks to
+# the server pays for it. The session is configured with configure(...) before that
+# first use, or from the environment:
+#
+#   EE_PROJECT      Cloud project passed to ee.Initialize
+#   EE_PROXY_PORT   Port of a local HTTP(S) proxy, e.g. 7890
+#   EE_PROXY_HOST   Host of the proxy, 127.0.0.1 by default
+#   EE_OPT_URL      Earth Engine endpoint, e.g. https://earthengine-highvolume.googleapis.com
+#   EE_MODULE       Module standing in for the Earth Engine API, e.g. an offline fake
+
+import os
+import importlib
+import threading
+
+# Setting name -> environment variable
+ENVIRONMENT = {
+    'project': 'EE_PROJECT',
+    'proxy_port': 'EE_PROXY_PORT',
+    'proxy_host': 'EE_PROXY_HOST',
+    'opt_url': 'EE_OPT_URL',
+    'module': 'EE_MODULE',
+}
+
+
+class EESession:
+    """
+    Earth Engine session initialised on first use.
+
+    Attributes:
+        settings (dict): Settings given to configure; the environment fills the others.
+        module: The initialised Earth Engine module, None until first use.
+    """
+    def __init__(self, **settings):
+        self.settings = {}
+        self.module = None
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.configure(**settings)
+
+    def configure(self, **settings):
+        """
+        Sets project, proxy_port, proxy_host, opt_url or module; must be called before first use.
+        """
+        unknown = set(settings) - set(ENVIRONMENT)
+        if unknown:
+            raise TypeError(f'Unknown Earth Engine settings: {sorted(unknown)}')
+        with self.lock:
+            if self.module is not None:
+                raise RuntimeError('The Earth Engine session is already initialised')
+            self.settings.update({name: value for name,value in settings.items() if value is not None})
+
+    def setting(self, name):
+        return self.settings.get(name, os.environ.get(ENVIRONMENT[name]))
+
+    def get(self):
+        """
+        Returns the Earth Engine module, initialising the session the first time.
+        """
+        if self.module is not None:
+            return self.module
+        with self.lock:
+            if self.module is None:
+                proxy_port = self.setting('proxy_port')
+                if proxy_port:
+                    proxy = f"http://{self.setting('proxy_host') or '127.0.0.1'}:{proxy_port}"
+                    os.environ['HTTP_PROXY'] = proxy
+                    os.environ['HTTPS_PROXY'] = proxy
+                module = importlib.import_module(self.setting('module') or 'ee')
+                options = {name: self.setting(name) for name in ('project', 'opt_url') if self.setting(name)}
+                try:
+                    module.Initialize(**options)
+                except module.EEException:
+                    # No stored credentials yet
+                    module.Authenticate()
+                    module.Initialize(**options)
+                for hook in self.hooks:
+                    hook(module)
+                self.module = module
+        return self.module
+
+    def add_hook(self, hook):
+        """
+        Calls hook(module) once the session is initialised, at once if it already is.
+        """
+        with self.lock:
+            if self.module is None:
+                self.hooks.append(hook)
+                return
+        hook(self.module)
+
+    @property
+    def initialized(self):
+        return self.module is not None
+
+
+class LazyEE:
+    """
+    Stands in for the `ee` module; the first attribute access initialises the session.
+    """
+    def __init__(self, session):
+        object.__setattr__(self, '_session', session)
+
+    def __getattr__(self, name):
+        return getattr(self._session.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._session.get(), name, value)
+
+    def __repr__(self):
+        state = 'initialised' if self._session.initialized else 'not initialised yet'
+        return f'<Earth Engine session, {state}>'
+
+
+session = EESession()
+ee = LazyEE(session)
+
+
+def configure(**settings):
+    """
+    Configures the shared session, see EESession.configure.
+    """
+    session.configure(**settings)
+
+
+def initialize(**settings):
+    """
+    Configures and initialises the shared session now, for scripts that build Earth Engine objects at once.
+
+    Returns:
+        The Earth Engine module.
+    """
+    if settings:
+        session.configure(**settings)
+    return session.get()
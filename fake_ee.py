@@ -0,0 +1,1862 @@
+# Offline stand-in for the Earth Engine API, for testing and benchmarking without an account.
+#
+# It implements, on NumPy arrays, the part of the API used by the rainfall and flood
+# pipelines: dates, numbers, lists, dictionaries and arrays are evaluated at once, and
+# images compute their bands the first time they are needed. The data comes from a
+# synthetic World on a regular lon/lat grid, generated from a seed for any date:
+#
+#   NASA/GPM_L3/IMERG_V06              half-hourly precipitationCal, storms of one to a few days
+#   MODIS/006/MOD09GQ|GA, MYD09GQ|GA   daily Terra/Aqua reflectances, water where it rained, some clouds
+#   JAXA/ALOS/AW3D30_V1_1              elevation (AVE) rising from the river, a few hills
+#   JRC/GSW1_4/YearlyHistory           yearly waterClass, 3 on the river and the reservoir
+#   FAO/GAUL*/2015/level2              four units, Shenzhen in the middle of the world
+#   any other FeatureCollection        the permanent water areas, with code = 1
+#
+# Every request that reaches the server in the real API -- getInfo, geemap.ee_export_image
+# downloads, batch exports and task listings -- is recorded in `calls` with the line of
+# the toolkit that made it, after waiting the configured latency. Exports write local
+# GeoTIFFs (downloads) or keep the image under its asset ID (toAsset).
+#
+# Use it through the session, before the first Earth Engine call:
+#
+#   EE_MODULE=fake_ee python rainfall_extract.py
+#   ee_session.configure(module='fake_ee'); fake_ee.configure(world=fake_ee.World(shape=(200, 350)), latency=0.3)
+#
+# The environment can set FAKE_EE_LATENCY (seconds per request), FAKE_EE_SEED and
+# FAKE_EE_SHAPE ("rows,cols"). Simplifications: every band is float64, reductions finer
+# than the grid use the grid, exports are in EPSG:4326 whatever the crs, polygons are
+# reduced to their bounding boxes, and expression() supports arithmetic, comparisons,
+# || and && only.
+
+import os
+import re
+import sys
+import time
+import types
+import zlib
+import random
+import calendar
+import threading
+from collections import Counter,OrderedDict
+from datetime import datetime,timedelta
+from functools import lru_cache
+from statistics import NormalDist
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+# Metres per degree, for converting scales to the grid
+METRES_PER_DEGREE = 111320.0
+
+settings = {
+    'latency': float(os.environ.get('FAKE_EE_LATENCY', 0)),
+    'export_latency': None,
+    'jitter': 0.0,
+    'export_dir': None,
+    'cache_mb': 256,
+}
+# Every round trip: kind, detail, site, thread, start and latency
+calls = []
+_lock = threading.Lock()
+_jitter = random.Random(0)
+_world = None
+
+
+class EEException(Exception):
+    """Raised where the real API would return an error."""
+
+
+# --------------------------------------------------------------------------- recording
+
+def configure(world=None, latency=None, export_latency=None, jitter=None, export_dir=None, cache_mb=None, seed=None):
+    """
+    Configures the fake; settings left to None are unchanged.
+
+    Args:
+        world (World, optional): The synthetic data; replaces the current one and empties the caches.
+        latency (float, optional): Seconds each request waits, like a server round trip.
+        export_latency (float, optional): Seconds of a download or export, by default the latency.
+        jitter (float, optional): Relative random variation of the latencies, e.g. 0.2 for +/-20 %.
+        export_dir (str, optional): Folder where Drive and Cloud Storage exports are written.
+        cache_mb (int, optional): Memory kept for computed image bands.
+        seed (int, optional): Seed of the latency jitter.
+    """
+    global _world
+    with _lock:
+        for name,value in (('latency', latency), ('export_latency', export_latency), ('jitter', jitter),
+                           ('export_dir', export_dir), ('cache_mb', cache_mb)):
+            if value is not None:
+                settings[name] = value
+        if seed is not None:
+            _jitter.seed(seed)
+    if world is not None:
+        _world = world
+        _arrays.clear()
+
+
+def reset():
+    """Forgets the recorded calls."""
+    with _lock:
+        calls.clear()
+
+
+def round_trips(kind=None):
+    """
+    Returns:
+        int: Number of recorded requests, of the given kind ('getInfo', 'download', 'export', 'tasks') or all.
+    """
+    with _lock:
+        return sum(1 for call in calls if kind is None or call['kind'] == kind)
+
+
+def summary():
+    """
+    Returns:
+        collections.Counter: Number of requests per (kind, site), e.g. ('getInfo', 'rainfall_utils/rainfall_toolbox.py:98').
+    """
+    with _lock:
+        return Counter((call['kind'], call['site']) for call in calls)
+
+
+# Modules whose frames are skipped when finding the line that made a request
+WRAPPER_MODULES = {__name__, 'tracing'}
+
+
+def _call_site():
+    # First frame outside this module and the instrumentation, as folder/file.py:line
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') in WRAPPER_MODULES:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    path = os.path.normpath(frame.f_code.co_filename).split(os.sep)
+    return f"{'/'.join(path[-2:])}:{frame.f_lineno}"
+
+
+def _round_trip(kind, detail):
+    latency = settings['latency']
+    if kind in ('download', 'export') and settings['export_latency'] is not None:
+        latency = settings['export_latency']
+    with _lock:
+        if settings['jitter']:
+            latency *= 1 + _jitter.uniform(-settings['jitter'], settings['jitter'])
+    site = _call_site()
+    start = time.perf_counter()
+    if latency > 0:
+        time.sleep(latency)
+    with _lock:
+        calls.append({'kind': kind, 'detail': detail, 'site': site, 'thread': threading.current_thread().name,
+                      'start': start, 'latency': latency})
+
+
+def Initialize(credentials=None, opt_url=None, project=None, **kwargs):
+    """
+    Starts the fake session. geemap is replaced by a module whose ee_export_image writes
+    the fake images, since the real one would ask the server for a download URL.
+    """
+    sys.modules['geemap'] = geemap
+
+
+def Authenticate(**kwargs):
+    pass
+
+
+def __getattr__(name):
+    raise AttributeError(f"fake_ee does not implement ee.{name}")
+
+
+# --------------------------------------------------------------------------- synthetic world
+
+def _bilinear(coarse, rows, cols):
+    """Upsamples a coarse grid to (rows, cols) by bilinear interpolation."""
+    cy,cx = coarse.shape
+    y = np.linspace(0, cy - 1, rows)
+    x = np.linspace(0, cx - 1, cols)
+    y0 = np.minimum(y.astype(int), cy - 2)
+    x0 = np.minimum(x.astype(int), cx - 2)
+    fy = (y - y0)[:, None]
+    fx = (x - x0)[None, :]
+    top = coarse[np.ix_(y0, x0)] * (1 - fx) + coarse[np.ix_(y0, x0 + 1)] * fx
+    bottom = coarse[np.ix_(y0 + 1, x0)] * (1 - fx) + coarse[np.ix_(y0 + 1, x0 + 1)] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+class World:
+    """
+    Synthetic data on a regular lon/lat grid, the same for the same seed whatever is read first.
+
+    Attributes:
+        bounds (tuple): (west, south, east, north) in degrees; outside, every image is masked.
+        shape (tuple): (rows, cols) of the grid.
+        seed (int): Seed of all the data.
+        rain_probability (float): Share of rainy days.
+        cloud_cover (float): Share of each MODIS image under clouds.
+        flood_depth_per_mm (float): Metres of water level per mm of rain over the last three days.
+        assets (dict): Images exported with Export.image.toAsset, by asset ID.
+    """
+    def __init__(self, bounds=(113.5, 22.2, 114.9, 23.0), shape=None, seed=None, rain_probability=0.35,
+                 cloud_cover=0.15, flood_depth_per_mm=0.1):
+        if shape is None:
+            shape = tuple(int(n) for n in os.environ.get('FAKE_EE_SHAPE', '80,140').split(','))
+        self.bounds = tuple(float(v) for v in bounds)
+        self.shape = tuple(shape)
+        self.seed = int(os.environ.get('FAKE_EE_SEED', 0)) if seed is None else seed
+        self.rain_probability = rain_probability
+        self.cloud_cover = cloud_cover
+        self.flood_depth_per_mm = flood_depth_per_mm
+        self.assets = {}
+        self.tasks = []
+        west,south,east,north = self.bounds
+        rows,cols = self.shape
+        self.dx = (east - west) / cols
+        self.dy = (north - south) / rows
+        self.lon = west + (np.arange(cols) + 0.5) * self.dx
+        self.lat = north - (np.arange(rows) + 0.5) * self.dy
+        self._rain_day = lru_cache(maxsize=64)(self._rain_day)
+        self._flood_level = lru_cache(maxsize=64)(self._flood_level)
+        self._static = None
+
+    def rng(self, *key):
+        """A generator seeded from the world seed and the key, e.g. ('rain', day)."""
+        return np.random.default_rng([self.seed] + [zlib.crc32(k.encode()) if isinstance(k, str) else int(k) for k in key])
+
+    def fraction_rect(self, west, south, east, north):
+        """A rectangle given as fractions of the world bounds."""
+        w,s,e,n = self.bounds
+        return (w + west * (e - w), s + south * (n - s), w + east * (e - w), s + north * (n - s))
+
+    # ---- static layers
+
+    def static(self):
+        """The layers that do not change: water rectangles, permanent water, elevation and pixel size."""
+        if self._static is not None:
+            return self._static
+        rows,cols = self.shape
+        rng = self.rng('static')
+        # A river of rectangular segments meandering west to east, and a reservoir
+        water_rects = []
+        segments = 24
+        for i in range(segments):
+            centre = 0.5 + 0.08 * np.sin(2 * np.pi * 1.5 * (i + 0.5) / segments)
+            water_rects.append(self.fraction_rect(i / segments, centre - 0.012, (i + 1) / segments, centre + 0.012))
+        water_rects.append(self.fraction_rect(0.62, 0.2, 0.7, 0.28))
+        permanent = Geometry._rects_mask(water_rects, self.lon, self.lat)
+        # Distance to the river in km, then elevation rising from it with noise and hills
+        pixel_km = self.dx * METRES_PER_DEGREE / 1000 * np.cos(np.radians(np.mean(self.lat)))
+        fraction_x = (np.arange(cols) + 0.5) / cols
+        river_row = (1 - (0.5 + 0.08 * np.sin(2 * np.pi * 1.5 * fraction_x))) * rows
+        distance_km = np.abs(np.arange(rows)[:, None] + 0.5 - river_row[None, :]) * self.dy / self.dx * pixel_km
+        elevation = 1 + 4 * distance_km + 15 * _bilinear(rng.random((7, 9)), rows, cols)
+        yy,xx = np.mgrid[0:rows, 0:cols]
+        for _ in range(3):
+            cy,cx = rng.uniform(0.1, 0.9) * rows,rng.uniform(0.1, 0.9) * cols
+            sigma = rng.uniform(3, 6) / pixel_km
+            elevation += rng.uniform(300, 600) * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * sigma ** 2))
+        elevation[permanent] = 0
+        self._static = {'water_rects': water_rects, 'permanent': permanent, 'elevation': elevation, 'pixel_km': pixel_km}
+        return self._static
+
+    # ---- rain and floods
+
+    def _rain_day(self, ordinal):
+        """Total rain (mm) of the day per pixel and the share of it in each half hour."""
+        rows,cols = self.shape
+        # Rainy days come in spells: the weather of a day is averaged with its neighbours
+        wetness = sum(self.rng('weather', day).standard_normal() for day in (ordinal - 1, ordinal, ordinal + 1)) / np.sqrt(3)
+        rng = self.rng('rain', ordinal)
+        rainy = wetness > NormalDist().inv_cdf(1 - self.rain_probability)
+        total = rng.gamma(2, 25) if rainy else rng.exponential(0.5)
+        field = 0.3 + 1.4 * _bilinear(rng.random((5, 5)), rows, cols)
+        steps = np.arange(48)
+        profile = np.exp(-0.5 * ((steps - rng.uniform(6, 42)) / rng.uniform(3, 8)) ** 2)
+        return total * field,profile / profile.sum()
+
+    def _flood_level(self, ordinal):
+        """Water level (m) of the day, from the rain of the last three days."""
+        rain = sum(self._rain_day(day)[0].mean() for day in (ordinal - 2, ordinal - 1, ordinal))
+        return self.flood_depth_per_mm * rain
+
+    def imerg(self, time_start):
+        day = datetime(time_start.year, time_start.month, time_start.day)
+        total,profile = self._rain_day(day.toordinal())
+        step = int((time_start - day).total_seconds() // 1800)
+        # precipitationCal is a rate in mm/hr over the half hour
+        return [2 * total * profile[step]]
+
+    def modis(self, product, time_start):
+        rows,cols = self.shape
+        static = self.static()
+        ordinal = time_start.toordinal()
+        water = static['permanent'] | (static['elevation'] < self._flood_level(ordinal))
+        satellite = product[:3]
+        clouds = _bilinear(self.rng('cloud', satellite, ordinal).random((6, 6)), rows, cols)
+        cloudy = clouds > np.quantile(clouds, 1 - self.cloud_cover)
+        rng = self.rng(product, ordinal)
+        def band(water_value, land_value, cloud_value, noise):
+            values = np.where(water, water_value, land_value) + rng.normal(0, noise, self.shape)
+            return np.round(np.where(cloudy, cloud_value, values))
+        if product.endswith('GQ'):
+            return [band(400, 700, 4000, 60), band(250, 2800, 4200, 150)]
+        return [band(400, 700, 4000, 60), band(500, 500, 4100, 40), band(700, 800, 4100, 40),
+                band(80, 1600, 2800, 200), cloudy.astype(np.float64)]
+
+    def jrc(self, year):
+        static = self.static()
+        water_class = np.where(static['elevation'] < 2, 2.0, 1.0)
+        water_class[static['permanent']] = 3
+        return [water_class]
+
+    # ---- catalogue
+
+    def collection_times(self, dataset, start, end):
+        """
+        Returns:
+            list: (time_start, properties) of the images of the dataset in [start, end).
+        """
+        if dataset == 'JRC/GSW1_4/YearlyHistory':
+            years = range(1984, 2022)
+            return [(datetime(year, 1, 1), {'year': year}) for year in years
+                    if (start is None or datetime(year, 1, 1) >= start) and (end is None or datetime(year, 1, 1) < end)]
+        if start is None or end is None:
+            raise EEException(f"Collection query aborted after accumulating over 5000 elements ({dataset} without filterDate)")
+        if dataset == 'NASA/GPM_L3/IMERG_V06':
+            first = start + timedelta(seconds=-(start - EPOCH).total_seconds() % 1800)
+            steps = max(0, int(np.ceil((end - first).total_seconds() / 1800)))
+            return [(first + timedelta(minutes=30 * i), {}) for i in range(steps)]
+        # MODIS: one image per day and satellite, Terra in the morning and Aqua in the afternoon
+        hour = 10.5 if '/MOD' in dataset else 13.5
+        day = datetime(start.year, start.month, start.day)
+        times = []
+        while day < end:
+            time_start = day + timedelta(hours=hour)
+            if start <= time_start < end:
+                times.append((time_start, {}))
+            day += timedelta(days=1)
+        return times
+
+
+# Images and collections of the catalogue: band names, nominal scale (m) and generator
+COLLECTIONS = {
+    'NASA/GPM_L3/IMERG_V06': (['precipitationCal'], 11132.0, lambda world,t: world.imerg(t)),
+    'MODIS/006/MOD09GQ': (['sur_refl_b01', 'sur_refl_b02'], 231.656, lambda world,t: world.modis('MOD09GQ', t)),
+    'MODIS/006/MYD09GQ': (['sur_refl_b01', 'sur_refl_b02'], 231.656, lambda world,t: world.modis('MYD09GQ', t)),
+    'MODIS/006/MOD09GA': (['sur_refl_b01', 'sur_refl_b03', 'sur_refl_b04', 'sur_refl_b07', 'state_1km'], 463.313,
+                          lambda world,t: world.modis('MOD09GA', t)),
+    'MODIS/006/MYD09GA': (['sur_refl_b01', 'sur_refl_b03', 'sur_refl_b04', 'sur_refl_b07', 'state_1km'], 463.313,
+                          lambda world,t: world.modis('MYD09GA', t)),
+    'JRC/GSW1_4/YearlyHistory': (['waterClass'], 30.0, lambda world,t: world.jrc(t.year)),
+}
+IMAGES = {
+    'JAXA/ALOS/AW3D30_V1_1': (['AVE'], 30.0, lambda world: [world.static()['elevation']]),
+}
+GAUL_LEVEL2 = ('FAO/GAUL/2015/level2', 'FAO/GAUL_SIMPLIFIED_500m/2015/level2')
+# Level-2 units as fractions of the world bounds, Shenzhen where the example scripts expect it
+GAUL_UNITS = [
+    ((0.18, 0.31, 0.8, 0.84), {'ADM0_CODE': 53, 'ADM0_NAME': 'China', 'ADM1_CODE': 899, 'ADM1_NAME': 'Guangdong', 'ADM2_CODE': 13060, 'ADM2_NAME': 'Shenzhen'}),
+    ((0.0, 0.84, 0.55, 1.0), {'ADM0_CODE': 53, 'ADM0_NAME': 'China', 'ADM1_CODE': 899, 'ADM1_NAME': 'Guangdong', 'ADM2_CODE': 13041, 'ADM2_NAME': 'Dongguan'}),
+    ((0.55, 0.84, 1.0, 1.0), {'ADM0_CODE': 53, 'ADM0_NAME': 'China', 'ADM1_CODE': 899, 'ADM1_NAME': 'Guangdong', 'ADM2_CODE': 13046, 'ADM2_NAME': 'Huizhou'}),
+    ((0.2, 0.0, 0.8, 0.31), {'ADM0_CODE': 33364, 'ADM0_NAME': 'Hong Kong', 'ADM1_CODE': 1089, 'ADM1_NAME': 'Hong Kong', 'ADM2_CODE': 33365, 'ADM2_NAME': 'Hong Kong'}),
+]
+
+
+def world():
+    """The active World, created with the defaults on first use."""
+    global _world
+    if _world is None:
+        _world = World()
+    return _world
+
+
+class _ArrayCache:
+    """Computed image bands by image key, the least recently used dropped beyond cache_mb."""
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            arrays = self.entries.get(key)
+            if arrays is not None:
+                self.entries.move_to_end(key)
+            return arrays
+
+    def put(self, key, arrays):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = arrays
+            self.size += sum(array.nbytes for array in arrays)
+            while self.size > settings['cache_mb'] * 2 ** 20 and len(self.entries) > 1:
+                _,dropped = self.entries.popitem(last=False)
+                self.size -= sum(array.nbytes for array in dropped)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_arrays = _ArrayCache()
+
+
+# --------------------------------------------------------------------------- values
+
+def _value(x):
+    """Unwraps computed objects to their Python value."""
+    while type(x) in _COMPUTED:
+        x = x._value
+    return x
+
+
+def _wrap(x):
+    """Wraps a Python value in the matching computed object."""
+    if isinstance(x, (ComputedObject, Image, Collection, Geometry, Feature)):
+        return x
+    if isinstance(x, (bool, int, float, np.number)):
+        return Number(x)
+    if isinstance(x, str):
+        return String(x)
+    if isinstance(x, (list, tuple)):
+        return List(x)
+    if isinstance(x, dict):
+        return Dictionary(x)
+    return ComputedObject(x)
+
+
+def _info(x):
+    """The JSON-like value of an object, as getInfo returns it."""
+    if isinstance(x, ComputedObject):
+        return _info(x._value)
+    if isinstance(x, (Image, Collection, Geometry, Feature, Date)):
+        return x._info()
+    if isinstance(x, dict):
+        return {str(key): _info(value) for key,value in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [_info(value) for value in x]
+    if isinstance(x, np.ndarray):
+        return _info(x.tolist())
+    if isinstance(x, np.integer):
+        return int(x)
+    if isinstance(x, np.floating):
+        return float(x)
+    return x
+
+
+def _number(x):
+    value = x._value if type(x) is Number else _value(x)
+    if value is None or not isinstance(value, (bool, int, float, np.number)):
+        raise EEException(f"Number: Invalid type. Expected type: Number. Actual value: {value!r}")
+    return value
+
+
+class ComputedObject:
+    """A value computed at once; getInfo counts as a round trip."""
+    def __init__(self, value=None):
+        self._value = _value(value)
+
+    def getInfo(self):
+        _round_trip('getInfo', type(self).__name__)
+        return _info(self._value)
+
+    def __repr__(self):
+        return f"ee.{type(self).__name__}({self._value!r})"
+
+
+def _binary_number(fn):
+    def method(self, right):
+        return Number(fn(_number(self), _number(right)))
+    return method
+
+
+def _divide(a, b):
+    # Like the server, division by 0 gives 0
+    return a / b if b != 0 else 0
+
+
+class Number(ComputedObject):
+    def __init__(self, number):
+        super().__init__(number)
+
+    add = _binary_number(lambda a,b: a + b)
+    subtract = _binary_number(lambda a,b: a - b)
+    multiply = _binary_number(lambda a,b: a * b)
+    divide = _binary_number(_divide)
+    pow = _binary_number(lambda a,b: a ** b)
+    mod = _binary_number(lambda a,b: a % b)
+    min = _binary_number(min)
+    max = _binary_number(max)
+    gt = _binary_number(lambda a,b: int(a > b))
+    gte = _binary_number(lambda a,b: int(a >= b))
+    lt = _binary_number(lambda a,b: int(a < b))
+    lte = _binary_number(lambda a,b: int(a <= b))
+    eq = _binary_number(lambda a,b: int(a == b))
+    neq = _binary_number(lambda a,b: int(a != b))
+    And = _binary_number(lambda a,b: int(bool(a) and bool(b)))
+    Or = _binary_number(lambda a,b: int(bool(a) or bool(b)))
+
+    def Not(self):
+        return Number(int(not _number(self)))
+
+    def abs(self):
+        return Number(abs(_number(self)))
+
+    def round(self):
+        return Number(round(_number(self)))
+
+    def int(self):
+        return Number(int(_number(self)))
+
+    def toInt(self):
+        return self.int()
+
+    def float(self):
+        return Number(float(_number(self)))
+
+    def sqrt(self):
+        return Number(float(np.sqrt(_number(self))))
+
+
+class String(ComputedObject):
+    def __init__(self, string):
+        super().__init__(string)
+
+    def cat(self, string2):
+        return String(_value(self) + _value(string2))
+
+    def length(self):
+        return Number(len(_value(self)))
+
+
+class List(ComputedObject):
+    def __init__(self, list):
+        super().__init__([_value(item) if not isinstance(_value(item), (Image, Collection)) else _value(item) for item in _value(list)])
+
+    @staticmethod
+    def sequence(start, end=None, step=None, count=None):
+        start = _number(start)
+        step = 1 if step is None else _number(step)
+        if count is not None:
+            values = [start + i * step for i in range(int(_number(count)))]
+        else:
+            end = _number(end)
+            values = [start + i * step for i in range(int(np.floor((end - start) / step)) + 1)] if (end - start) * step >= 0 else []
+        if float(start).is_integer() and float(step).is_integer():
+            values = [int(value) for value in values]
+        return List(values)
+
+    def map(self, baseAlgorithm, dropNulls=False):
+        results = [baseAlgorithm(_wrap(item)) for item in self._value]
+        return List([result for result in results if not (dropNulls and _value(result) is None)])
+
+    def get(self, index):
+        return _wrap(self._value[int(_number(index))])
+
+    def size(self):
+        return Number(len(self._value))
+
+    length = size
+
+    def add(self, element):
+        return List(self._value + [_value(element)])
+
+    def slice(self, start, end=None, step=None):
+        return List(self._value[int(_number(start)):None if end is None else int(_number(end)):None if step is None else int(_number(step))])
+
+    def reduce(self, reducer):
+        return _wrap(reducer._region(np.asarray([_number(item) for item in self._value], dtype=np.float64))[0])
+
+
+class Dictionary(ComputedObject):
+    def __init__(self, dict=None):
+        value = _value(dict) or {}
+        super().__init__({str(_value(key)): value for key,value in value.items()})
+
+    @staticmethod
+    def fromLists(keys, values):
+        return Dictionary(dict(zip([_value(key) for key in _value(keys)], _value(values))))
+
+    def get(self, key, defaultValue=None):
+        key = _value(key)
+        if key not in self._value:
+            if defaultValue is None:
+                raise EEException(f"Dictionary.get: Dictionary does not contain key: {key}")
+            return _wrap(defaultValue)
+        return _wrap(self._value[key])
+
+    def keys(self):
+        return List(sorted(self._value))
+
+    def values(self, keys=None):
+        return List([self._value[key] for key in (_value(keys) if keys is not None else sorted(self._value))])
+
+    def set(self, key, value):
+        return Dictionary({**self._value, _value(key): value})
+
+    def contains(self, key):
+        return Number(int(_value(key) in self._value))
+
+    def size(self):
+        return Number(len(self._value))
+
+    def combine(self, second, overwrite=True):
+        second = _value(second)
+        return Dictionary({**self._value, **second} if overwrite else {**second, **self._value})
+
+    def toImage(self, names=None):
+        names = [_value(name) for name in _value(names)] if names is not None else sorted(self._value)
+        return Image.cat(*[Image.constant(_number(self._value[name])).rename(name) for name in names])
+
+
+class Array(ComputedObject):
+    def __init__(self, values, pixelType=None):
+        values = _value(values)
+        if isinstance(values, list):
+            values = [_value(v) for v in values]
+        self._value = np.asarray(values, dtype=np.float64)
+
+    def _other(self, right):
+        right = _value(right)
+        return right if isinstance(right, np.ndarray) else np.float64(_number(right))
+
+    def add(self, right):
+        return Array(self._value + self._other(right))
+
+    def subtract(self, right):
+        return Array(self._value - self._other(right))
+
+    def multiply(self, right):
+        return Array(self._value * self._other(right))
+
+    def divide(self, right):
+        right = self._other(right)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return Array(np.where(right != 0, self._value / right, 0.0))
+
+    def length(self):
+        return Array(list(self._value.shape))
+
+    def get(self, position):
+        return Number(_info(self._value[tuple(int(_number(p)) for p in _value(position))]))
+
+    def slice(self, axis=0, start=0, end=None, step=1):
+        index = [slice(None)] * self._value.ndim
+        index[int(_number(axis))] = slice(int(_number(start)), None if end is None else int(_number(end)), int(_number(step)))
+        return Array(self._value[tuple(index)])
+
+    def reduce(self, reducer, axes, fieldAxis=None):
+        axis = int(_number(_value(axes)[0]))
+        if self._value.ndim == 1:
+            return Array(np.array([reducer._region(self._value)[0]]))
+        result = np.apply_along_axis(lambda values: reducer._region(values)[0], axis, self._value)
+        return Array(np.expand_dims(result, axis))
+
+    def sort(self, keys=None):
+        order = np.argsort(np.asarray([_number(k) for k in _value(keys)]) if keys is not None else self._value, kind='stable')
+        return Array(self._value[order])
+
+    def toList(self):
+        return List(self._value.tolist())
+
+
+# Types unwrapped by _value
+_COMPUTED = {ComputedObject, Number, String, List, Dictionary, Array}
+
+
+# --------------------------------------------------------------------------- dates
+
+_JODA = {'YYYY': '%Y', 'yyyy': '%Y', 'YY': '%y', 'yy': '%y', 'MM': '%m', 'dd': '%d', 'DDD': '%j', 'HH': '%H', 'mm': '%M', 'ss': '%S'}
+
+
+def _to_datetime(x):
+    x = _value(x)
+    if isinstance(x, Date):
+        return x._datetime
+    if isinstance(x, datetime):
+        return x.replace(tzinfo=None)
+    if isinstance(x, (int, float, np.number)):
+        return EPOCH + timedelta(milliseconds=float(x))
+    if isinstance(x, str):
+        return datetime.fromisoformat(x.replace('Z', ''))
+    raise EEException(f"Date: Invalid type {type(x).__name__}")
+
+
+def _advance(moment, delta, unit):
+    if unit in ('year', 'month'):
+        months = int(delta) * (12 if unit == 'year' else 1)
+        month = moment.month - 1 + months
+        year = moment.year + month // 12
+        day = min(moment.day, calendar.monthrange(year, month % 12 + 1)[1])
+        return moment.replace(year=year, month=month % 12 + 1, day=day)
+    seconds = {'week': 604800, 'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}[unit]
+    return moment + timedelta(seconds=delta * seconds)
+
+
+def _millis(moment):
+    return int(round((moment - EPOCH).total_seconds() * 1000))
+
+
+class Date:
+    def __init__(self, date, tz=None):
+        self._datetime = _to_datetime(date)
+
+    def advance(self, delta, unit, timeZone=None):
+        return Date(_advance(self._datetime, _number(delta), unit))
+
+    def difference(self, start, unit):
+        seconds = (self._datetime - _to_datetime(start)).total_seconds()
+        return Number(seconds / {'year': 365.25 * 86400, 'month': 30.4375 * 86400, 'week': 604800, 'day': 86400,
+                                 'hour': 3600, 'minute': 60, 'second': 1}[unit])
+
+    def format(self, format=None, timeZone=None):
+        if format is None:
+            return String(self._datetime.strftime('%Y-%m-%dT%H:%M:%S'))
+        return String(self._datetime.strftime(re.sub('|'.join(_JODA), lambda m: _JODA[m.group(0)], format)))
+
+    def getRange(self, unit):
+        start = self._datetime
+        if unit == 'year':
+            start = datetime(start.year, 1, 1)
+        elif unit == 'month':
+            start = datetime(start.year, start.month, 1)
+        elif unit == 'week':
+            start = datetime(start.year, start.month, start.day) - timedelta(days=start.weekday())
+        else:
+            start = start.replace(microsecond=0, second=0 if unit != 'second' else start.second,
+                                  minute=start.minute if unit in ('minute', 'second') else 0,
+                                  hour=start.hour if unit in ('hour', 'minute', 'second') else 0)
+        return DateRange(start, _advance(start, 1, unit))
+
+    def millis(self):
+        return Number(_millis(self._datetime))
+
+    def get(self, unit):
+        return Number(getattr(self._datetime, unit))
+
+    def getInfo(self):
+        _round_trip('getInfo', 'Date')
+        return self._info()
+
+    def _info(self):
+        return {'type': 'Date', 'value': _millis(self._datetime)}
+
+    def __repr__(self):
+        return f"ee.Date('{self._datetime.isoformat()}')"
+
+
+class DateRange:
+    def __init__(self, start, end=None, timeZone=None):
+        if isinstance(start, DateRange):
+            start,end = start._start,start._end
+        self._start = _to_datetime(start)
+        self._end = _to_datetime(end) if end is not None else self._start + timedelta(milliseconds=1)
+
+    def start(self):
+        return Date(self._start)
+
+    def end(self):
+        return Date(self._end)
+
+
+# --------------------------------------------------------------------------- geometries and filters
+
+def _bounds_of(coordinates):
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+
+class Geometry:
+    """A union of lon/lat rectangles; polygons are reduced to their bounding boxes."""
+    def __init__(self, geoJson=None, proj=None, geodesic=None, evenOdd=None):
+        if isinstance(geoJson, Geometry):
+            self._rects = list(geoJson._rects)
+            return
+        geoJson = _value(geoJson) or {'type': 'Polygon', 'coordinates': []}
+        coordinates = _info(geoJson['coordinates'])
+        if geoJson['type'] == 'MultiPolygon':
+            self._rects = [_bounds_of(polygon) for polygon in coordinates]
+        else:
+            self._rects = [_bounds_of(coordinates)] if len(coordinates) else []
+
+    @staticmethod
+    def _from_rects(rects):
+        geometry = Geometry.__new__(Geometry)
+        geometry._rects = [tuple(float(v) for v in rect) for rect in rects]
+        return geometry
+
+    @staticmethod
+    def Rectangle(coords, proj=None, geodesic=None, evenOdd=None):
+        coords = [_number(c) if not isinstance(_value(c), list) else [_number(v) for v in _value(c)] for c in _value(coords)]
+        return Geometry._from_rects([_bounds_of(coords)])
+
+    @staticmethod
+    def BBox(west, south, east, north):
+        return Geometry._from_rects([(_number(west), _number(south), _number(east), _number(north))])
+
+    @staticmethod
+    def Point(coords, proj=None):
+        lon,lat = (_number(c) for c in _value(coords))
+        return Geometry._from_rects([(lon, lat, lon, lat)])
+
+    @staticmethod
+    def Polygon(coords, proj=None, geodesic=None, maxError=None, evenOdd=None):
+        return Geometry._from_rects([_bounds_of(_info(coords))])
+
+    @staticmethod
+    def _rects_mask(rects, lon, lat):
+        mask = np.zeros((len(lat), len(lon)), dtype=bool)
+        for west,south,east,north in rects:
+            mask |= ((lat >= south) & (lat <= north))[:, None] & ((lon >= west) & (lon <= east))[None, :]
+        return mask
+
+    def _mask(self, lon, lat):
+        return Geometry._rects_mask(self._rects, lon, lat)
+
+    def _bounds(self):
+        if not self._rects:
+            return None
+        rects = np.asarray(self._rects)
+        return (rects[:, 0].min(), rects[:, 1].min(), rects[:, 2].max(), rects[:, 3].max())
+
+    def geometry(self):
+        return self
+
+    def bounds(self, maxError=None, proj=None):
+        return Geometry._from_rects([self._bounds()] if self._rects else [])
+
+    def buffer(self, distance, maxError=None, proj=None):
+        degrees = _number(distance) / METRES_PER_DEGREE
+        return Geometry._from_rects([(w - degrees, s - degrees, e + degrees, n + degrees) for w,s,e,n in self._rects])
+
+    def area(self, maxError=None, proj=None):
+        return Number(sum((e - w) * METRES_PER_DEGREE * np.cos(np.radians((s + n) / 2)) * (n - s) * METRES_PER_DEGREE
+                          for w,s,e,n in self._rects))
+
+    def coordinates(self):
+        return List(self._info()['coordinates'])
+
+    def getInfo(self):
+        _round_trip('getInfo', 'Geometry')
+        return self._info()
+
+    def _info(self):
+        rings = [[[[w, s], [e, s], [e, n], [w, n], [w, s]]] for w,s,e,n in self._rects]
+        if len(rings) == 1:
+            return {'type': 'Polygon', 'coordinates': rings[0]}
+        return {'type': 'MultiPolygon', 'coordinates': rings}
+
+
+def _geometry(x):
+    """The geometry of a Geometry, Feature, FeatureCollection or [west, south, east, north] list."""
+    x = _value(x)
+    if isinstance(x, (Geometry, Feature, FeatureCollection)):
+        return x.geometry()
+    if isinstance(x, (list, tuple)):
+        return Geometry.Rectangle(x)
+    if isinstance(x, dict):
+        return Geometry(x)
+    raise EEException(f"Invalid geometry {x!r}")
+
+
+class Feature:
+    def __init__(self, geometry, properties=None):
+        if isinstance(geometry, Feature):
+            geometry,properties = geometry._geometry,geometry._props
+        self._geometry = _geometry(geometry) if geometry is not None else None
+        self._props = {key: _value(value) for key,value in (_value(properties) or {}).items()}
+
+    def geometry(self):
+        return self._geometry
+
+    def get(self, property):
+        return _wrap(self._props.get(_value(property)))
+
+    def set(self, *args):
+        props = _value(args[0]) if len(args) == 1 else {_value(args[0]): args[1]}
+        return Feature(self._geometry, {**self._props, **{key: _value(value) for key,value in props.items()}})
+
+    def getInfo(self):
+        _round_trip('getInfo', 'Feature')
+        return self._info()
+
+    def _info(self):
+        return {'type': 'Feature', 'geometry': self._geometry._info() if self._geometry else None, 'properties': _info(self._props)}
+
+
+_OPERATORS = {
+    'equals': lambda a,b: a == b, 'not_equals': lambda a,b: a != b,
+    'less_than': lambda a,b: a is not None and a < b, 'greater_than': lambda a,b: a is not None and a > b,
+    'not_less_than': lambda a,b: a is not None and a >= b, 'not_greater_than': lambda a,b: a is not None and a <= b,
+}
+
+
+class Filter:
+    """A test on the properties of an element, or of the two elements of a join."""
+    def __init__(self, test=None, date_range=None):
+        self._test = test or (lambda left,right=None: True)
+        self._date_range = date_range
+
+    @staticmethod
+    def _compare(operator, leftField=None, rightValue=None, rightField=None, leftValue=None):
+        def test(left, right=None):
+            a = left.get(leftField) if leftField is not None else _value(leftValue)
+            b = (right if right is not None else left).get(rightField) if rightField is not None else _value(rightValue)
+            return _OPERATORS[operator](a, b)
+        return Filter(test)
+
+    @staticmethod
+    def equals(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        return Filter._compare('equals', leftField, rightValue, rightField, leftValue)
+
+    @staticmethod
+    def eq(name, value):
+        return Filter._compare('equals', name, value)
+
+    @staticmethod
+    def neq(name, value):
+        return Filter._compare('not_equals', name, value)
+
+    @staticmethod
+    def lt(name, value):
+        return Filter._compare('less_than', name, value)
+
+    @staticmethod
+    def gt(name, value):
+        return Filter._compare('greater_than', name, value)
+
+    @staticmethod
+    def lte(name, value):
+        return Filter._compare('not_greater_than', name, value)
+
+    @staticmethod
+    def gte(name, value):
+        return Filter._compare('not_less_than', name, value)
+
+    @staticmethod
+    def inList(leftField=None, rightValue=None, rightField=None, leftValue=None):
+        values = [_value(v) for v in _value(rightValue)]
+        return Filter(lambda left,right=None: left.get(leftField) in values)
+
+    @staticmethod
+    def metadata(name, operator, value):
+        return Filter._compare(operator, name, value)
+
+    @staticmethod
+    def date(start, end=None):
+        date_range = DateRange(start, end)
+        start_ms,end_ms = _millis(date_range._start),_millis(date_range._end)
+        return Filter(lambda left,right=None: start_ms <= (left.get('system:time_start') or 0) < end_ms, date_range)
+
+    @staticmethod
+    def And(*filters):
+        return Filter(lambda left,right=None: all(f._test(left, right) for f in filters))
+
+    @staticmethod
+    def Or(*filters):
+        return Filter(lambda left,right=None: any(f._test(left, right) for f in filters))
+
+
+class Algorithms:
+    @staticmethod
+    def If(condition=None, trueCase=None, falseCase=None):
+        # Like the server, null, 0, false and empty strings or lists are false
+        return _wrap(trueCase if _info(condition) not in (None, 0, False, '', []) else falseCase)
+
+
+class Join:
+    def __init__(self, kind, primaryKey='primary', secondaryKey='secondary'):
+        self._kind = kind
+        self._keys = (primaryKey, secondaryKey)
+
+    @staticmethod
+    def inner(primaryKey='primary', secondaryKey='secondary', measureKey=None):
+        return Join('inner', primaryKey, secondaryKey)
+
+    def apply(self, primary, secondary, condition):
+        primary_key,secondary_key = self._keys
+        def elements():
+            pairs = []
+            for left in primary._list():
+                for right in secondary._list():
+                    if condition._test(left._props, right._props):
+                        pairs.append(Feature(None, {primary_key: left, secondary_key: right}))
+            return pairs
+        return FeatureCollection._make(elements)
+
+
+# --------------------------------------------------------------------------- reducers
+
+class Reducer:
+    """
+    A reduction of pixel values; _region reduces 1-D values to one value per output,
+    _pixels (single-output reducers) reduces a stack of images along its first axis.
+    Reducers of several inputs (repeat, group, toList) have _columns instead, which
+    reduces a sequence of rows, one value per input, to the result dictionary.
+    """
+    def __init__(self, outputs, region, pixels=None, columns=None):
+        self._outputs = outputs
+        self._region = region
+        self._pixels = pixels
+        self._columns = columns
+
+    @staticmethod
+    def mean():
+        return Reducer(['mean'], lambda v: [float(v.mean()) if v.size else None], lambda s: np.ma.mean(s, axis=0))
+
+    @staticmethod
+    def sum():
+        return Reducer(['sum'], lambda v: [float(v.sum())], lambda s: np.ma.sum(s, axis=0))
+
+    @staticmethod
+    def max():
+        return Reducer(['max'], lambda v: [float(v.max()) if v.size else None], lambda s: np.ma.max(s, axis=0))
+
+    @staticmethod
+    def min():
+        return Reducer(['min'], lambda v: [float(v.min()) if v.size else None], lambda s: np.ma.min(s, axis=0))
+
+    @staticmethod
+    def median(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer(['median'], lambda v: [float(np.median(v)) if v.size else None], lambda s: np.ma.median(s, axis=0))
+
+    @staticmethod
+    def count():
+        return Reducer(['count'], lambda v: [int(v.size)], lambda s: np.ma.array(s.count(axis=0).astype(np.float64)))
+
+    @staticmethod
+    def first():
+        def pixels(stack):
+            valid = ~np.ma.getmaskarray(stack)
+            index = np.argmax(valid, axis=0)
+            values = np.take_along_axis(stack.data, index[None], axis=0)[0]
+            return np.ma.array(values, mask=~valid.any(axis=0))
+        return Reducer(['first'], lambda v: [float(v[0]) if v.size else None], pixels)
+
+    @staticmethod
+    def minMax():
+        return Reducer(['min', 'max'], lambda v: [float(v.min()), float(v.max())] if v.size else [None, None])
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None, maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        percentiles = [_number(p) for p in _value(percentiles)]
+        names = [_value(name) for name in _value(outputNames)] if outputNames is not None else [f'p{p:g}' for p in percentiles]
+        return Reducer(names, lambda v: [float(np.percentile(v, p)) for p in percentiles] if v.size else [None] * len(percentiles))
+
+    @staticmethod
+    def histogram(maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        max_buckets = int(_number(maxBuckets)) if maxBuckets is not None else 255
+        def region(values):
+            if values.size == 0:
+                return [None]
+            low,high = float(values.min()),float(values.max())
+            if minBucketWidth is not None:
+                # Widths are the minimum width times a power of 2, like the server's
+                width = float(_number(minBucketWidth))
+                while (high - np.floor(low / width) * width) / width >= max_buckets:
+                    width *= 2
+            else:
+                width = (high - low) / max_buckets or 1.0
+            bucket_min = float(np.floor(low / width) * width)
+            index = np.minimum(((values - bucket_min) // width).astype(np.int64), int((high - bucket_min) // width))
+            counts = np.bincount(index)
+            sums = np.bincount(index, weights=values)
+            centres = bucket_min + (np.arange(len(counts)) + 0.5) * width
+            means = np.where(counts > 0, sums / np.maximum(counts, 1), centres)
+            return [{'bucketMin': bucket_min, 'bucketWidth': width, 'histogram': counts.astype(float).tolist(), 'bucketMeans': means.tolist()}]
+        return Reducer(['histogram'], region)
+
+    @staticmethod
+    def toList(tupleSize=None, numOptional=None):
+        return Reducer(['list'], lambda v: [v.tolist()],
+                       columns=lambda rows: {'list': [list(row) if tupleSize is not None else row[0] for row in rows]})
+
+    def combine(self, reducer2, outputPrefix='', sharedInputs=False):
+        return Reducer(self._outputs + [outputPrefix + name for name in reducer2._outputs],
+                       lambda v: self._region(v) + reducer2._region(v))
+
+    def unweighted(self):
+        # Pixels are never weighted here
+        return self
+
+    def repeat(self, count):
+        count = int(_number(count))
+        def columns(rows):
+            values = np.asarray(rows, dtype=np.float64).reshape(-1, count)
+            outputs = [self._region(values[:, i]) for i in range(count)]
+            return {name: [output[k] for output in outputs] for k,name in enumerate(self._outputs)}
+        return Reducer(self._outputs, None, columns=columns)
+
+    def group(self, groupField=0, groupName='group'):
+        field,name = int(_number(groupField)),_value(groupName)
+        inner = self._columns or (lambda rows: dict(zip(self._outputs, self._region(np.asarray(rows, dtype=np.float64)[:, 0]))))
+        def columns(rows):
+            rows = np.asarray(rows, dtype=np.float64).reshape(len(rows), -1)
+            keys,inputs = rows[:, field],np.delete(rows, field, axis=1)
+            return {'groups': [{name: key.item(), **inner(inputs[keys == key])} for key in np.unique(keys)]}
+        return Reducer(['groups'], None, columns=columns)
+
+
+# --------------------------------------------------------------------------- images
+
+_keys = iter(range(1, sys.maxsize))
+
+
+def _make_image(names, compute, props=None, scale=None, clips=()):
+    image = Image.__new__(Image)
+    image._names = list(names)
+    image._compute = compute
+    image._props = dict(props or {})
+    image._scale = scale
+    image._clips = tuple(clips)
+    image._key = next(_keys)
+    return image
+
+
+def _constant(value):
+    return np.ma.array(np.full(world().shape, float(value)), mask=np.zeros(world().shape, dtype=bool))
+
+
+def _as_image(x):
+    """Casts to an image like the Image constructor: images, numbers, asset IDs and lists of images."""
+    x = _value(x)
+    if isinstance(x, Image):
+        return x
+    if x is None:
+        return _make_image([], lambda: [])
+    if isinstance(x, (bool, int, float, np.number)):
+        return Image.constant(x)
+    if isinstance(x, (list, tuple)):
+        return Image.cat(*x)
+    if isinstance(x, str):
+        if x in world().assets:
+            return world().assets[x]
+        if x in IMAGES:
+            names,scale,generate = IMAGES[x]
+            current = world()
+            return _make_image(names, lambda: [np.ma.array(a, mask=np.zeros(a.shape, dtype=bool)) for a in generate(current)],
+                               {'system:id': x}, scale)
+        raise EEException(f"Image asset '{x}' not found.")
+    raise EEException(f"Image: Invalid argument {x!r}")
+
+
+def _bool_to_float(array):
+    return np.ma.array(np.asarray(array.filled(False), dtype=np.float64), mask=np.ma.getmaskarray(array))
+
+
+def _int_op(fn):
+    def op(a, b):
+        result = fn(a.filled(0).astype(np.int64), b.filled(0).astype(np.int64)).astype(np.float64)
+        return np.ma.array(result, mask=np.ma.getmaskarray(a) | np.ma.getmaskarray(b))
+    return op
+
+
+def _image_divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(b.data != 0, a.data / np.where(b.data != 0, b.data, 1), 0.0)
+    return np.ma.array(values, mask=np.ma.getmaskarray(a) | np.ma.getmaskarray(b))
+
+
+def _binary_image(fn):
+    def method(self, image2):
+        return self._binary(image2, fn)
+    return method
+
+
+class Image:
+    """
+    An image whose bands are computed on first use and kept in a shared cache.
+    Every band is a float64 masked array on the grid of the World.
+    """
+    def __init__(self, args=None, version=None):
+        self.__dict__.update(_as_image(args).__dict__)
+
+    def _derive(self, names, compute, props=None, clips=None):
+        return _make_image(names, compute, self._props if props is None else props, self._scale,
+                           self._clips if clips is None else clips)
+
+    def _arrays(self):
+        arrays = _arrays.get(self._key)
+        if arrays is None:
+            arrays = self._compute()
+            _arrays.put(self._key, arrays)
+        return arrays
+
+    # ---- bands
+
+    def bandNames(self):
+        return List(list(self._names))
+
+    def _band_index(self, selector):
+        selector = _value(selector)
+        if isinstance(selector, (int, np.integer)):
+            return [int(selector)]
+        matches = [i for i,name in enumerate(self._names) if re.fullmatch(selector, name)]
+        if not matches:
+            raise EEException(f"Image.select: Pattern '{selector}' did not match any bands.")
+        return matches
+
+    def select(self, *args, **kwargs):
+        selectors = kwargs.get('opt_selectors', kwargs.get('bandSelectors'))
+        names = kwargs.get('opt_names', kwargs.get('newNames'))
+        if selectors is None:
+            if len(args) == 2 and all(isinstance(_value(a), (list, tuple)) for a in args):
+                selectors,names = args
+            elif len(args) == 1 and isinstance(_value(args[0]), (list, tuple)):
+                selectors = args[0]
+            else:
+                selectors = list(args)
+        indices = [i for selector in _value(selectors) for i in self._band_index(selector)]
+        names = [_value(name) for name in _value(names)] if names is not None else [self._names[i] for i in indices]
+        return self._derive(names, lambda: [self._arrays()[i] for i in indices])
+
+    def rename(self, *names):
+        names = _value(names[0]) if len(names) == 1 and isinstance(_value(names[0]), (list, tuple)) else names
+        names = [_value(name) for name in names]
+        if len(names) != len(self._names):
+            raise EEException(f"Image.rename: Expected {len(self._names)} names, got {len(names)}.")
+        return self._derive(names, self._arrays)
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        source = _as_image(srcImg)
+        indices = list(range(len(source._names))) if names is None else \
+            [i for name in _value(names) for i in source._band_index(name)]
+        added = [source._names[i] for i in indices]
+        kept = [i for i,name in enumerate(self._names) if not (overwrite and name in added)]
+        result_names = [self._names[i] for i in kept]
+        for name in added:
+            # Duplicate names get a suffix, as on the server
+            unique,n = name,1
+            while unique in result_names:
+                unique,n = f'{name}_{n}',n + 1
+            result_names.append(unique)
+        return self._derive(result_names, lambda: [self._arrays()[i] for i in kept] + [source._arrays()[i] for i in indices])
+
+    @staticmethod
+    def cat(*images):
+        images = [_as_image(image) for image in images]
+        if not images:
+            return _as_image(None)
+        result = images[0]
+        for image in images[1:]:
+            result = result.addBands(image)
+        return result
+
+    @staticmethod
+    def constant(value):
+        values = _value(value)
+        if isinstance(values, (list, tuple)):
+            return Image.cat(*[Image.constant(v).rename(f'constant_{i}') for i,v in enumerate(values)])
+        number = _number(values)
+        return _make_image(['constant'], lambda: [_constant(number)])
+
+    @staticmethod
+    def pixelLonLat():
+        current = world()
+        def compute():
+            lon,lat = np.meshgrid(current.lon, current.lat)
+            return [np.ma.array(lon), np.ma.array(lat)]
+        return _make_image(['longitude', 'latitude'], compute)
+
+    # ---- pixel operations
+
+    def _binary(self, other, fn):
+        other = _as_image(other)
+        a,b = len(self._names),len(other._names)
+        if b == 1:
+            pairs,names = [(i, 0) for i in range(a)],self._names
+        elif a == 1:
+            pairs,names = [(0, j) for j in range(b)],other._names
+        elif a == b:
+            pairs,names = [(i, i) for i in range(a)],self._names
+        else:
+            raise EEException(f"Images must contain the same number of bands or only 1 band. Got {a} and {b}.")
+        return self._derive(names, lambda: [fn(self._arrays()[i], other._arrays()[j]) for i,j in pairs])
+
+    def _unary(self, fn):
+        return self._derive(self._names, lambda: [fn(array) for array in self._arrays()])
+
+    add = _binary_image(lambda a,b: a + b)
+    subtract = _binary_image(lambda a,b: a - b)
+    multiply = _binary_image(lambda a,b: a * b)
+    divide = _binary_image(_image_divide)
+    pow = _binary_image(lambda a,b: np.ma.power(a, b))
+    max = _binary_image(lambda a,b: np.ma.maximum(a, b))
+    min = _binary_image(lambda a,b: np.ma.minimum(a, b))
+    gt = _binary_image(lambda a,b: _bool_to_float(a > b))
+    gte = _binary_image(lambda a,b: _bool_to_float(a >= b))
+    lt = _binary_image(lambda a,b: _bool_to_float(a < b))
+    lte = _binary_image(lambda a,b: _bool_to_float(a <= b))
+    eq = _binary_image(lambda a,b: _bool_to_float(a == b))
+    neq = _binary_image(lambda a,b: _bool_to_float(a != b))
+    And = _binary_image(lambda a,b: _bool_to_float((a != 0) & (b != 0)))
+    Or = _binary_image(lambda a,b: _bool_to_float((a != 0) | (b != 0)))
+    bitwiseAnd = _binary_image(_int_op(np.bitwise_and))
+    bitwiseOr = _binary_image(_int_op(np.bitwise_or))
+    rightShift = _binary_image(_int_op(np.right_shift))
+    leftShift = _binary_image(_int_op(np.left_shift))
+
+    def Not(self):
+        return self._unary(lambda a: _bool_to_float(a == 0))
+
+    def abs(self):
+        return self._unary(np.ma.abs)
+
+    def sqrt(self):
+        return self._unary(np.ma.sqrt)
+
+    def log(self):
+        return self._unary(np.ma.log)
+
+    def exp(self):
+        return self._unary(np.ma.exp)
+
+    def round(self):
+        return self._unary(np.ma.round)
+
+    def floor(self):
+        return self._unary(np.ma.floor)
+
+    def float(self):
+        return self
+
+    toFloat = toDouble = double = float
+
+    def int(self):
+        return self._unary(np.ma.trunc)
+
+    toInt = uint8 = toUint8 = byte = toByte = int16 = toInt16 = int
+
+    def expression(self, expression, map=None):
+        """Evaluates an expression of b('name'), b(index), band variables, numbers, arithmetic, comparisons, || and &&."""
+        variables = {name: _as_image(image) for name,image in (_value(map) or {}).items()}
+        # || and && bind looser than comparisons, unlike | and & in Python
+        parts = re.split(r'(\|\||&&)', expression)
+        if len(parts) > 1:
+            expression = ''.join({'||': ' | ', '&&': ' & '}.get(part, f'({part})') for part in parts)
+        def compute():
+            arrays = self._arrays()
+            namespace = {
+                'b': lambda selector: arrays[self._band_index(selector)[0]],
+                'float': lambda x: x.astype(np.float64) if hasattr(x, 'astype') else float(x),
+                'int': lambda x: np.ma.trunc(x) if hasattr(x, 'astype') else int(x),
+                'abs': np.ma.abs, 'sqrt': np.ma.sqrt, 'log': np.ma.log, 'exp': np.ma.exp,
+            }
+            namespace.update({name: image._arrays()[0] for name,image in variables.items()})
+            result = eval(expression, {'__builtins__': {}}, namespace)
+            if np.ma.isMaskedArray(result) and result.dtype == bool:
+                result = _bool_to_float(result)
+            elif not np.ma.isMaskedArray(result):
+                result = _constant(result)
+            return [result.astype(np.float64)]
+        return self._derive(['constant'], compute)
+
+    def where(self, test, value):
+        test,value = _as_image(test),_as_image(value)
+        def compute():
+            t,v = test._arrays()[0],value._arrays()[0]
+            replace = (t.filled(0) != 0) & ~np.ma.getmaskarray(t) & ~np.ma.getmaskarray(v)
+            return [np.ma.array(np.where(replace, v.data, a.data), mask=np.ma.getmaskarray(a)) for a in self._arrays()]
+        return self._derive(self._names, compute)
+
+    def remap(self, from_, to, defaultValue=None, bandName=None):
+        lookup = dict(zip([_number(v) for v in _value(from_)], [_number(v) for v in _value(to)]))
+        def compute():
+            band = self._arrays()[0 if bandName is None else self._band_index(bandName)[0]]
+            data = band.filled(np.nan)
+            result = np.full(data.shape, np.nan if defaultValue is None else float(_number(defaultValue)))
+            for source,target in lookup.items():
+                result[data == source] = target
+            return [np.ma.array(result, mask=np.isnan(result) | np.ma.getmaskarray(band))]
+        return self._derive(['remapped'], compute)
+
+    # ---- masks
+
+    def updateMask(self, mask):
+        mask = _as_image(mask)
+        def compute():
+            masks = mask._arrays()
+            return [np.ma.array(a.data, mask=np.ma.getmaskarray(a) | np.ma.getmaskarray(masks[i if len(masks) > 1 else 0])
+                                | (masks[i if len(masks) > 1 else 0].filled(0) == 0))
+                    for i,a in enumerate(self._arrays())]
+        return self._derive(self._names, compute)
+
+    def mask(self, mask=None):
+        if mask is not None:
+            return self.updateMask(mask)
+        return self._unary(lambda a: np.ma.array((~np.ma.getmaskarray(a)).astype(np.float64)))
+
+    def selfMask(self):
+        return self._unary(lambda a: np.ma.array(a.data, mask=np.ma.getmaskarray(a) | (a.data == 0)))
+
+    def _footprint(self):
+        current = world()
+        mask = np.ones(current.shape, dtype=bool)
+        for geometry in self._clips:
+            mask &= geometry._mask(current.lon, current.lat)
+        return mask
+
+    def unmask(self, value=None, sameFootprint=True):
+        fill = _as_image(0 if value is None else value)
+        def compute():
+            outside = ~self._footprint() if sameFootprint else np.zeros(world().shape, dtype=bool)
+            values = fill._arrays()
+            return [np.ma.array(np.where(np.ma.getmaskarray(a), values[min(i, len(values) - 1)].filled(0), a.data), mask=outside)
+                    for i,a in enumerate(self._arrays())]
+        return self._derive(self._names, compute)
+
+    def clip(self, geometry):
+        geometry = _geometry(geometry)
+        def compute():
+            current = world()
+            outside = ~geometry._mask(current.lon, current.lat)
+            return [np.ma.array(a.data, mask=np.ma.getmaskarray(a) | outside) for a in self._arrays()]
+        return self._derive(self._names, compute, clips=self._clips + (geometry,))
+
+    # ---- reductions
+
+    def reduce(self, reducer):
+        if reducer._pixels is None:
+            raise EEException("Image.reduce: only reducers with one output are supported")
+        return self._derive(reducer._outputs, lambda: [reducer._pixels(np.ma.stack(self._arrays()))])
+
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None, bestEffort=False,
+                     maxPixels=None, tileScale=1):
+        rows,cols,inside = _window(geometry, scale)
+        if reducer._columns is not None:
+            # One row per pixel unmasked in every band
+            bands = [array[np.ix_(rows, cols)] for array in self._arrays()]
+            valid = inside & ~np.any([np.ma.getmaskarray(band) for band in bands], axis=0)
+            return Dictionary(reducer._columns(np.stack([np.asarray(band.data, dtype=np.float64)[valid] for band in bands], axis=1)))
+        result = {}
+        for name,array in zip(self._names, self._arrays()):
+            band = array[np.ix_(rows, cols)]
+            values = np.asarray(band.data, dtype=np.float64)[~np.ma.getmaskarray(band) & inside]
+            outputs = reducer._region(values)
+            if len(reducer._outputs) == 1:
+                result[name] = outputs[0]
+            else:
+                result.update({f'{name}_{output}': value for output,value in zip(reducer._outputs, outputs)})
+        return Dictionary(result)
+
+    # ---- properties
+
+    def set(self, *args):
+        props = _value(args[0]) if len(args) == 1 else {_value(args[0]): args[1]}
+        updated = {**self._props, **{_value(key): _value(value) for key,value in props.items()}}
+        return self._derive(self._names, self._arrays, updated)
+
+    def get(self, property):
+        return _wrap(self._props.get(_value(property)))
+
+    def copyProperties(self, source=None, properties=None, exclude=None):
+        props = {key: value for key,value in _as_image(source)._props.items()
+                 if (properties is None or key in _value(properties)) and key not in (_value(exclude) or [])}
+        return self._derive(self._names, self._arrays, {**self._props, **props})
+
+    def date(self):
+        return Date(self._props['system:time_start'])
+
+    def projection(self):
+        return Projection(self._scale)
+
+    def getInfo(self):
+        _round_trip('getInfo', 'Image')
+        return self._info()
+
+    def _info(self):
+        return {'type': 'Image', 'bands': [{'id': name, 'data_type': {'type': 'PixelType', 'precision': 'double'}} for name in self._names],
+                'properties': _info(self._props)}
+
+    def __repr__(self):
+        return f"ee.Image({self._names})"
+
+
+class Projection:
+    def __init__(self, scale):
+        self._scale = scale
+
+    def nominalScale(self):
+        return Number(self._scale if self._scale is not None else world().dx * METRES_PER_DEGREE)
+
+
+class Terrain:
+    @staticmethod
+    def slope(input):
+        elevation = _as_image(input)
+        def compute():
+            current = world()
+            band = elevation._arrays()[0]
+            dx = current.dx * METRES_PER_DEGREE * np.cos(np.radians(current.lat))[:, None]
+            dy = current.dy * METRES_PER_DEGREE
+            grad_y,grad_x = np.gradient(band.filled(0))
+            slope = np.degrees(np.arctan(np.hypot(grad_x / dx, grad_y / dy)))
+            return [np.ma.array(slope, mask=np.ma.getmaskarray(band))]
+        return elevation._derive(['slope'], compute)
+
+
+def _window(geometry, scale):
+    """Rows and columns of the grid a reduction reads, and which of those pixels are inside the geometry."""
+    current = world()
+    rows,cols = current.shape
+    geometry = _geometry(geometry) if geometry is not None else None
+    stride = max(1, int(round(_number(scale) / METRES_PER_DEGREE / current.dx))) if scale is not None else 1
+    bounds = geometry._bounds() if geometry is not None else None
+    if bounds is None:
+        row_index,col_index = np.arange(0, rows, stride),np.arange(0, cols, stride)
+    else:
+        west,south,east,north = bounds
+        c0 = max(0, int(np.floor((west - current.bounds[0]) / current.dx)))
+        c1 = min(cols, int(np.ceil((east - current.bounds[0]) / current.dx)))
+        r0 = max(0, int(np.floor((current.bounds[3] - north) / current.dy)))
+        r1 = min(rows, int(np.ceil((current.bounds[3] - south) / current.dy)))
+        row_index,col_index = np.arange(r0, max(r0, r1), stride),np.arange(c0, max(c0, c1), stride)
+    if geometry is None:
+        inside = np.ones((len(row_index), len(col_index)), dtype=bool)
+    else:
+        inside = geometry._mask(current.lon[col_index], current.lat[row_index])
+    return row_index,col_index,inside
+
+
+# --------------------------------------------------------------------------- collections
+
+class Collection:
+    """Elements computed on first use; map and the filters are applied lazily."""
+    @classmethod
+    def _make(cls, elements, props=None, dataset=None, date_range=None):
+        collection = cls.__new__(cls)
+        collection._elements = elements
+        collection._cache = None
+        collection._props = dict(props or {})
+        collection._dataset = dataset
+        collection._date_range = date_range
+        return collection
+
+    def _copy_from(self, other):
+        self._elements,self._cache,self._props = other._elements,other._cache,dict(other._props)
+        self._dataset,self._date_range = other._dataset,other._date_range
+
+    def _list(self):
+        if self._cache is None:
+            self._cache = list(self._elements())
+        return self._cache
+
+    def _derived(self, elements, cls=None):
+        return (cls or type(self))._make(elements, self._props)
+
+    def map(self, algorithm, dropNulls=False):
+        return self._derived(lambda: [result for result in (algorithm(element) for element in self._list())
+                                      if result is not None and _value(result) is not None])
+
+    def filter(self, filter):
+        if filter._date_range is not None and self._dataset is not None:
+            return self.filterDate(filter._date_range)
+        return self._derived(lambda: [element for element in self._list() if filter._test(element._props)])
+
+    def filterMetadata(self, name, operator, value):
+        return self.filter(Filter.metadata(name, operator, value))
+
+    def filterDate(self, start, end=None):
+        date_range = DateRange(start, end)
+        if self._dataset is not None:
+            start,end = date_range._start,date_range._end
+            if self._date_range is not None:
+                start,end = max(start, self._date_range._start),min(end, self._date_range._end)
+            return type(self)._make(None, self._props, self._dataset, DateRange(start, max(start, end)))
+        return self.filter(Filter.date(date_range))
+
+    def filterBounds(self, geometry):
+        bounds = _geometry(geometry)._bounds()
+        def intersects(element):
+            footprint = element.geometry()._bounds() if isinstance(element, Feature) and element.geometry() else None
+            return footprint is None or bounds is None or not (
+                footprint[2] < bounds[0] or footprint[0] > bounds[2] or footprint[3] < bounds[1] or footprint[1] > bounds[3])
+        if self._dataset is not None:
+            return self
+        return self._derived(lambda: [element for element in self._list() if intersects(element)])
+
+    def sort(self, property, ascending=True):
+        def key(element):
+            value = element._props.get(property)
+            return (value is None, value if value is not None else 0)
+        return self._derived(lambda: sorted(self._list(), key=key, reverse=not ascending))
+
+    def limit(self, max, property=None, ascending=True):
+        source = self.sort(property, ascending) if property is not None else self
+        return self._derived(lambda: source._list()[:int(_number(max))])
+
+    def merge(self, collection2):
+        return self._derived(lambda: self._list() + collection2._list())
+
+    def first(self):
+        elements = self._list()
+        return elements[0] if elements else None
+
+    def size(self):
+        return Number(len(self._list()))
+
+    def toList(self, count, offset=0):
+        offset = int(_number(offset))
+        return List(self._list()[offset:offset + int(_number(count))])
+
+    def aggregate_array(self, property):
+        return List([element._props.get(property) for element in self._list()])
+
+    def reduceColumns(self, reducer, selectors, weightSelectors=None):
+        selectors = [_value(selector) for selector in _value(selectors)]
+        return Dictionary(reducer._columns([[element._props.get(selector) for selector in selectors] for element in self._list()]))
+
+    def aggregate_min(self, property):
+        return Number(min(element._props[property] for element in self._list() if element._props.get(property) is not None))
+
+    def aggregate_max(self, property):
+        return Number(max(element._props[property] for element in self._list() if element._props.get(property) is not None))
+
+    def set(self, *args):
+        props = _value(args[0]) if len(args) == 1 else {_value(args[0]): args[1]}
+        collection = self._derived(self._list)
+        collection._props.update({_value(key): _value(value) for key,value in props.items()})
+        return collection
+
+    def get(self, property):
+        return _wrap(self._props.get(_value(property)))
+
+    def getInfo(self):
+        _round_trip('getInfo', type(self).__name__)
+        return self._info()
+
+    def _info(self):
+        return {'type': type(self).__name__, 'features': [element._info() for element in self._list()], 'properties': _info(self._props)}
+
+
+class ImageCollection(Collection):
+    def __init__(self, args):
+        args = _value(args)
+        if isinstance(args, Collection):
+            self._copy_from(args)
+        elif isinstance(args, str):
+            if args not in COLLECTIONS:
+                raise EEException(f"ImageCollection.load: ImageCollection asset '{args}' not found.")
+            self._copy_from(ImageCollection._make(None, {'system:id': args}, args))
+        else:
+            images = [_as_image(image) for image in (args if isinstance(args, (list, tuple)) else [args])]
+            self._copy_from(ImageCollection._make(lambda: images))
+
+    @staticmethod
+    def fromImages(images):
+        return ImageCollection([_value(image) for image in _value(images)])
+
+    def _list(self):
+        if self._cache is None and self._dataset is not None:
+            current = world()
+            names,scale,generate = COLLECTIONS[self._dataset]
+            start,end = (self._date_range._start,self._date_range._end) if self._date_range else (None, None)
+            def image(time_start, props):
+                def compute():
+                    return [np.ma.array(a, mask=np.zeros(a.shape, dtype=bool)) for a in generate(current, time_start)]
+                index = time_start.strftime('%Y%m%d%H%M')
+                return _make_image(names, compute, {'system:time_start': _millis(time_start), 'system:index': index, **props}, scale)
+            self._cache = [image(time_start, props) for time_start,props in current.collection_times(self._dataset, start, end)]
+        return super()._list()
+
+    def _derived(self, elements, cls=None):
+        return (cls or ImageCollection)._make(elements, self._props)
+
+    def select(self, *args, **kwargs):
+        return self.map(lambda image: image.select(*args, **kwargs))
+
+    def _pixelwise(self, reducer, names=None):
+        def compute():
+            images = self._list()
+            if not images:
+                return []
+            return [reducer._pixels(np.ma.stack([image._arrays()[i] for image in images])) for i in range(len(images[0]._names))]
+        band_names = names if names is not None else (self._list()[0]._names if self._list() else [])
+        return _make_image(band_names, compute, {}, self._list()[0]._scale if self._list() else None)
+
+    def max(self):
+        return self._pixelwise(Reducer.max())
+
+    def min(self):
+        return self._pixelwise(Reducer.min())
+
+    def sum(self):
+        return self._pixelwise(Reducer.sum())
+
+    def mean(self):
+        return self._pixelwise(Reducer.mean())
+
+    def median(self):
+        return self._pixelwise(Reducer.median())
+
+    def count(self):
+        return self._pixelwise(Reducer.count())
+
+    def reduce(self, reducer, parallelScale=1):
+        if reducer._pixels is None:
+            raise EEException("ImageCollection.reduce: only reducers with one output are supported")
+        images = self._list()
+        names = [f'{name}_{reducer._outputs[0]}' for name in images[0]._names] if images else []
+        return self._pixelwise(reducer, names)
+
+    def mosaic(self):
+        def compute():
+            images = self._list()
+            if not images:
+                return []
+            result = [band.copy() for band in images[0]._arrays()]
+            for image in images[1:]:
+                for i,band in enumerate(image._arrays()):
+                    valid = ~np.ma.getmaskarray(band)
+                    result[i] = np.ma.array(np.where(valid, band.data, result[i].data), mask=np.ma.getmaskarray(result[i]) & ~valid)
+            return result
+        images = self._list()
+        return _make_image(images[0]._names if images else [], compute)
+
+    def first(self):
+        image = super().first()
+        return image
+
+
+class FeatureCollection(Collection):
+    def __init__(self, args, opt_column=None):
+        args = _value(args)
+        if isinstance(args, Collection):
+            self._copy_from(args)
+        elif isinstance(args, str):
+            self._copy_from(FeatureCollection._make(lambda: _load_features(args), {'system:id': args}))
+        elif isinstance(args, (Feature, Geometry)):
+            feature = args if isinstance(args, Feature) else Feature(args)
+            self._copy_from(FeatureCollection._make(lambda: [feature]))
+        else:
+            features = [feature if isinstance(feature, Feature) else Feature(feature) for feature in args]
+            self._copy_from(FeatureCollection._make(lambda: features))
+
+    def _derived(self, elements, cls=None):
+        return (cls or FeatureCollection)._make(elements, self._props)
+
+    def geometry(self, maxError=None):
+        return Geometry._from_rects([rect for feature in self._list() if feature.geometry() for rect in feature.geometry()._rects])
+
+    def reduceToImage(self, properties, reducer):
+        features = self._list()
+        property = _value(_value(properties)[0])
+        def compute():
+            current = world()
+            values = np.full(current.shape, np.nan)
+            for feature in reversed(features):
+                value = feature._props.get(property)
+                if value is not None and feature.geometry() is not None:
+                    values[feature.geometry()._mask(current.lon, current.lat)] = value
+            return [np.ma.array(values, mask=np.isnan(values))]
+        return _make_image(reducer._outputs, compute)
+
+
+def _load_features(asset_id):
+    current = world()
+    if asset_id in GAUL_LEVEL2:
+        return [Feature(Geometry._from_rects([current.fraction_rect(*rect)]), props) for rect,props in GAUL_UNITS]
+    # Any other table stands for the permanent water areas, e.g. the water area asset of the flood pipeline
+    return [Feature(Geometry._from_rects([rect]), {'code': 1}) for rect in current.static()['water_rects']]
+
+
+# --------------------------------------------------------------------------- exports
+
+def _write_geotiff(image, filename, scale=None, region=None):
+    """Writes the image over the region at the scale (m) as a float32 GeoTIFF, masked pixels as NaN."""
+    import rasterio
+    from rasterio.transform import from_origin
+    current = world()
+    image = _as_image(image)
+    west,south,east,north = _geometry(region)._bounds() if region is not None else current.bounds
+    step = _number(scale) / METRES_PER_DEGREE if scale is not None else current.dx
+    cols,rows = max(1, int(round((east - west) / step))),max(1, int(round((north - south) / step)))
+    col_index = np.floor((west + (np.arange(cols) + 0.5) * step - current.bounds[0]) / current.dx).astype(int)
+    row_index = np.floor((current.bounds[3] - (north - (np.arange(rows) + 0.5) * step)) / current.dy).astype(int)
+    inside = ((row_index >= 0) & (row_index < current.shape[0]))[:, None] & ((col_index >= 0) & (col_index < current.shape[1]))[None, :]
+    index = np.ix_(np.clip(row_index, 0, current.shape[0] - 1), np.clip(col_index, 0, current.shape[1] - 1))
+    bands = [np.where(np.ma.getmaskarray(array)[index] | ~inside, np.nan, array.data[index]).astype(np.float32)
+             for array in image._arrays()]
+    folder = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(folder, exist_ok=True)
+    with rasterio.open(filename, 'w', driver='GTiff', width=cols, height=rows, count=len(bands), dtype='float32',
+                       nodata=np.nan, crs='EPSG:4326', transform=from_origin(west, north, step, step)) as dataset:
+        for i,(name,band) in enumerate(zip(image._names, bands), start=1):
+            dataset.write(band, i)
+            dataset.set_band_description(i, name)
+    return filename
+
+
+def _ee_export_image(ee_object, filename, scale=None, crs=None, crs_transform=None, region=None, dimensions=None,
+                     file_per_band=False, format='ZIPPED_GEO_TIFF', unmask_value=None, timeout=300, proxies=None, verbose=True):
+    """Stand-in for geemap.ee_export_image: one download request, then the GeoTIFF is written locally."""
+    _round_trip('download', os.path.basename(filename))
+    image = _as_image(ee_object)
+    if unmask_value is not None:
+        image = image.unmask(unmask_value, False)
+    _write_geotiff(image, filename, scale, region)
+    if verbose:
+        print(f"Data downloaded to {os.path.abspath(filename)}")
+
+
+geemap = types.ModuleType('geemap', 'Offline stand-in for geemap, installed by fake_ee.Initialize.')
+geemap.ee_export_image = _ee_export_image
+
+
+class Task:
+    """An export task; it runs when started and is COMPLETED at once."""
+    def __init__(self, task_type, config, run):
+        self.id = f'FAKE{next(_keys):020d}'
+        self.task_type = task_type
+        self.config = config
+        self._run = run
+        self.state = 'UNSUBMITTED'
+
+    def start(self):
+        _round_trip('export', self.config.get('description'))
+        self._run()
+        self.state = 'COMPLETED'
+        with _lock:
+            world().tasks.append(self)
+
+    def status(self):
+        _round_trip('tasks', self.id)
+        return {'id': self.id, 'state': self.state, 'description': self.config.get('description'), 'task_type': self.task_type}
+
+    def active(self):
+        return self.status()['state'] in ('READY', 'RUNNING')
+
+
+class _ImageExport:
+    @staticmethod
+    def toAsset(image, description='myExportImageTask', assetId=None, pyramidingPolicy=None, dimensions=None, region=None,
+                scale=None, crs=None, crsTransform=None, maxPixels=None, **kwargs):
+        config = {'description': description, 'assetId': assetId, 'scale': scale}
+        def run():
+            stored = _as_image(image)
+            if region is not None:
+                stored = stored.clip(region)
+            world().assets[assetId] = stored
+        return Task('EXPORT_IMAGE', config, run)
+
+    @staticmethod
+    def toDrive(image, description='myExportImageTask', folder=None, fileNamePrefix=None, dimensions=None, region=None,
+                scale=None, crs=None, crsTransform=None, maxPixels=None, **kwargs):
+        config = {'description': description, 'folder': folder, 'fileNamePrefix': fileNamePrefix, 'scale': scale}
+        def run():
+            if settings['export_dir'] is not None:
+                filename = os.path.join(settings['export_dir'], folder or '', f'{fileNamePrefix or description}.tif')
+                _write_geotiff(image, filename, scale, region)
+        return Task('EXPORT_IMAGE', config, run)
+
+    toCloudStorage = toDrive
+
+
+batch = types.SimpleNamespace(Export=types.SimpleNamespace(image=_ImageExport), Task=Task)
+
+
+def _get_task_list():
+    _round_trip('tasks', 'getTaskList')
+    return [{'id': task.id, 'state': task.state, 'description': task.config.get('description'), 'task_type': task.task_type}
+            for task in reversed(world().tasks)]
+
+
+data = types.SimpleNamespace(getTaskList=_get_task_list)
@@ -1,7 +1,16 @@
-import ee
-import geemap
-geemap.set_proxy(port=7890)
-geemap.ee_initialize()
+import argparse
+from ee_session import initialize
+import profiling
+
+# --profile records the wall time, CPU time and memory of every stage (see profiling.py)
+# and writes the report next to the database
+parser = argparse.ArgumentParser(description='Extract the flood events of the period set below and store them in the database.')
+parser.add_argument('--profile', action='store_true', help='profile every stage and write {database}_profile.json')
+args = parser.parse_args()
+
+# Initialize Earth Engine now, as the dates below are Earth Engine objects
+# The project and proxy are set with EE_PROJECT and EE_PROXY_PORT; no proxy is used when EE_PROXY_PORT is unset
+ee = initialize()
 from flood_utils.flood_period import FloodPeriod
 from flood_utils.flood_toolbox import format_db_path,get_bbox
 
@@ -37,6 +46,13 @@ db_path_template = '../../data/intermediate/Flood/flood_{start_date}_{end_date}.
 # Here, format_db_path is assumed to be a pre-defined function that formats the date and inserts it into the database path template
 db_path = format_db_path(start_date, end_date, db_path_template)  # Formatted database path
 
+# Profile the run when started with --profile
+if args.profile:
+    profiling.enable(profiling.report_path(db_path))
+
+# Optional folder for the per-pixel results (Parquet, registered as views in the database); None to skip
+pixel_dir = None  # e.g. '../../data/intermediate/Flood/pixels/'
+
 # Create a FloodPeriod object
 period = FloodPeriod(start_date,end_date,roi,bbox,water_area_asset_path,resolution,threshold,folder_path)
 
@@ -44,4 +60,4 @@ period = FloodPeriod(start_date,end_date,roi,bbox,water_area_asset_path,resoluti
 flood_events_with_details = period.flood_list()
 
 # Process the flood events, download flood images, and store event information in the database
-period.process_flood_events(flood_events_with_details,db_path)
\ No newline at end of file
+period.process_flood_events(flood_events_with_details,db_path,pixel_dir)
\ No newline at end of file
@@ -1,5 +1,11 @@
-import ee,geemap,os
-import Water_extract_main
+import os,json,time
+from ee_session import ee
+from concurrent.futures import ThreadPoolExecutor,as_completed
+from flood_utils import Water_extract_main
+from flood_utils.Public_methods import parse_TC_path
+from flood_utils.export_manager import ExportManager,ACTIVE_STATES,FINISHED_STATES
+from flood_utils.track_index import TrackIndex
+from flood_utils.tc_catalog import update_catalog,query_catalog
 
 #Obtain the file endwith '.shp' in the TargetDir
 def find_files_EndWith_shp(TargetDir):
@@ -17,21 +23,174 @@ def find_files_EndWith_shp(TargetDir):
     return TC_filesList
 
 
-if '__name__'=="__mainWater_extract_main.ee_init__":
-    #Initializing GEE
+def load_manifest(manifest_path):
+    """
+    Loads the record of typhoons that have already been extracted.
+
+    Args:
+        manifest_path (str): Path of the JSON manifest.
+
+    Returns:
+        dict: Entries keyed by TC ID, each holding the track file, output asset and run time.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest,manifest_path):
+    """
+    Writes the manifest atomically, so an interrupted run never leaves it half written.
+
+    Args:
+        manifest (dict): Entries keyed by TC ID.
+        manifest_path (str): Path of the JSON manifest.
+    """
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def extract_TC(TargetDir,TC_file,radius,asset_path,export_manager=None,track_index=None):
+    """
+    Extracts the flood image of one typhoon and times it.
+
+    Returns:
+        dict: The manifest entry of the typhoon.
+    """
+    start = time.perf_counter()
+    Water_extract_main.TC_flood(TargetDir,TC_file,radius,asset_path,export_manager,track_index=track_index)
+    TC_info = parse_TC_path(TC_file)
+    return {
+        'TC_file': TC_file,
+        'TC_name': TC_info['TC_name'],
+        'asset': Water_extract_main.TC_asset_id(TC_info,asset_path),
+        'seconds': round(time.perf_counter() - start, 1),
+        'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def print_timing_summary(entries,failed):
+    """
+    Prints the run time of every typhoon extracted in this run and the failures.
+    """
+    print(f"{'TC_ID':<10}{'TC_name':<20}{'seconds':>10}")
+    for TC_ID,entry in sorted(entries.items()):
+        print(f"{TC_ID:<10}{entry['TC_name']:<20}{entry['seconds']:>10.1f}")
+    if entries:
+        total = sum(entry['seconds'] for entry in entries.values())
+        print(f"{len(entries)} typhoons, {total:.1f} s in total, {total/len(entries):.1f} s on average")
+    for TC_file,error in failed.items():
+        print(f'Failed: {TC_file}: {error}')
+
+
+def record_exported(manifest,export_manager,assets):
+    """
+    Moves the typhoons whose export has completed into the manifest.
+
+    Args:
+        manifest (dict): Entries keyed by TC ID, updated in place.
+        export_manager (ExportManager): The exports of the batch.
+        assets (dict): Asset ID -> TC ID of the typhoons not in the manifest yet.
+
+    Returns:
+        list: The TC IDs added.
+    """
+    added = []
+    for asset,TC_ID in assets.items():
+        if TC_ID not in manifest and export_manager.state(asset) == 'COMPLETED':
+            manifest[TC_ID] = export_manager.source(asset) or {'asset': asset}
+            added.append(TC_ID)
+    return added
+
+
+def run_batch(TargetDir,radius=2000000,manifest_path=None,max_workers=4,asset_path='projects/ee-mypython/assets/',max_exports=10,start_date=None,end_date=None,export_service=None,poll_interval=30):
+    """
+    Extracts the floods of all typhoon tracks in a directory, several at a time.
+
+    Typhoons recorded in the manifest are skipped. A typhoon is only recorded once the
+    export of its flood image has completed, so an interrupted batch resumes where it
+    stopped and a failed export is extracted again on the next run. Exports go through
+    an ExportManager whose task table (TC_exports.db) sits next to the manifest; at
+    start the manifest is reconciled with it, exports that completed after the last
+    run are recorded and those still running are waited for instead of being redone.
+    The typhoons are taken from the catalog (TC_catalog.db in TargetDir), which only
+    re-reads new or modified tracks. Pending tracks are read and buffered locally once
+    (TrackIndex) instead of being uploaded and buffered on the server one by one.
+
+    Args:
+        TargetDir (str): Directory holding the typhoon track shapefiles.
+        radius (float): Buffer radius around the tracks, in metres.
+        manifest_path (str, optional): JSON manifest of finished typhoons. Defaults to TC_manifest.json in TargetDir.
+        max_workers (int): Number of typhoons processed concurrently.
+        asset_path (str): Earth Engine asset folder for the flood images.
+        max_exports (int): Maximum number of asset exports running at once.
+        start_date (str, optional): Only typhoons ending on or after this day, 'YYYY-MM-DD'.
+        end_date (str, optional): Only typhoons starting on or before this day, 'YYYY-MM-DD'.
+        export_service (optional): Task backend of the ExportManager, e.g. a FakeTaskService. Defaults to Earth Engine.
+        poll_interval (float): Seconds between two polls of the exports.
+
+    Returns:
+        dict: The updated manifest.
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(TargetDir,'TC_manifest.json')
+    manifest = load_manifest(manifest_path)
+    export_manager = ExportManager(os.path.join(os.path.dirname(manifest_path),'TC_exports.db'),service=export_service,max_running=max_exports)
+    TCs_List = query_catalog(update_catalog(TargetDir),start_date,end_date)
+    assets = {Water_extract_main.TC_asset_id(parse_TC_path(TC['TC_file']),asset_path): TC['TC_ID']
+              for TC in TCs_List if TC['TC_ID'] not in manifest}
+
+    # Exports of an earlier run: refresh their states, record the completed ones
+    if export_manager.pending():
+        export_manager.poll()
+    if record_exported(manifest,export_manager,assets):
+        save_manifest(manifest,manifest_path)
+    running = {TC_ID for asset,TC_ID in assets.items() if export_manager.state(asset) in ACTIVE_STATES}
+    pending = {TC['TC_ID']: TC['TC_file'] for TC in TCs_List if TC['TC_ID'] not in manifest and TC['TC_ID'] not in running}
+    print(f'{len(TCs_List)-len(pending)-len(running)} typhoons already extracted, {len(running)} still exporting, {len(pending)} to go')
+    track_index = TrackIndex(TargetDir,radius,list(pending.values()))
+
+    entries = {}
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(extract_TC,TargetDir,TC,radius,asset_path,export_manager,track_index): TC_ID
+                   for TC_ID,TC in pending.items()}
+        for done,future in enumerate(as_completed(futures),1):
+            TC_ID = futures[future]
+            try:
+                entries[TC_ID] = future.result()
+            except Exception as e:
+                # One failed typhoon must not stop the batch; it is retried on the next run
+                failed[pending[TC_ID]] = e
+                print(f'[{done}/{len(pending)}] {pending[TC_ID]} failed: {e}')
+                continue
+            # Kept with the export, the manifest is written once it has completed
+            export_manager.describe(entries[TC_ID]['asset'],entries[TC_ID])
+            print(f"[{done}/{len(pending)}] {pending[TC_ID]} extracted in {entries[TC_ID]['seconds']:.1f} s")
+
+    print_timing_summary(entries,failed)
+    # Keep polling until the queued exports have all been started and finished
+    print('Exports:', export_manager.wait(poll_interval))
+    record_exported(manifest,export_manager,assets)
+    save_manifest(manifest,manifest_path)
+    for asset,TC_ID in assets.items():
+        if TC_ID not in manifest and export_manager.state(asset) in FINISHED_STATES:
+            print(f'Export of {asset} ended {export_manager.state(asset)}, {TC_ID} is extracted again on the next run')
+    return manifest
+
+
+if __name__ == "__main__":
+    #Initializing GEE (through a proxy only when EE_PROXY_PORT is set, e.g. 7890)
     Water_extract_main.ee_init()
 
     TargetDir = r'E:/多年台风洪水检测/数据/temp/'
-    TCs_List = find_files_EndWith_shp(TargetDir);
-
-    # Creat a list to store the results of each typhoon in turn
-    TCs_water_lst =[]
-    #Process the typhoon in the list one by one
-    for TC in TCs_List:
-        TC_water = Water_extract_main.TC_flood(TargetDir,TC,2000000);
-        TCs_water_lst.append(TC_water);
-    
-    print('ALL TCs have been extracted successfully')
-    #将不同台风组合为一ImageCollection
-    # water_collection = ee.ImageCollection.fromImages(TC_water_lst);
+    # Process the typhoons four at a time, skipping those already in the manifest
+    manifest = run_batch(TargetDir,radius=2000000,max_workers=4)
 
+    if all(TC['TC_ID'] in manifest for TC in query_catalog(os.path.join(TargetDir,'TC_catalog.db'))):
+        print('ALL TCs have been extracted successfully')
+    #将不同台风组合为一ImageCollection
+    # water_collection = ee.ImageCollection.fromImages([ee.Image(entry['asset']) for entry in manifest.values()]);
@@ -1,4 +1,37 @@
-import ee,re
+import re,time,threading
+from ee_session import ee
+
+class RateLimiter:
+    """
+    Token-bucket limiter for Earth Engine requests, shared by concurrent extractors.
+
+    Attributes:
+        rate (float): Average number of requests allowed per second.
+        burst (int): Number of requests that may be sent back to back.
+    """
+    def __init__(self, rate=5, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A negative balance reserves the next token, so waiting threads are served in turn
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+# Shared by every module that sends synchronous requests (getInfo) to Earth Engine
+ee_rate_limiter = RateLimiter()
 
 def Route2Roi(TC_shp,buffer_width):
     """
@@ -38,6 +71,42 @@ def potential_flood(start_date,end_date,roi):
     return potential_flood_area
 
 
+def potential_flood_mask(start_date,end_date,roi):
+    """
+    Raster counterpart of potential_flood: keeps the rainfall exceedance as a mask instead of polygons.
+
+    Args:
+        start_date (ee.Date): The start date for the analysis period.
+        end_date (ee.Date): The end date for the analysis period.
+        roi (ee.Geometry): The region of interest for flood detection.
+
+    Returns:
+        tuple: (ee.Image, ee.Geometry) The self-masked 'potential_flood' exceedance mask and its bounding box,
+            the bounding box of roi when no pixel exceeds the threshold.
+    """
+    rainFall_duration = end_date.difference(start_date,'day');
+    precipitation_threshold = ee.Number(rainFall_duration).multiply(ee.Number(50));
+    GPM = ee.ImageCollection("NASA/GPM_L3/IMERG_V06").filterDate(start_date,end_date).select('precipitationCal').filterBounds(roi)
+    potential_flood_area = GPM.sum().gt(precipitation_threshold).clip(roi)\
+        .selfMask().rename('potential_flood')
+    # The bounding box is the extent of the unmasked pixel centres, widened by half a GPM pixel (0.05 degrees)
+    def lonlat_extent(mask):
+        return ee.Image.pixelLonLat().updateMask(mask).reduceRegion(
+            reducer = ee.Reducer.minMax(),
+            geometry = roi,
+            crs = 'EPSG:4326',
+            scale = 10000,
+            maxPixels = 10000000)
+    extent = lonlat_extent(potential_flood_area)
+    # Without any exceedance minMax gives nulls, the extent of the whole ROI is used instead
+    extent = ee.Dictionary(ee.Algorithms.If(extent.get('longitude_min'), extent, lonlat_extent(ee.Image.constant(1))))
+    bbox = ee.Geometry.Rectangle(
+        [ee.Number(extent.get('longitude_min')).subtract(0.05), ee.Number(extent.get('latitude_min')).subtract(0.05),
+         ee.Number(extent.get('longitude_max')).add(0.05), ee.Number(extent.get('latitude_max')).add(0.05)],
+        'EPSG:4326', False)
+    return potential_flood_area,bbox
+
+
 def otsu1(histogram):
     """
     Applies the OTSU method to an image to determine the threshold for flood detection.
@@ -89,6 +158,26 @@ def otsu(image,roi):
     # print("distribution", histogram)
     return otsu1(histogram.get(histogram.keys().get(0)))
 
+def otsu_bands(image,roi):
+    """
+    Applies the OTSU method to every band of an image with a single histogram request.
+
+    Args:
+        image (ee.Image): The image to threshold, e.g. the VV and VH bands of Sentinel-1.
+        roi (ee.Geometry): The region over which the histograms are computed.
+
+    Returns:
+        ee.Image: A constant image holding each band's threshold under the band's name.
+    """
+    histogram = image.reduceRegion(
+        reducer = ee.Reducer.histogram(10000, 0.01),
+        geometry = roi,
+        scale = 30,
+        bestEffort = True,)
+    bands = image.bandNames()
+    thresholds = bands.map(lambda band: otsu1(histogram.get(band)))
+    return ee.Dictionary.fromLists(bands, thresholds).toImage(bands)
+
 
 def final_mask (image):
     """
@@ -121,14 +210,11 @@ def parse_TC_path(TC_path):
     TC_ID = TC_path.split('.')[0].split("_")[0];
     TC_name = TC_path.split('.')[0].split("_")[1];
     # Parse the start and end dates
-    daterange = re.findall('\d{8}',TC_path,re.S)  # Parse the start and end dates
+    daterange = re.findall(r'\d{8}',TC_path,re.S)  # Parse the start and end dates
     start_date = daterange[0];
     start_date = start_date[0:4] + '-' + start_date[4:6] + '-' + start_date[6:9]
     end_date = daterange[1];
     end_date = end_date[0:4] + '-' + end_date[4:6] + '-' + end_date[6:9]
-    year = ee.Date(start_date).get('year')  # The year in which the TC occurred
-    # Output the start and end dates
-    print('Start date:',start_date, 'End date:',end_date);
     # Write to a dictionary
     TC_information = {
         'TC_ID':TC_ID,
@@ -157,7 +243,7 @@ def get_JRC_water(year,roi):
     return jrc_perm.clip(roi)
 
 # Save image to Google Earth Engine Asset
-def to_asset(save_asset,flood_img,bounds,res=250):
+def to_asset(save_asset,flood_img,bounds,res=250,export_manager=None):
     """
     Saves an image to Google Earth Engine Asset.
 
@@ -166,13 +252,21 @@ def to_asset(save_asset,flood_img,bounds,res=250):
         flood_img (ee.Image): The image to save.
         bounds (ee.Geometry): The region bounds where the image is located.
         res (int): The resolution at which to save the image.
+        export_manager (ExportManager, optional): Queues the export instead of starting it at once.
+
+    Returns:
+        ee.batch.Task: The started task, or None when the export is queued on export_manager.
     """
-    task = ee.batch.Export.image.toAsset(
+    export = dict(
         image=flood_img,
         description='ExportToAsset TC Flood'+ str(save_asset.split('/')[-1]),
         assetId=save_asset,
-        region = bounds.getInfo()['coordinates'],
+        region = bounds,
         scale =res,
         maxPixels=1e12)
+    if export_manager is not None:
+        export_manager.submit(save_asset,export)
+        return None
+    task = ee.batch.Export.image.toAsset(**export)
     task.start()
-    return
+    return task
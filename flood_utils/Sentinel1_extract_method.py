@@ -1,128 +1,157 @@
-import ee,geemap
-from Public_methods import otsu,final_mask 
+from ee_session import ee
+from flood_utils.Public_methods import otsu_bands,final_mask
+from profiling import profile_stage
+#VV和VH极化在同一幅双波段影像中一起处理
+S1_BANDS = ['VV','VH']
+#筛选覆盖研究区的哨兵1双极化影像
+def S1_collection(start_date,end_date,roi):
+    #加载哨兵1数据，一次筛选同时获得VV和VH两个极化
+    return ee.ImageCollection('COPERNICUS/S1_GRD') \
+             .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV')) \
+             .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
+             .filter(ee.Filter.eq('instrumentMode', 'IW')) \
+             .filterDate(start_date,end_date).filterBounds(roi).select(S1_BANDS)
 #Sentinel1数据加载
 def load_Sentinel1(start_date,end_date,roi):
-    #加载哨兵1数据
-    sentinel1 = ee.ImageCollection('COPERNICUS/S1_GRD')
-    img_vh =sentinel1.filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-                 .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-                 .filterDate(start_date,end_date).filterBounds(roi).select('VH')
-    
-    img_vv =sentinel1.filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV')) \
-                 .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-                 .filterDate(start_date,end_date).filterBounds(roi).select('VV')
-    VH = ee.Image.cat([img_vh.min()]).clip(roi)
-    VV = ee.Image.cat([img_vv.min()]).clip(roi)
-    return VH,VV
-#RefinedLee滤波
-def RefinedLee(img): 
+    return S1_collection(start_date,end_date,roi).min().clip(roi)
+#一次reduceNeighborhood同时计算均值和方差，并保留原波段名
+def neighborhood_stats(img,kernel):
+    bands = img.bandNames()
+    stats = img.reduceNeighborhood(ee.Reducer.mean().combine(ee.Reducer.variance(), sharedInputs=True), kernel)
+    mean = stats.select(bands.map(lambda band: ee.String(band).cat('_mean')), bands)
+    variance = stats.select(bands.map(lambda band: ee.String(band).cat('_variance')), bands)
+    return mean,variance
+#取得每个像元在(dy,dx)偏移处的值，相当于neighborhoodToBands的一个波段，但对每个波段分别进行
+def neighborhood_shift(img,dy,dx):
+    weights = [[1 if (i,j) == (3+dy,3+dx) else 0 for j in range(7)] for i in range(7)]
+    kernel = ee.Kernel.fixed(7,7, weights, 3,3, False)
+    return img.reduceNeighborhood(ee.Reducer.sum(), kernel).rename(img.bandNames())
+#RefinedLee滤波，逐波段进行，多波段影像（如VV和VH）在同一次计算中完成
+def RefinedLee(img):
+    bands = img.bandNames()
     #设定内核
     weights3 = ee.List.repeat(ee.List.repeat(1,3),3);
     kernel3 = ee.Kernel.fixed(3,3, weights3, 1, 1, False);
- 
-    mean3 = img.reduceNeighborhood(ee.Reducer.mean(), kernel3);
-    variance3 = img.reduceNeighborhood(ee.Reducer.variance(), kernel3);
- 
+
+    mean3,variance3 = neighborhood_stats(img,kernel3);
+    variance_bands = bands.map(lambda band: ee.String(band).cat('_var'))
+    stats3 = mean3.addBands(variance3.rename(variance_bands));
+
     #使用7x7窗户内的3x3窗户的样本来确定梯度和方向
-    sample_weights = ee.List([[0,0,0,0,0,0,0], [0,1,0,1,0,1,0],[0,0,0,0,0,0,0], [0,1,0,1,0,1,0], [0,0,0,0,0,0,0], [0,1,0,1,0,1,0],[0,0,0,0,0,0,0]]);
- 
-    sample_kernel = ee.Kernel.fixed(7,7, sample_weights, 3,3, False);
- 
-    #计算取样窗口的平均值和方差，并存储为9个波段
-    sample_mean = mean3.neighborhoodToBands(sample_kernel); 
-    sample_var = variance3.neighborhoodToBands(sample_kernel);
- 
-    #确定取样窗口的4个梯度
-    gradients = sample_mean.select(1).subtract(sample_mean.select(7)).abs();
-    gradients = gradients.addBands(sample_mean.select(6).subtract(sample_mean.select(2)).abs());
-    gradients = gradients.addBands(sample_mean.select(3).subtract(sample_mean.select(5)).abs());
-    gradients = gradients.addBands(sample_mean.select(0).subtract(sample_mean.select(8)).abs());
- 
-    #并找到梯度带中的最大梯度
-    max_gradient = gradients.reduce(ee.Reducer.max());
- 
-    #为最大梯度的带状像素创建一个掩码
-    gradmask = gradients.eq(max_gradient);
- 
-    #重复的梯度带：每个梯度代表两个方向
-    gradmask = gradmask.addBands(gradmask);
- 
-    #确定8个方向
-    directions = sample_mean.select(1).subtract(sample_mean.select(4)).gt(sample_mean.select(4).subtract(sample_mean.select(7))).multiply(1);
-    directions = directions.addBands(sample_mean.select(6).subtract(sample_mean.select(4)).gt(sample_mean.select(4).subtract(sample_mean.select(2))).multiply(2));
-    directions = directions.addBands(sample_mean.select(3).subtract(sample_mean.select(4)).gt(sample_mean.select(4).subtract(sample_mean.select(5))).multiply(3));
-    directions = directions.addBands(sample_mean.select(0).subtract(sample_mean.select(4)).gt(sample_mean.select(4).subtract(sample_mean.select(8))).multiply(4));
-    #接下来的4个是前面4个的not()。
-    directions = directions.addBands(directions.select(0).Not().multiply(5));
-    directions = directions.addBands(directions.select(1).Not().multiply(6));
-    directions = directions.addBands(directions.select(2).Not().multiply(7));
-    directions = directions.addBands(directions.select(3).Not().multiply(8));
-
- 
-    #屏蔽所有不是1-8的值
-    directions = directions.updateMask(gradmask);
- 
-    #将堆栈 "折叠 "成一个单一波段的图像（由于遮蔽，每个像素在它的方向波段中只有一个值（1-8），否则就会被遮蔽）。
-    directions = directions.reduce(ee.Reducer.sum());  
- 
-    pal = ['ffffff','ff0000','ffff00', '00ff00', '00ffff', '0000ff', 'ff00ff', '000000'];
-    #Map.addLayer(directions.reduce(ee.Reducer.sum()), {min:1, max:8, palette: pal}, 'Directions', false);
- 
-    sample_stats = sample_var.divide(sample_mean.multiply(sample_mean));
- 
-    #Calculate localNoiseVariance
-    sigmaV = sample_stats.toArray().arraySort().arraySlice(0,0,5).arrayReduce(ee.Reducer.mean(), [0]);
- 
+    #计算取样窗口的平均值和方差，每个取样窗口对应local_toolbox.SAMPLE_OFFSETS中的一个偏移
+    from flood_utils import local_toolbox
+    sample_mean = []
+    sample_var = []
+    for dy,dx in local_toolbox.SAMPLE_OFFSETS:
+        sample = neighborhood_shift(stats3,dy,dx)
+        sample_mean.append(sample.select(bands))
+        sample_var.append(sample.select(variance_bands,bands))
+
+    #确定取样窗口的4个梯度，每个梯度代表两个方向
+    pairs = [(1,7),(6,2),(3,5),(0,8)]
+    gradients = [sample_mean[i].subtract(sample_mean[j]).abs() for i,j in pairs]
+
+    #并找到梯度带中的最大梯度（逐波段）
+    max_gradient = gradients[0].max(gradients[1]).max(gradients[2]).max(gradients[3]);
+
+    #确定8个方向：最大梯度为第k个时，方向为k+1，否则为k+5（即前4个方向的not()）
+    directions = ee.Image.constant(0)
+    for k,(i,j) in enumerate(pairs):
+        towards = sample_mean[i].subtract(sample_mean[4]).gt(sample_mean[4].subtract(sample_mean[j]))
+        direction = towards.multiply(-4).add(k+5)
+        directions = gradients[k].eq(max_gradient).multiply(direction).add(directions)
+
+    #Calculate localNoiseVariance：9个取样窗口统计量中最小的5个的平均值（逐波段）
+    sample_stats = [var.divide(mean.multiply(mean)) for mean,var in zip(sample_mean,sample_var)]
+    sigmaV = ee.ImageCollection.fromImages(sample_stats).toArrayPerBand() \
+               .arraySort().arraySlice(0,0,5).arrayReduce(ee.Reducer.mean(), [0]).arrayGet([0]);
+
     #为定向统计设置7*7内核
     rect_weights = ee.List.repeat(ee.List.repeat(0,7),3).cat(ee.List.repeat(ee.List.repeat(1,7),4));
- 
+
     diag_weights = ee.List([[1,0,0,0,0,0,0], [1,1,0,0,0,0,0], [1,1,1,0,0,0,0], [1,1,1,1,0,0,0], [1,1,1,1,1,0,0], [1,1,1,1,1,1,0], [1,1,1,1,1,1,1]]);
- 
+
     rect_kernel = ee.Kernel.fixed(7,7, rect_weights, 3, 3, False);
     diag_kernel = ee.Kernel.fixed(7,7, diag_weights, 3, 3, False);
- 
-    #使用原始核子为平均值和方差创建堆栈。用相关的方向进行屏蔽。
-    dir_mean = img.reduceNeighborhood(ee.Reducer.mean(), rect_kernel).updateMask(directions.eq(1));
-    dir_var = img.reduceNeighborhood(ee.Reducer.variance(), rect_kernel).updateMask(directions.eq(1));
- 
-    dir_mean = dir_mean.addBands(img.reduceNeighborhood(ee.Reducer.mean(), diag_kernel).updateMask(directions.eq(2)));
-    dir_var = dir_var.addBands(img.reduceNeighborhood(ee.Reducer.variance(), diag_kernel).updateMask(directions.eq(2)));
- 
-    #并为旋转的核子添加波段
-    for i in range(1,4,1):
-        dir_mean = dir_mean.addBands(img.reduceNeighborhood(ee.Reducer.mean(), rect_kernel.rotate(i)).updateMask(directions.eq(2*i+1)));
-        dir_var = dir_var.addBands(img.reduceNeighborhood(ee.Reducer.variance(), rect_kernel.rotate(i)).updateMask(directions.eq(2*i+1)));
-        dir_mean = dir_mean.addBands(img.reduceNeighborhood(ee.Reducer.mean(), diag_kernel.rotate(i)).updateMask(directions.eq(2*i+2)));
-        dir_var = dir_var.addBands(img.reduceNeighborhood(ee.Reducer.variance(), diag_kernel.rotate(i)).updateMask(directions.eq(2*i+2)));
-  
-    #"collapse" the stack into a single band image (due to masking, each pixel has just one value in it's directional band, and is otherwise masked)
-    dir_mean = dir_mean.reduce(ee.Reducer.sum());
-    dir_var = dir_var.reduce(ee.Reducer.sum());
- 
+
+    #使用原始核子及其旋转为平均值和方差创建堆栈。用相关的方向进行屏蔽。
+    dir_mean = []
+    dir_var = []
+    for i in range(0,4,1):
+        for kernel,direction in [(rect_kernel,2*i+1),(diag_kernel,2*i+2)]:
+            mean,var = neighborhood_stats(img,kernel.rotate(i) if i else kernel)
+            dir_mean.append(mean.updateMask(directions.eq(direction)))
+            dir_var.append(var.updateMask(directions.eq(direction)))
+
+    #"collapse" the stack into a single image (due to masking, each pixel has just one value in it's directional image, and is otherwise masked)
+    dir_mean = ee.ImageCollection.fromImages(dir_mean).sum();
+    dir_var = ee.ImageCollection.fromImages(dir_var).sum();
+
     #最后生成过滤后的值
     varX = dir_var.subtract(dir_mean.multiply(dir_mean).multiply(sigmaV)).divide(sigmaV.add(1.0));
- 
+
     b = varX.divide(dir_var);
- 
+
     result = dir_mean.add(b.multiply(img.subtract(dir_mean)));
-    return result
-def S1_water_extract(start_date,end_date,roi):
-    #加载VV和VH极化
-    VH,VV = load_Sentinel1(start_date,end_date,roi);
-    #进行RefinedLee滤波
-    VH_LEE = RefinedLee(VH).arrayFlatten(coordinateLabels=[['LEE_VH']]);
-    VV_LEE = RefinedLee(VV).arrayFlatten(coordinateLabels=[['LEE_VV']]);
+    return result.rename(bands)
+def S1_water_extract(start_date,end_date,roi,mask=None):
+    #加载VV和VH双极化影像
+    S1_img = load_Sentinel1(start_date,end_date,roi);
+    #栅格模式下roi为潜在洪水区的外包矩形，用潜在洪水区掩膜限定提取和OTSU统计的范围
+    if mask is not None:
+        S1_img = S1_img.updateMask(mask);
+    #进行RefinedLee滤波，一次处理两个极化
+    S1_LEE = RefinedLee(S1_img);
     #根据地形去除干扰
-    VH_final = final_mask(VH_LEE);
-    VV_final = final_mask(VV_LEE);
-    #调用OTSU获得阈值
-    water_threshold_VH=otsu(VH_final,roi);
-    water_threshold_VV=otsu(VV_final,roi);
-    #根据阈值提取水体
-    water_VH = VH_final.lt(water_threshold_VH);
-    water_VV = VV_final.lt(water_threshold_VV);
+    S1_final = final_mask(S1_LEE);
+    #调用OTSU获得阈值，一次直方图请求得到两个极化各自的阈值
+    water_thresholds = otsu_bands(S1_final,roi);
+    #根据阈值提取水体（逐波段比较）
+    water = S1_final.lt(water_thresholds);
     #融合VH水体和VV水体
-    thresholds_counts = water_VH.addBands(water_VV).reduce(ee.Reducer.sum());
-    Sentinel1_water = thresholds_counts.gte(ee.Image.constant(2)).select(['sum'],['Sentinel2_water'])
+    thresholds_counts = water.reduce(ee.Reducer.sum());
+    Sentinel1_water = thresholds_counts.gte(ee.Image.constant(len(S1_BANDS))).select(['sum'],['Sentinel1_water'])
     #返回获得水体
-    return Sentinel1_water.unmask()
\ No newline at end of file
+    return Sentinel1_water.unmask()
+def S1_water_extract_local(scenes,slope,block_rows=64,workers=None,jrc_cache=None,year=None,offset=(0,0)):
+    """
+    Local counterpart of S1_water_extract working on cached Sentinel-1 scenes.
+
+    Args:
+        scenes (iterable): (2, rows, cols) arrays of VV and VH backscatter (S1_BANDS order) in dB on a common grid, NaN where masked.
+        slope (np.ndarray): Terrain slope in degrees on the same grid, see local_toolbox.terrain_slope.
+        block_rows (int): Number of rows per Refined Lee block.
+        workers (int, optional): Number of threads filtering blocks concurrently, all CPUs by default.
+        jrc_cache (JRCCache, optional): Cache whose permanent water of `year` is removed from the result.
+        year (int, optional): The year of the JRC layer, required with jrc_cache.
+        offset (tuple): (row_off, col_off) of the scenes in the grid of jrc_cache.
+
+    Returns:
+        np.ndarray: A uint8 array, 1 where both polarisations detect water (outside permanent water with jrc_cache).
+    """
+    import numpy as np
+    from flood_utils import local_toolbox
+    #按像元取最小值合成，与min()一样忽略被掩膜的像元
+    composite = None
+    with profile_stage('compositing'):
+        for scene in scenes:
+            if composite is None:
+                composite = np.array(scene, dtype=np.float32)
+            else:
+                np.fmin(composite, scene, out=composite)
+    if composite is None:
+        raise ValueError('No Sentinel-1 scenes')
+    with profile_stage('filtering'):
+        #一次RefinedLee滤波同时处理VV和VH
+        S1_LEE = local_toolbox.refined_lee(composite, block_rows, workers)
+        S1_final = local_toolbox.final_mask(S1_LEE, slope)
+    with profile_stage('thresholding'):
+        #两个极化的OTSU阈值一次计算
+        water_thresholds = local_toolbox.otsu(S1_final)
+        water = S1_final < water_thresholds[:, None, None]
+    #融合VH水体和VV水体：两个极化都检测为水体，按位计票（与S1_water_extract中的求和相同）
+    water = local_toolbox.fuse_water(water, min_votes=len(S1_BANDS))
+    if jrc_cache is not None:
+        #去除JRC永久水体，得到洪水范围
+        water = local_toolbox.remove_permanent_water(water,jrc_cache,year,offset)
+    return water.to_array().astype(np.uint8)
@@ -1,6 +1,6 @@
-import ee
-import geemap
-from Public_methods import otsu,final_mask
+from ee_session import ee
+from flood_utils.Public_methods import otsu,final_mask
+from profiling import profile_stage
 #定义去云函数
 def mask2clouds(image):
     qa = image.select('QA60')
@@ -13,13 +13,19 @@ def cal_NDWI(image):
     NDWI = image.normalizedDifference(['B3','B11']).rename('NDWI')
     NDWI = NDWI.updateMask(NDWI.gt(-1).And(NDWI.lt(1)))
     return image.addBands(NDWI)
-def S2_water_extract(start_date,end_date,roi):
+#筛选覆盖研究区的少云哨兵2影像
+def S2_collection(start_date,end_date,roi):
+    return ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED').filterDate(start_date,end_date).filterBounds(roi)\
+             .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE',10))
+def S2_water_extract(start_date,end_date,roi,mask=None):
     #加载哨兵2数据
-    sentinel2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED').filterDate(start_date,end_date)\
-                  .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE',10)).map(mask2clouds)\
+    sentinel2 = S2_collection(start_date,end_date,roi).map(mask2clouds)\
                   .select('B3','B4','B8','B11','QA60');
     #运行同一天影像
     S2_img = sentinel2.max().clip(roi);
+    #栅格模式下roi为潜在洪水区的外包矩形，用潜在洪水区掩膜限定提取和OTSU统计的范围
+    if mask is not None:
+        S2_img = S2_img.updateMask(mask);
     #计算NDWI指数
     S2_NDWI = cal_NDWI(S2_img).select(['NDWI'],['Sentinel2_water']);
     #OTSU计算阈值
@@ -28,3 +34,61 @@ def S2_water_extract(start_date,end_date,roi):
     S2_water = S2_NDWI.gt(NDWI_threshold);
     S2_water = final_mask(S2_water);
     return S2_water.unmask()
+
+#本地引擎：直接读取缓存的哨兵2影像，无需调用服务器
+S2_BANDS = ['B3','B11','QA60']
+#QA60中的云和卷云标志位
+CLOUD_BITS = (1<<10) | (1<<11)
+def S2_water_extract_local(scenes,slope=None,chunk_rows=1024,jrc_cache=None,year=None,offset=(0,0)):
+    """
+    Local counterpart of S2_water_extract working on cached Sentinel-2 scenes.
+
+    Scenes are read in row chunks. The QA60 cloud mask is applied while updating a
+    running per-band max composite in place, so memory does not grow with the
+    number of scenes.
+
+    Args:
+        scenes (list): Paths of GeoTIFFs holding the S2_BANDS bands on a common grid.
+        slope (np.ndarray, optional): Terrain slope in degrees on the same grid, see local_toolbox.terrain_slope.
+        chunk_rows (int): Number of rows read at a time.
+        jrc_cache (JRCCache, optional): Cache whose permanent water of `year` is removed from the result.
+        year (int, optional): The year of the JRC layer, required with jrc_cache.
+        offset (tuple): (row_off, col_off) of the scenes in the grid of jrc_cache.
+
+    Returns:
+        np.ndarray: A uint8 array, 1 where water is detected (outside permanent water with jrc_cache).
+    """
+    import numpy as np
+    from flood_utils import local_toolbox
+    composite = None
+    #影像按块读取并直接合成，读取时间计入compositing阶段
+    with profile_stage('compositing'):
+        for path in scenes:
+            if composite is None:
+                composite = np.full((2,) + local_toolbox.raster_shape(path), np.nan, dtype=np.float32)
+            for rows, (b3, b11, qa) in local_toolbox.read_chunks(path, S2_BANDS, chunk_rows):
+                #去云：云和卷云标志位均为0的像元才参与合成
+                clear = np.isfinite(qa)
+                clear[clear] = (qa[clear].astype(np.uint16) & CLOUD_BITS) == 0
+                #按像元取最大值合成，原地更新
+                np.fmax(composite[0, rows], b3, out=composite[0, rows], where=clear)
+                np.fmax(composite[1, rows], b11, out=composite[1, rows], where=clear)
+    if composite is None:
+        raise ValueError('No Sentinel-2 scenes')
+    with profile_stage('thresholding'):
+        #计算NDWI指数，复用合成影像的内存
+        b3, b11 = composite
+        ndwi = np.subtract(b3, b11)
+        np.add(b3, b11, out=b11)
+        np.divide(ndwi, b11, out=ndwi)
+        ndwi[~((ndwi > -1) & (ndwi < 1))] = np.nan
+        #OTSU计算阈值
+        NDWI_threshold = local_toolbox.otsu(ndwi[None])[0]
+        #根据阈值提取水体
+        S2_water = ndwi > NDWI_threshold
+        if slope is not None:
+            S2_water &= slope < 5
+    if jrc_cache is not None:
+        #去除JRC永久水体，得到洪水范围
+        S2_water = local_toolbox.remove_permanent_water(S2_water,jrc_cache,year,offset)
+    return S2_water.astype(np.uint8)
@@ -1,49 +1,65 @@
-import ee,geemap,time,os,re
-from Public_methods import Route2Roi,potential_flood,parse_TC_path,to_asset,get_JRC_water
-from GEE_python_Flood_extract_Li.Sentinel1_extract_method import S1_water_extract
-from GEE_python_Flood_extract_Li.Sentinel2_extract_method import S2_water_extract
-from GEE_python_Flood_extract_Li.modis_extract_method import modis_main 
-def ee_init():
-    #账户验证
-    # ee.Authenticate()
-    ee.Initialize();
-    #设置网路代理端口
-    geemap.set_proxy(port=7890);
+import os,re
+import ee_session
+from ee_session import ee
+from flood_utils.Public_methods import Route2Roi,potential_flood,potential_flood_mask,parse_TC_path,to_asset,get_JRC_water,ee_rate_limiter
+from flood_utils.Sentinel1_extract_method import S1_water_extract,S1_collection
+from flood_utils.Sentinel2_extract_method import S2_water_extract,S2_collection
+from flood_utils.modis_extract_method import modis_main,modis_collection
+def ee_init(**settings):
+    #初始化Earth Engine会话；项目、网络代理端口等由参数或环境变量（EE_PROJECT、EE_PROXY_PORT等）配置，见ee_session
+    ee_session.initialize(**settings);
+
+#各卫星的影像集合与水体提取函数，顺序即为波段组合的顺序
+SATELLITES = {
+    'Modis': (modis_collection,modis_main),
+    'Sentinel1': (S1_collection,S1_water_extract),
+    'Sentinel2': (S2_collection,S2_water_extract),
+}
+
+def satellite_availability(start_date,end_date,roi):
+    """
+    Counts the images of every satellite covering the period with a single request.
+
+    Args:
+        start_date (ee.Date): The start date of the typhoon.
+        end_date (ee.Date): The end date of the typhoon.
+        roi (ee.Geometry or ee.FeatureCollection): The potential flood area.
+
+    Returns:
+        dict: The number of images per satellite name in SATELLITES.
+    """
+    sizes = ee.Dictionary({name: collection(start_date,end_date,roi).size()
+                           for name,(collection,_) in SATELLITES.items()})
+    ee_rate_limiter.acquire()
+    return sizes.getInfo()
 
 #Combine the results extracted from different satellites
-def water_extract_from_satellites(start_date,end_date,potential_flood_area):
-    #依次采用不同卫星数据进行计算
-    #Sentinel-1提取
-    try:
-        Sentinel1_water = S1_water_extract(start_date,end_date,potential_flood_area).unmask();
-        time.sleep(2);
-    except:
-        Sentinel1_water = None;
-        print('NO Sentinel-1 images')
-    
-    #Sentinel-2提取
-    try:
-        Sentinel2_water = S2_water_extract(start_date,end_date,potential_flood_area).unmask();
-        time.sleep(2);
-    except:
-        Sentinel2_water =None;
-        print('NO Sentinel-2 images')
-    
-    #Modis提取
-    try:
-        modis_water = modis_main(start_date,end_date,potential_flood_area);
-        time.sleep(2);
-    except:
-        modis_water=None;
-        print('no Modis images')
-
-    #将所有图像组合
-    if modis_water:
-        satellite_water_detect = modis_water
-    if Sentinel1_water:
-        satellite_water_detect = satellite_water_detect.addBands([Sentinel1_water])
-    if Sentinel2_water:
-        satellite_water_detect = satellite_water_detect.addBands([Sentinel2_water])
+def water_extract_from_satellites(start_date,end_date,potential_flood_area,mask=None):
+    #先用一次请求检查各卫星是否有影像，只对有影像的卫星进行提取
+    availability = satellite_availability(start_date,end_date,potential_flood_area)
+    for name,count in availability.items():
+        if count == 0:
+            print(f'NO {name} images')
+    available = [name for name in SATELLITES if availability[name] > 0]
+    if not available:
+        raise ValueError('No satellite images during this period')
+
+    #各卫星的提取函数只构建计算图（仅MODIS用一次getInfo取得阈值），依次构建即可，计算在导出时于服务器上完成
+    #节省的时间来自去掉的sleep和合并的getInfo请求，而不是并行构建
+    #栅格模式下potential_flood_area为外包矩形，mask为潜在洪水区掩膜
+    extract_kwargs = {} if mask is None else {'mask': mask}
+    satellite_water = {}
+    for name in available:
+        try:
+            satellite_water[name] = ee.Image(SATELLITES[name][1](start_date,end_date,potential_flood_area,**extract_kwargs)).unmask()
+        except ee.EEException as e:
+            #只能捕获构建计算图和MODIS阈值请求中的错误，其余服务器端错误在导出任务中才出现
+            print(f'{name} water extraction failed: {e}')
+    if not satellite_water:
+        raise ValueError('Water extraction failed for every satellite')
+
+    #将所有图像组合，波段顺序与SATELLITES一致
+    satellite_water_detect = ee.Image.cat([satellite_water[name] for name in SATELLITES if name in satellite_water])
     #将所有检测到的水体相加
     total_water_detect = satellite_water_detect.reduce(ee.Reducer.sum())\
                                                 .select(['sum'],['All_water_detect']);
@@ -51,10 +67,11 @@ def water_extract_from_satellites(start_date,end_date,potential_flood_area):
 
     return satellite_water_detect.addBands([total_water_detect])
 
-def TC_flood(TargetDir,TC_file,radius):
-    #load the local shpfile of TC
-    TC_shp = geemap.shp_to_ee(TargetDir+'/'+TC_file);
+#Asset ID under which the flood image of a typhoon is saved
+def TC_asset_id(TC_info,asset_path='projects/ee-mypython/assets/'):
+    return str(asset_path+TC_info.get('TC_ID')+TC_info.get('TC_name'))
 
+def TC_flood(TargetDir,TC_file,radius,asset_path='projects/ee-mypython/assets/',export_manager=None,pfa_mode='mask',track_index=None):
     # parse the TC information from the name of TC_file
     TC_info=parse_TC_path(TC_file);
     start_date=ee.Date(TC_info.get('start_date'));
@@ -62,29 +79,42 @@ def TC_flood(TargetDir,TC_file,radius):
     year = ee.Date(start_date).get('year') 
 
     # Determin the TC influenece ranges based on the radius
-    roi = Route2Roi(TC_shp,radius);  #radius
+    if track_index is not None:
+        #轨迹缓冲区已在本地计算（track_index.TrackIndex），只上传简化后的ROI
+        roi = track_index.ee_roi(TC_info.get('TC_ID'));
+    else:
+        #load the local shpfile of TC
+        import geemap
+        TC_shp = geemap.shp_to_ee(TargetDir+'/'+TC_file);
+        roi = Route2Roi(TC_shp,radius);  #radius
 
     #Identify potential flood areas based on the precipitation furing typhoons
     #根据中国气象局标准，单日降水超过50mm即认为暴雨
     #此处认为持续时间内日平均降雨超过暴雨量即可能发生洪水
-    potential_flood_area = potential_flood(start_date,end_date,roi); 
+    #pfa_mode='mask'时潜在洪水区保持为栅格掩膜，下游只按外包矩形裁剪，避免复杂多边形的裁剪；'vector'为原来的矢量化方式
+    if pfa_mode == 'mask':
+        pfa_mask,potential_flood_area = potential_flood_mask(start_date,end_date,roi);
+    elif pfa_mode == 'vector':
+        pfa_mask,potential_flood_area = None,potential_flood(start_date,end_date,roi);
+    else:
+        raise ValueError(f"Unknown pfa_mode '{pfa_mode}', expected 'mask' or 'vector'")
 
     #根据不同卫星数据进行提取,将卫星提取的数据组合为同一image的不同波段
     #The maximum water range during the typhoon is extracted according to difference satellites
     #Return an Image with the results of different satellites for each band
-    Satellit_water_detect = water_extract_from_satellites(start_date,end_date,potential_flood_area);
+    Satellit_water_detect = water_extract_from_satellites(start_date,end_date,potential_flood_area,pfa_mask);
     
     #The JRC annual water body was used as the pre-disaster water body range
     JRC_Permanent_water = get_JRC_water(year,potential_flood_area);
+    if pfa_mask is not None:
+        JRC_Permanent_water = JRC_Permanent_water.updateMask(pfa_mask);
     #将所有数据添加至同一image
     ALL_water_combine = ee.Image(Satellit_water_detect).addBands([JRC_Permanent_water])\
                             .set(TC_info);
     
     #Save the image to Google Earth Engine's Assets
-    asset_path = 'projects/ee-mypython/assets/'  
-    save_name = TC_info.get('TC_ID')+TC_info.get('TC_name');  
-    save_asset = str(asset_path+save_name);    
-    to_asset(save_asset,ALL_water_combine,roi,250);
+    save_asset = TC_asset_id(TC_info,asset_path);
+    to_asset(save_asset,ALL_water_combine,roi,250,export_manager);
 
     print('The ',TC_file,'has been extracted ');
 
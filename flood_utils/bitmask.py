@@ -0,0 +1,243 @@
+# Bit-packed 0/1 rasters for the local path. A mask of shape (rows, cols) is stored
+# as np.packbits along the column axis, i.e. (rows, ceil(cols / 8)) bytes with the
+# first column in the most significant bit. Padding bits at the end of a row are 0.
+
+import numpy as np
+
+
+def pack(mask):
+    """
+    Packs a boolean (or 0/1) array along its last axis; NaN counts as 0.
+
+    Args:
+        mask (np.ndarray): The mask to pack.
+
+    Returns:
+        np.ndarray: uint8 array with ceil(cols / 8) bytes per row.
+    """
+    mask = np.asarray(mask)
+    if mask.dtype != bool:
+        mask = np.nan_to_num(mask) > 0
+    return np.packbits(mask, axis=-1)
+
+
+def unpack(packed, cols):
+    """
+    Unpacks a packed mask back to a boolean array with `cols` columns.
+    """
+    return np.unpackbits(packed, axis=-1, count=cols).view(bool)
+
+
+def and_not(packed, exclude):
+    """
+    Computes `packed AND NOT exclude` on the packed bytes, e.g. flood = detected water AND NOT permanent water.
+
+    Padding bits stay 0 because they are 0 in `packed`.
+
+    Args:
+        packed (np.ndarray): The packed mask to keep.
+        exclude (np.ndarray): The packed mask to remove, on the same grid.
+
+    Returns:
+        np.ndarray: The packed result.
+    """
+    return np.bitwise_and(packed, np.invert(exclude))
+
+
+# Number of set bits of every byte value, for popcounts on numpy versions without np.bitwise_count
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(packed):
+    """
+    Counts the set bits of a packed array.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(packed).sum(dtype=np.int64))
+    return int(POPCOUNT[packed].sum(dtype=np.int64))
+
+
+class BitMask:
+    """
+    A 0/1 raster stored with one bit per pixel, for the water, slope and flood masks of the local path.
+
+    Bitwise operators work on the packed bytes directly, so a mask never has to be
+    expanded to one byte (or float) per pixel.
+
+    Attributes:
+        packed (np.ndarray): uint8 array of shape (rows, ceil(cols / 8)), see pack.
+        shape (tuple): (rows, cols) of the mask.
+    """
+    def __init__(self, packed, shape):
+        self.packed = packed
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_array(cls, mask):
+        """
+        Packs a boolean or 0/1 array; NaN (masked) pixels become 0.
+        """
+        mask = np.asarray(mask)
+        return cls(pack(mask), mask.shape)
+
+    @classmethod
+    def from_raster(cls, path, band=1, window=None, chunk_rows=1024):
+        """
+        Reads a 0/1 band of a GeoTIFF (e.g. a *_flood_map.tif) into a packed mask, chunk by chunk.
+
+        Args:
+            path (str): Path of the GeoTIFF.
+            band (int): Index of the band, starting at 1.
+            window (tuple, optional): (row_off, col_off, rows, cols) to read instead of the whole band.
+            chunk_rows (int): Number of rows read at once.
+
+        Returns:
+            BitMask: The packed band, 1 where the value is positive and not nodata.
+        """
+        import rasterio
+        from rasterio.windows import Window
+        with rasterio.open(path) as dataset:
+            row_off,col_off,rows,cols = window if window is not None else (0, 0, dataset.height, dataset.width)
+            packed = np.empty((rows, (cols + 7) // 8), dtype=np.uint8)
+            for top in range(0, rows, chunk_rows):
+                height = min(chunk_rows, rows - top)
+                data = dataset.read(band, window=Window(col_off, row_off + top, cols, height), masked=True)
+                packed[top:top + height] = pack(data.filled(0) > 0)
+        return cls(packed, (rows, cols))
+
+    @classmethod
+    def zeros(cls, shape):
+        return cls(np.zeros((shape[0], (shape[1] + 7) // 8), dtype=np.uint8), shape)
+
+    def to_array(self):
+        """
+        Returns:
+            np.ndarray: The mask as a boolean array.
+        """
+        return unpack(self.packed, self.shape[1])
+
+    def _check(self, other):
+        if self.shape != other.shape:
+            raise ValueError(f'Mask shapes differ: {self.shape} and {other.shape}')
+
+    def __and__(self, other):
+        self._check(other)
+        return BitMask(self.packed & other.packed, self.shape)
+
+    def __or__(self, other):
+        self._check(other)
+        return BitMask(self.packed | other.packed, self.shape)
+
+    def __xor__(self, other):
+        self._check(other)
+        return BitMask(self.packed ^ other.packed, self.shape)
+
+    def __invert__(self):
+        inverted = np.invert(self.packed)
+        # Keep the padding bits at the end of every row 0
+        if self.shape[1] % 8:
+            inverted[:, -1] &= np.uint8(0xFF << (8 - self.shape[1] % 8) & 0xFF)
+        return BitMask(inverted, self.shape)
+
+    def and_not(self, other):
+        """
+        Returns `self AND NOT other`, e.g. flood = detected water AND NOT permanent water.
+        """
+        self._check(other)
+        return BitMask(and_not(self.packed, other.packed), self.shape)
+
+    def window(self, row_off, col_off, rows, cols):
+        """
+        Cuts a window out of the mask; byte-aligned windows are sliced without unpacking.
+
+        Returns:
+            BitMask: The window.
+        """
+        if col_off % 8 == 0:
+            packed = self.packed[row_off:row_off + rows, col_off // 8:col_off // 8 + (cols + 7) // 8].copy()
+            if cols % 8:
+                packed[:, -1] &= np.uint8(0xFF << (8 - cols % 8) & 0xFF)
+            return BitMask(packed, (rows, cols))
+        bits = unpack(self.packed[row_off:row_off + rows], self.shape[1])
+        return BitMask.from_array(bits[:, col_off:col_off + cols])
+
+    def count(self):
+        """
+        Returns:
+            int: The number of set pixels.
+        """
+        return popcount(self.packed)
+
+    def area(self, pixel_area):
+        """
+        Args:
+            pixel_area (float): Area of one pixel, e.g. resolution ** 2 in square metres.
+
+        Returns:
+            float: The area of the set pixels.
+        """
+        return self.count() * pixel_area
+
+    def occurrence(self, valid=None):
+        """
+        Percentage of set pixels among the valid pixels, like FloodEvent.flood_occurrence.
+
+        Args:
+            valid (BitMask, optional): Pixels with data (the ROI); all pixels when not given.
+
+        Returns:
+            float: The percentage, NaN when there is no valid pixel.
+        """
+        if valid is None:
+            total = self.shape[0] * self.shape[1]
+            flooded = self.count()
+        else:
+            total = valid.count()
+            flooded = (self & valid).count()
+        return 100 * flooded / total if total else float('nan')
+
+    @staticmethod
+    def majority(masks, min_votes=None):
+        """
+        Pixels set in at least `min_votes` masks, the local counterpart of thresholding All_water_detect.
+
+        The votes are counted with a bit-sliced binary counter on the packed bytes, so
+        masks are never unpacked.
+
+        Args:
+            masks (list): BitMasks of the same shape, e.g. the water of every satellite.
+            min_votes (int, optional): Votes required; a strict majority by default.
+
+        Returns:
+            BitMask: The fused mask.
+        """
+        if not masks:
+            raise ValueError('No masks to vote on')
+        if min_votes is None:
+            min_votes = len(masks) // 2 + 1
+        shape = masks[0].shape
+        for mask in masks[1:]:
+            masks[0]._check(mask)
+        if min_votes <= 0:
+            return ~BitMask.zeros(shape)
+        # planes[i] holds bit i of the per-pixel vote count
+        planes = []
+        for mask in masks:
+            carry = mask.packed
+            for i in range(len(planes)):
+                planes[i],carry = planes[i] ^ carry,planes[i] & carry
+            if carry.any():
+                planes.append(carry)
+        if min_votes >= 1 << len(planes):
+            return BitMask.zeros(shape)
+        # Compare the count with min_votes from the most significant bit down
+        greater = np.zeros_like(masks[0].packed)
+        equal = np.full_like(masks[0].packed, 0xFF)
+        for i in reversed(range(len(planes))):
+            if min_votes >> i & 1:
+                equal &= planes[i]
+            else:
+                greater |= equal & planes[i]
+                equal &= np.invert(planes[i])
+        # equal starts with every bit set, padding included, so the padding is cleared again
+        return BitMask(greater | equal, shape) & ~BitMask.zeros(shape)
@@ -0,0 +1,347 @@
+# Result storage shared by the flood and rainfall toolkits: parameter hashes, in-place
+# schema migration, batched DuckDB upserts, per-pixel Parquet tables and COG conversion.
+# flood_toolbox and rainfall_toolbox re-export everything here.
+
+import os
+import json
+import hashlib
+from profiling import profiled
+
+
+def param_hash(*params):
+    """
+    Hashes the parameters a result depends on, so results of different runs can be told apart.
+
+    Args:
+        *params: JSON-serialisable parameters (bbox, resolution, thresholds, ...).
+
+    Returns:
+        str: A short, stable hexadecimal hash.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def migrate_tables(con, tables):
+    """
+    Creates the tables that are missing and brings existing ones to the given schema, keeping their rows.
+
+    Missing columns are added in place. Tables from before ParamHash was part of the
+    primary key are rebuilt: their rows are copied out, the tables recreated and the
+    rows copied back with an empty ParamHash. All of it runs in one transaction, which
+    is rolled back on error.
+
+    Args:
+        con (duckdb.DuckDBPyConnection): The database connection.
+        tables (dict): Column and constraint definitions per table, referenced tables first.
+    """
+    existing = {name for (name,) in con.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'").fetchall()}
+    def columns(table):
+        return {row[0] for row in con.execute(f"DESCRIBE {table}").fetchall()}
+    legacy = [table for table in tables if table in existing and 'ParamHash' not in columns(table)]
+    # One transaction: an error or an interruption part way leaves the old tables and their rows untouched
+    con.begin()
+    try:
+        kept = []
+        if legacy:
+            # DuckDB cannot change a primary key, so the tables are rebuilt (referencing tables are dropped first)
+            kept = [table for table in tables if table in existing]
+            for table in kept:
+                con.execute(f"CREATE TEMP TABLE legacy_{table} AS SELECT * FROM {table}")
+            for table in reversed(kept):
+                con.execute(f"DROP TABLE {table}")
+            existing -= set(kept)
+        for table,fields in tables.items():
+            if table not in existing:
+                con.execute(f"CREATE TABLE {table} (\n    " + ",\n    ".join(fields) + "\n)")
+            else:
+                present = columns(table)
+                for field in fields:
+                    name = field.split()[0]
+                    if name not in ('PRIMARY','FOREIGN') and name not in present:
+                        con.execute(f"ALTER TABLE {table} ADD COLUMN {field}")
+                        print(f"Added column {name} to {table}")
+        for table in kept:
+            con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM legacy_{table}")
+            con.execute(f"DROP TABLE legacy_{table}")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    for table in legacy:
+        print(f"Migrated {table} to the ParamHash key")
+
+def finished_ids(con, table_name, id_column, run_hash, required_columns=()):
+    """
+    Lists the rows of a run that are already in the database, so reruns can skip them.
+
+    Args:
+        con (duckdb.DuckDBPyConnection): The database connection.
+        table_name (str): The table to look in.
+        id_column (str): EventID or DayID.
+        run_hash (str): The ParamHash of the run.
+        required_columns (iterable): Columns that must be filled for a row to count as finished.
+
+    Returns:
+        set: The IDs of the finished rows.
+    """
+    conditions = ''.join(f" AND {column} IS NOT NULL" for column in required_columns)
+    rows = con.execute(f"SELECT {id_column} FROM {table_name} WHERE ParamHash = ?{conditions}", [run_hash]).fetchall()
+    return {row[0] for row in rows}
+
+class BulkWriter:
+    """
+    Buffers result rows and writes them to a DuckDB table in batches.
+
+    Every flush registers the buffered rows as a DataFrame and inserts them all with a
+    single INSERT ... SELECT inside one transaction, instead of one INSERT per row.
+    With key_columns the insert is an upsert, so rewriting a row updates it. Used as a
+    context manager the rows still buffered are written on exit, also after an error.
+
+    Attributes:
+        connection (duckdb.DuckDBPyConnection): The database connection.
+        table_name (str): The table the rows are written to.
+        id_column (str): The column holding the row ID returned by add.
+        batch_size (int): Number of buffered rows that triggers a flush.
+        after (BulkWriter, optional): Writer flushed first, e.g. the events that day rows reference.
+        key_columns (list, optional): Primary key columns of the table, for ON CONFLICT DO UPDATE.
+    """
+    def __init__(self, connection, table_name, id_column, batch_size=1000, after=None, key_columns=None):
+        self.connection = connection
+        self.table_name = table_name
+        self.id_column = id_column
+        self.key_columns = key_columns
+        self.batch_size = batch_size
+        self.after = after
+        self.rows = []
+
+    def add(self, row):
+        """
+        Buffers one row, flushing when the batch is full.
+
+        Args:
+            row (dict): Column values of the row.
+
+        Returns:
+            The ID of the row, read from id_column.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return row[self.id_column]
+
+    @profiled('db write')
+    def flush(self):
+        """
+        Writes the buffered rows in one transaction.
+
+        Returns:
+            int: The number of rows written.
+        """
+        if self.after is not None:
+            self.after.flush()
+        if not self.rows:
+            return 0
+        import pandas as pd
+        frame = pd.DataFrame(self.rows)
+        columns = ', '.join(frame.columns)
+        sql = f"INSERT INTO {self.table_name} ({columns}) SELECT {columns} FROM buffered_rows"
+        if self.key_columns:
+            # A row may be written twice in one batch; the last version wins
+            frame = frame.drop_duplicates(self.key_columns, keep='last')
+            updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in frame.columns if column not in self.key_columns)
+            sql += f" ON CONFLICT ({', '.join(self.key_columns)}) DO UPDATE SET {updates}"
+        self.connection.register('buffered_rows', frame)
+        try:
+            self.connection.begin()
+            self.connection.execute(sql)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.unregister('buffered_rows')
+        written = len(self.rows)
+        self.rows = []
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The buffered rows are complete results, they are written after an error too
+        if exc_type is None:
+            self.flush()
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            # The original error is the one passed on
+            print(f"Could not write the rows buffered for {self.table_name}: {e}")
+
+
+class PixelTableWriter:
+    """
+    Writes the per-pixel values of the maps of every result row to a Parquet dataset.
+
+    The dataset is partitioned Hive-style by year and event,
+    {root}/{table_name}/Year={year}/EventID={event_id}/{row id}_{ParamHash}.parquet,
+    so queries filtering on Year or EventID only open the matching files. Rewriting a
+    row replaces its file. Register the datasets as DuckDB views with register_pixel_views.
+
+    Attributes:
+        root (str): Root directory of the Parquet datasets.
+        table_name (str): Name of the dataset and of its view, e.g. FloodEventPixel.
+        id_column (str): EventID or DayID.
+        columns (dict): Output column per map path column of the row, e.g. {'Flooded': 'FloodExtentMapPath'}.
+    """
+    def __init__(self, root, table_name, id_column, columns):
+        self.root = root
+        self.table_name = table_name
+        self.id_column = id_column
+        self.columns = columns
+
+    @profiled('db write')
+    def add(self, row):
+        """
+        Reads the maps of one row and writes their valid pixels.
+
+        Every pixel gets a PixelID (row * width + col on the map grid) and the Lon/Lat of
+        its centre. The maps of one row must share a grid.
+
+        Args:
+            row (dict): The result row, as passed to BulkWriter.add.
+
+        Returns:
+            str: The path of the Parquet file, or None when the row has no map.
+        """
+        import numpy as np
+        import rasterio
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        values = {}
+        grid = None
+        for column,path_column in self.columns.items():
+            path = row.get(path_column)
+            if not path or not os.path.exists(path):
+                print(f"No map for {column} of {self.id_column} {row[self.id_column]}, skipped")
+                continue
+            with rasterio.open(path) as dataset:
+                if grid is None:
+                    grid = (dataset.height, dataset.width, dataset.transform)
+                elif grid != (dataset.height, dataset.width, dataset.transform):
+                    raise ValueError(f'{path} is not on the grid of the other maps of {self.id_column} {row[self.id_column]}')
+                values[column] = dataset.read(1, masked=True)
+        if grid is None:
+            return None
+        height,width,transform = grid
+        # Pixels with data in at least one map
+        valid = ~np.logical_and.reduce([np.ma.getmaskarray(band) for band in values.values()])
+        rows,cols = np.nonzero(valid)
+        lon,lat = rasterio.transform.xy(transform, rows, cols)
+        date = row['Date'] if 'Date' in row else row['StartDate']
+        table = {
+            self.id_column: np.full(len(rows), row[self.id_column], dtype=np.int64),
+            'ParamHash': [row.get('ParamHash', '')] * len(rows),
+            'PixelID': rows.astype(np.int64) * width + cols,
+            'Lon': np.asarray(lon, dtype=np.float64),
+            'Lat': np.asarray(lat, dtype=np.float64),
+        }
+        for column,band in values.items():
+            table[column] = pa.array(band[rows, cols].astype(np.float32).filled(np.nan), from_pandas=True)
+        # EventID is a partition column; for event rows it is also the row id
+        table.pop('EventID', None)
+        folder = os.path.join(self.root, self.table_name, f"Year={date.year}", f"EventID={row['EventID']}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{row[self.id_column]}_{row.get('ParamHash', '')}.parquet")
+        pq.write_table(pa.table(table), path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return path
+
+
+def register_pixel_views(con, root):
+    """
+    Creates or replaces one DuckDB view per Parquet dataset under root, named after the dataset.
+
+    Year and EventID are read from the partition folders; files written with different
+    durations are combined by column name.
+
+    Args:
+        con (duckdb.DuckDBPyConnection): The database connection.
+        root (str): Root directory of the Parquet datasets.
+
+    Returns:
+        list: The names of the views.
+    """
+    views = []
+    for table_name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        pattern = os.path.join(os.path.abspath(root), table_name, '*', '*', '*.parquet').replace("'", "''")
+        con.execute(f"CREATE OR REPLACE VIEW {table_name} AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)")
+        views.append(table_name)
+    return views
+
+
+def _check_range(data, dtype, nodata, path):
+    """
+    Raises a ValueError when valid pixels of a masked array do not fit in dtype,
+    or equal nodata and would be masked once written.
+    """
+    import numpy as np
+    if data.count() == 0:
+        return
+    info = np.iinfo(dtype) if np.issubdtype(np.dtype(dtype), np.integer) else np.finfo(dtype)
+    low,high = data.min(), data.max()
+    if low < info.min or high > info.max:
+        raise ValueError(f"{path} holds values from {low} to {high}, which do not fit in {dtype}")
+    if nodata is not None and (data == nodata).any():
+        raise ValueError(f"{path} holds valid pixels equal to the nodata value {nodata}")
+
+@profiled('export')
+def to_cog(path, dtype=None, nodata=None, compress='DEFLATE', blocksize=512, resampling='NEAREST'):
+    """
+    Rewrites a GeoTIFF in place as a Cloud-Optimized GeoTIFF.
+
+    The result has internal tiles, compression with a predictor (horizontal
+    differencing for integers, floating point for floats) and overviews, so a viewer
+    reads only the tiles and the overview level of its viewport.
+
+    Args:
+        path (str): The GeoTIFF to convert, e.g. a map written by geemap.ee_export_image.
+        dtype (str, optional): Data type to store, e.g. 'uint8' for flood masks; unchanged by default.
+        nodata (number, optional): Nodata value for masked pixels; required when dtype cannot hold the current one.
+            Valid pixels that dtype cannot hold, or that equal nodata, raise a ValueError instead of
+            wrapping around or being masked.
+        compress (str): 'DEFLATE' or 'ZSTD'.
+        blocksize (int): Tile width and height in pixels.
+        resampling (str): Resampling of the overviews, e.g. 'NEAREST' for masks or 'AVERAGE' for rainfall.
+
+    Returns:
+        str: The path, or None when the file does not exist (e.g. a failed export).
+    """
+    import rasterio
+    from rasterio.io import MemoryFile
+    from rasterio.shutil import copy as raster_copy
+    if not os.path.exists(path):
+        print(f"No map at {path}, not converted to COG")
+        return None
+    options = dict(driver='COG', COMPRESS=compress, PREDICTOR='YES', BLOCKSIZE=blocksize,
+                   OVERVIEWS='AUTO', OVERVIEW_RESAMPLING=resampling, BIGTIFF='IF_SAFER')
+    temp_path = path + '.cog.tif'
+    with rasterio.open(path) as src:
+        if (dtype is None or dtype == src.dtypes[0]) and (nodata is None or nodata == src.nodata):
+            # GDAL streams the conversion, the raster is never read into memory
+            raster_copy(src, temp_path, **options)
+        else:
+            data = src.read(masked=True)
+            profile = src.profile
+            _check_range(data, dtype or src.dtypes[0], nodata, path)
+            profile.update(driver='GTiff', dtype=dtype or src.dtypes[0], nodata=nodata if nodata is not None else src.nodata)
+            profile.pop('blockxsize', None)
+            profile.pop('blockysize', None)
+            profile.pop('tiled', None)
+            with MemoryFile() as memfile:
+                with memfile.open(**profile) as converted:
+                    converted.write(data.filled(profile['nodata'] if profile['nodata'] is not None else 0).astype(profile['dtype']))
+                    converted.descriptions = src.descriptions
+                with memfile.open() as converted:
+                    raster_copy(converted, temp_path, **options)
+    os.replace(temp_path, path)
+    return path
@@ -0,0 +1,153 @@
+# Links rainfall events (rainfall_*.db) to the flood events (flood_*.db) they overlap or
+# precede. The source databases are attached read-only to a separate link database and
+# joined on date ranges; DuckDB plans the inequality conditions as a sort-merge range
+# join (piecewise merge join or IEJoin) instead of a nested loop. Every source event that has been
+# linked is recorded in LinkSource, so a refresh only joins the new events; the
+# TotalRainfall and FloodExtentValue of existing links are updated from the sources.
+#
+# Dates follow the event tables: StartDate is the first day, EndDate the day after the last.
+
+import duckdb
+
+LINK_TABLE = 'RainfallFloodLink'
+
+
+def initialize_link_database(con):
+    """
+    Creates the link tables if they do not exist.
+
+    RainfallFloodLink holds one row per linked pair: OverlapDays is the number of days
+    both events cover, GapDays the days from the end of the rain to the start of the
+    flood (0 when they overlap) and LagDays the days from the start of the rain to the
+    start of the flood (negative when the flood started first).
+
+    Args:
+        con (duckdb.DuckDBPyConnection): Connection to the link database.
+    """
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LINK_TABLE} (
+            RainfallEventID BIGINT,
+            RainfallParamHash VARCHAR,
+            FloodEventID BIGINT,
+            FloodParamHash VARCHAR,
+            RainfallStartDate DATE,
+            RainfallEndDate DATE,
+            FloodStartDate DATE,
+            FloodEndDate DATE,
+            TotalRainfall FLOAT,
+            FloodExtentValue FLOAT,
+            OverlapDays INTEGER,
+            GapDays INTEGER,
+            LagDays INTEGER,
+            PRIMARY KEY (RainfallEventID, RainfallParamHash, FloodEventID, FloodParamHash)
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS LinkSource (
+            Side VARCHAR,
+            EventID BIGINT,
+            ParamHash VARCHAR,
+            MaxLagDays INTEGER,
+            PRIMARY KEY (Side, EventID, ParamHash)
+        )""")
+
+
+def _attach_events(con, db_paths, alias, table_name, value_column):
+    """
+    Attaches the source databases read-only and collects their events into one temporary table.
+
+    Databases from before ParamHash existed get an empty ParamHash, like migrated rows.
+    """
+    selects = []
+    for i,db_path in enumerate(db_paths):
+        schema = f"{alias}{i}"
+        quoted = db_path.replace("'", "''")
+        con.execute(f"ATTACH '{quoted}' AS {schema} (READ_ONLY)")
+        columns = {row[0] for row in con.execute(f"DESCRIBE {schema}.{table_name}").fetchall()}
+        param_hash = 'ParamHash' if 'ParamHash' in columns else "''"
+        selects.append(f"SELECT EventID, {param_hash} AS ParamHash, StartDate, EndDate, {value_column} AS Value FROM {schema}.{table_name}")
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {alias}_events AS " + " UNION ALL ".join(selects))
+    # Events not linked yet
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE {alias}_new AS
+        SELECT * FROM {alias}_events e
+        WHERE NOT EXISTS (SELECT 1 FROM LinkSource s WHERE s.Side = '{alias}' AND s.EventID = e.EventID AND s.ParamHash = e.ParamHash)""")
+
+
+def refresh_links(link_db_path, rainfall_db_paths, flood_db_paths, max_lag_days=3):
+    """
+    Links the rainfall and flood events of the given databases, incrementally.
+
+    A rainfall event is linked to a flood event when they overlap or the flood starts
+    at most max_lag_days after the rain ends. Only pairs with at least one event that
+    was not linked before are joined; changing max_lag_days rebuilds the links. Values
+    of events rewritten since the last refresh (e.g. a rerun with a new duration) are
+    copied to their existing links.
+
+    Args:
+        link_db_path (str): The link database, created if needed.
+        rainfall_db_paths (str or list): rainfall_*.db files with a RainfallEvent table.
+        flood_db_paths (str or list): flood_*.db files with a FloodEvent table.
+        max_lag_days (int): Largest number of days between the end of the rain and the start of the flood.
+
+    Returns:
+        int: The number of links written or updated by this refresh.
+    """
+    if isinstance(rainfall_db_paths, str):
+        rainfall_db_paths = [rainfall_db_paths]
+    if isinstance(flood_db_paths, str):
+        flood_db_paths = [flood_db_paths]
+    if not rainfall_db_paths or not flood_db_paths:
+        raise ValueError('At least one rainfall and one flood database are needed')
+    con = duckdb.connect(link_db_path)
+    try:
+        initialize_link_database(con)
+        lags = {row[0] for row in con.execute("SELECT DISTINCT MaxLagDays FROM LinkSource").fetchall()}
+        if lags and lags != {max_lag_days}:
+            print(f"max_lag_days changed from {sorted(lags)} to {max_lag_days}, rebuilding the links")
+            con.execute(f"DELETE FROM {LINK_TABLE}")
+            con.execute("DELETE FROM LinkSource")
+        _attach_events(con, rainfall_db_paths, 'rain', 'RainfallEvent', 'TotalRainfall')
+        _attach_events(con, flood_db_paths, 'flood', 'FloodEvent', 'FloodExtentValue')
+
+        # New rainfall events against all flood events, and all rainfall events against new flood events
+        pair_sql = """
+            SELECT r.EventID AS RainfallEventID, r.ParamHash AS RainfallParamHash,
+                   f.EventID AS FloodEventID, f.ParamHash AS FloodParamHash,
+                   r.StartDate AS RainfallStartDate, r.EndDate AS RainfallEndDate,
+                   f.StartDate AS FloodStartDate, f.EndDate AS FloodEndDate,
+                   r.Value AS TotalRainfall, f.Value AS FloodExtentValue,
+                   greatest(0, least(r.EndDate, f.EndDate) - greatest(r.StartDate, f.StartDate)) AS OverlapDays,
+                   greatest(0, f.StartDate - r.EndDate) AS GapDays,
+                   f.StartDate - r.StartDate AS LagDays
+            FROM {rain} r JOIN {flood} f
+              ON r.StartDate < f.EndDate AND f.StartDate <= r.EndDate + CAST($lag AS INTEGER)"""
+        con.begin()
+        try:
+            written = con.execute(f"""
+                INSERT INTO {LINK_TABLE}
+                {pair_sql.format(rain='rain_new', flood='flood_events')}
+                UNION
+                {pair_sql.format(rain='rain_events', flood='flood_new')}
+                ON CONFLICT DO UPDATE SET
+                    TotalRainfall = EXCLUDED.TotalRainfall,
+                    FloodExtentValue = EXCLUDED.FloodExtentValue""", {'lag': max_lag_days}).fetchone()[0]
+            # Events linked before whose values changed in their database since
+            for column,alias,side in (('TotalRainfall','rain','Rainfall'),('FloodExtentValue','flood','Flood')):
+                written += con.execute(f"""
+                    UPDATE {LINK_TABLE} l SET {column} = e.Value
+                    FROM {alias}_events e
+                    WHERE l.{side}EventID = e.EventID AND l.{side}ParamHash = e.ParamHash
+                      AND l.{column} IS DISTINCT FROM e.Value""").fetchone()[0]
+            con.execute("""
+                INSERT OR IGNORE INTO LinkSource
+                SELECT 'rain', EventID, ParamHash, $lag FROM rain_new
+                UNION ALL
+                SELECT 'flood', EventID, ParamHash, $lag FROM flood_new""", {'lag': max_lag_days})
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+    finally:
+        con.close()
+    print(f"{written} rainfall-flood links written to {link_db_path}")
+    return written
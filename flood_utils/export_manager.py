@@ -0,0 +1,287 @@
+import time,json,uuid,threading
+from ee_session import ee
+from collections import deque
+from flood_utils.Public_methods import ee_rate_limiter
+
+# Task states that occupy one of the concurrent-task slots of the account
+ACTIVE_STATES = ('READY','RUNNING','CANCEL_REQUESTED')
+# Task states after which the task never changes again
+FINISHED_STATES = ('COMPLETED','FAILED','CANCELLED')
+
+
+class EETaskService:
+    """
+    Starts asset exports on Earth Engine and lists the state of all tasks.
+    """
+    def start(self, export):
+        """
+        Starts an image export to an asset.
+
+        Args:
+            export (dict): Keyword arguments of ee.batch.Export.image.toAsset.
+
+        Returns:
+            str: The ID of the started task.
+        """
+        task = ee.batch.Export.image.toAsset(**export)
+        task.start()
+        return task.id
+
+    def states(self):
+        """
+        Lists the state of every task of the account with a single request.
+
+        Returns:
+            dict: (state, error message) per task ID.
+        """
+        ee_rate_limiter.acquire()
+        return {task['id']: (task['state'], task.get('error_message')) for task in ee.data.getTaskList()}
+
+
+class FakeTaskService:
+    """
+    Offline stand-in for EETaskService, for testing the export manager without Earth Engine.
+
+    Every task is READY after it starts and RUNNING from the next listing call on. After
+    `running_polls` further listing calls it ends in the state given by `outcomes`.
+
+    Attributes:
+        outcomes (dict): Final states per export description, one per attempt; 'COMPLETED' when not given.
+        running_polls (int): Number of listing calls a task stays RUNNING.
+        started (list): Descriptions of all started exports, in order.
+        list_calls (int): Number of listing calls made.
+    """
+    def __init__(self, outcomes=None, running_polls=1):
+        self.outcomes = {description: list(states) for description,states in (outcomes or {}).items()}
+        self.running_polls = running_polls
+        self.started = []
+        self.list_calls = 0
+        self.tasks = {}
+        # Task IDs of two services differ, as those of two Earth Engine runs do
+        self.prefix = uuid.uuid4().hex[:8].upper()
+        self.lock = threading.Lock()
+
+    def start(self, export):
+        with self.lock:
+            description = export['description']
+            attempts = self.outcomes.get(description)
+            final_state = attempts.pop(0) if attempts else 'COMPLETED'
+            task_id = f'FAKE{self.prefix}{len(self.started):06d}'
+            self.started.append(description)
+            self.tasks[task_id] = {'state': 'READY', 'polls': 0, 'final_state': final_state}
+            return task_id
+
+    def states(self):
+        with self.lock:
+            self.list_calls += 1
+            for task in self.tasks.values():
+                if task['state'] == 'READY':
+                    task['state'] = 'RUNNING'
+                elif task['state'] == 'RUNNING':
+                    task['polls'] += 1
+                    if task['polls'] >= self.running_polls:
+                        task['state'] = task['final_state']
+            return {task_id: (task['state'], 'Fake failure' if task['state'] == 'FAILED' else None)
+                    for task_id,task in self.tasks.items()}
+
+
+class ExportManager:
+    """
+    Queues asset exports and keeps at most `max_running` of them running at once.
+
+    The states of all running exports are refreshed with one listing call per poll.
+    Failed exports are resubmitted until `max_attempts` is reached. A task missing from
+    the listing for `max_missing_polls` polls in a row counts as failed, so that a task
+    the service lost can not keep wait() polling forever; a task of an earlier run
+    (reloaded from the table) fails at the first poll that does not list it. Asset IDs, task
+    IDs and states are kept in the ExportTask table of a DuckDB file, so an interrupted
+    batch can look up what it already exported.
+
+    The export arguments hold Earth Engine objects and are only kept in memory. What
+    the caller needs to build an export again (e.g. the typhoon track) is stored as
+    its source (see describe); exports that were queued or failed in an earlier run
+    are submitted again by the caller, submit does not skip them.
+
+    Attributes:
+        service (EETaskService or FakeTaskService): The task backend.
+        max_running (int): Maximum number of exports running at once.
+        max_attempts (int): Maximum number of submissions per export.
+        max_missing_polls (int): Consecutive polls a started task may be missing from the listing.
+    """
+    def __init__(self, table_path, service=None, max_running=10, max_attempts=3, max_missing_polls=5):
+        self.service = service if service is not None else EETaskService()
+        self.max_running = max_running
+        self.max_attempts = max_attempts
+        self.max_missing_polls = max_missing_polls
+        self.queue = deque()
+        self.exports = {}
+        self.tasks = {}
+        # Reentrant, poll returns summary() while holding it
+        self.lock = threading.RLock()
+        import duckdb
+        self.con = duckdb.connect(table_path)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS ExportTask (
+                AssetID VARCHAR PRIMARY KEY,
+                Description VARCHAR,
+                TaskID VARCHAR,
+                State VARCHAR,
+                Attempts INTEGER,
+                ErrorMessage VARCHAR,
+                UpdatedAt TIMESTAMP,
+                Source VARCHAR
+        )
+        """)
+        # Tables written before the sources were kept
+        self.con.execute('ALTER TABLE ExportTask ADD COLUMN IF NOT EXISTS Source VARCHAR')
+        # Exports left running by an earlier run are polled again
+        self.reloaded = set()
+        for asset_id,description,task_id,state,attempts,error,source in self.con.execute(
+                'SELECT AssetID, Description, TaskID, State, Attempts, ErrorMessage, Source FROM ExportTask').fetchall():
+            self.tasks[asset_id] = {'task_id': task_id, 'state': state, 'attempts': attempts, 'error': error,
+                                    'description': description, 'source': json.loads(source) if source else None}
+            if state in ACTIVE_STATES:
+                self.reloaded.add(asset_id)
+
+    def _record(self, asset_id):
+        task = self.tasks[asset_id]
+        self.con.execute(
+            'INSERT OR REPLACE INTO ExportTask (AssetID, Description, TaskID, State, Attempts, ErrorMessage, UpdatedAt, Source) '
+            'VALUES (?, ?, ?, ?, ?, ?, current_timestamp, ?)',
+            (asset_id, task['description'], task['task_id'], task['state'], task['attempts'], task['error'],
+             None if task['source'] is None else json.dumps(task['source'], ensure_ascii=False)))
+
+    def _running(self):
+        return sum(1 for task in self.tasks.values() if task['state'] in ACTIVE_STATES)
+
+    def _start_queued(self):
+        while self.queue and self._running() < self.max_running:
+            asset_id = self.queue.popleft()
+            task = self.tasks[asset_id]
+            task['task_id'] = self.service.start(self.exports[asset_id])
+            task['state'] = 'READY'
+            task['attempts'] += 1
+            task['missing'] = 0
+            self._record(asset_id)
+
+    def submit(self, asset_id, export):
+        """
+        Queues an export and starts it as soon as a slot is free.
+
+        Exports already completed or still running according to the table are skipped.
+
+        Args:
+            asset_id (str): The destination asset ID, which identifies the export.
+            export (dict): Keyword arguments of ee.batch.Export.image.toAsset.
+        """
+        with self.lock:
+            task = self.tasks.get(asset_id)
+            if task is not None and task['state'] in ('COMPLETED',) + ACTIVE_STATES:
+                return
+            self.exports[asset_id] = export
+            # Started again in this run, the new task is given time to be listed
+            self.reloaded.discard(asset_id)
+            self.tasks[asset_id] = {'task_id': None, 'state': 'QUEUED', 'attempts': 0, 'error': None,
+                                    'description': export.get('description'),
+                                    'source': task['source'] if task is not None else None}
+            self.queue.append(asset_id)
+            self._record(asset_id)
+            self._start_queued()
+
+    def poll(self):
+        """
+        Refreshes the state of all running exports, resubmits failures and starts queued exports.
+
+        Returns:
+            dict: Number of exports per state.
+        """
+        with self.lock:
+            states = self.service.states()
+            for asset_id,task in self.tasks.items():
+                if task['state'] not in ACTIVE_STATES:
+                    continue
+                if task['task_id'] not in states:
+                    # A new task may be listed late; a task of an earlier run that is no longer listed can not be followed
+                    task['missing'] = task.get('missing', 0) + 1
+                    if asset_id not in self.reloaded and task['missing'] < self.max_missing_polls:
+                        continue
+                    state,error = 'FAILED','Task not found'
+                else:
+                    task['missing'] = 0
+                    state,error = states[task['task_id']]
+                if state == task['state']:
+                    continue
+                task['state'],task['error'] = state,error
+                if state == 'FAILED' and asset_id in self.exports and task['attempts'] < self.max_attempts:
+                    print(f"Export of {asset_id} failed ({error}), resubmitting")
+                    task['state'] = 'QUEUED'
+                    self.queue.append(asset_id)
+                self._record(asset_id)
+            self._start_queued()
+            return self.summary()
+
+    def describe(self, asset_id, source):
+        """
+        Stores what an export was built from next to its state.
+
+        Args:
+            asset_id (str): The destination asset ID of a submitted export.
+            source (dict): JSON-serialisable description, e.g. the manifest entry of a typhoon.
+        """
+        with self.lock:
+            self.tasks[asset_id]['source'] = source
+            self._record(asset_id)
+
+    def state(self, asset_id):
+        """
+        Returns:
+            str: The last known state of an export, None when it was never submitted.
+        """
+        with self.lock:
+            task = self.tasks.get(asset_id)
+            return task['state'] if task is not None else None
+
+    def source(self, asset_id):
+        """
+        Returns:
+            dict: The source stored with describe, None when there is none.
+        """
+        with self.lock:
+            task = self.tasks.get(asset_id)
+            return task['source'] if task is not None else None
+
+    def summary(self):
+        """
+        Counts the exports per state.
+
+        Returns:
+            dict: Number of exports per state.
+        """
+        with self.lock:
+            counts = {}
+            for task in self.tasks.values():
+                counts[task['state']] = counts.get(task['state'], 0) + 1
+            return counts
+
+    def pending(self):
+        """
+        Returns:
+            bool: Whether any export is queued or running.
+        """
+        with self.lock:
+            return bool(self.queue) or self._running() > 0
+
+    def wait(self, poll_interval=30):
+        """
+        Polls until every export has finished.
+
+        Args:
+            poll_interval (float): Seconds between two polls.
+
+        Returns:
+            dict: Number of exports per final state.
+        """
+        while self.pending():
+            time.sleep(poll_interval)
+            print('Exports:', self.poll())
+        return self.summary()
@@ -1,11 +1,9 @@
-import ee
-import geemap
-import sys
-geemap.set_proxy(port=7890)
-geemap.ee_initialize()
+from ee_session import ee
 from flood_utils.modis_extract_method import modis_main
 from flood_utils.flood_toolbox import convert_ee_date_to_py_date
 from flood_utils.flood_event import FloodEvent
+from tracing import traced
+from profiling import profile_stage
 
 class FloodDay(FloodEvent):
     """
@@ -30,6 +28,7 @@ class FloodDay(FloodEvent):
     event_id : str, optional
         The ID of the flood event.
     """
+    id_column = 'DayID'
 
     def __init__(self, date, roi, bbox, water_area_asset_path, resolution, threshold, folder_path, event_id=None):
         start_date = date 
@@ -38,8 +37,10 @@ class FloodDay(FloodEvent):
         super().__init__(start_date=start_date, end_date=end_date, roi=roi, bbox=bbox, water_area_asset_path=water_area_asset_path, resolution=resolution, threshold=threshold, folder_path=folder_path)
 
         self.event_id = event_id
+        self.trace_label = f"FloodDay {self.start_date_py}"
     
     # 重写生成数据函数
+    @traced
     def generate_flood_water(self):
         """
         Generate the flood water extent map for the given date.
@@ -57,11 +58,12 @@ class FloodDay(FloodEvent):
         try:
             # Call the individual methods to generate the maps
             flood_water = self.obtain_flood_water()
-            flood_occurrence = self.flood_occurrence(flood_water).getInfo()
+            with profile_stage('reduction'):
+                flood_occurrence = self.flood_occurrence(flood_water).getInfo()
             flood_map_path = self.folder_path + f"{self.EventID}_flood_map.tif"
         except Exception as e:
             print(f"Error generating rainfall data: {e}")
-            sys.exit(1)  # 非零退出码通常表示程序遇到了错误 
+            raise
         
         start_date_py = convert_ee_date_to_py_date(self.start_date)
         DayID = int(f"{start_date_py.strftime('%y%m%d')}")
@@ -78,14 +80,24 @@ class FloodDay(FloodEvent):
         return result
     
     # 重写保存函数
-    def to_sql(self, connection):
+    @traced
+    def to_sql(self, connection, writer=None, pixel_writer=None):
         """
         Save the flood event data to a SQL database.
 
         Parameters:
         -----------
-        connection : sqlalchemy.engine.base.Connection
+        connection : duckdb.DuckDBPyConnection
             The database connection object.
+        writer : BulkWriter, optional
+            Buffers the row for a batched write instead of writing it at once.
+        pixel_writer : PixelTableWriter, optional
+            Also writes the per-pixel values of the flood map.
+
+        Returns:
+        --------
+        int
+            The DayID of the row.
         """
         # 调用父类的 to_sql 方法并指定表名为 FloodDay
-        super().to_sql(connection, table_name="FloodDay")
\ No newline at end of file
+        return super().to_sql(connection, table_name="FloodDay", writer=writer, pixel_writer=pixel_writer)
\ No newline at end of file
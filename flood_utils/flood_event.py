@@ -1,10 +1,9 @@
-import ee
-import geemap
-import sys
-geemap.set_proxy(port=7890)
-geemap.ee_initialize()
+from ee_session import ee
 from flood_utils.modis_extract_method import modis_main
-from flood_utils.flood_toolbox import convert_ee_date_to_py_date,generate_numeric_id
+from flood_utils.flood_toolbox import convert_ee_date_to_py_date,generate_numeric_id,param_hash,to_cog,BulkWriter
+from flood_utils.zonal_stats import zonal_counts_ee,roll_up
+from tracing import traced
+from profiling import profiled,profile_stage
 
 class FloodEvent:
     """
@@ -18,6 +17,8 @@ class FloodEvent:
         resolution (int): Spatial resolution at which to perform analysis.
         threshold (float): Threshold percentage for determining flood occurrence.
     """
+    # Column identifying the rows written by to_sql
+    id_column = 'EventID'
     
     def __init__(self, start_date, end_date, roi, bbox, water_area_asset_path, resolution, threshold,folder_path):
         """
@@ -45,10 +46,13 @@ class FloodEvent:
         self.start_date_py = convert_ee_date_to_py_date(self.start_date)
         self.end_date_py = convert_ee_date_to_py_date(self.end_date)
         self.EventID = generate_numeric_id(self.start_date_py,self.end_date_py)
+        # Object of the stages in traces, see tracing.py
+        self.trace_label = f"FloodEvent {self.start_date_py} to {self.end_date_py}"
         
         # Load the regular water bodies FeatureCollection
         self.water_area = ee.FeatureCollection(water_area_asset_path)
 
+    @traced
     def obtain_flood_water(self):
         """
         Retrieve the flood water image by masking out regular water areas from MODIS data.
@@ -90,6 +94,23 @@ class FloodEvent:
         flood_proportion = flood_pixels.divide(total_pixels).multiply(100)
         return flood_proportion
 
+    @traced
+    @profiled('reduction')
+    def flood_zonal_stats(self, image):
+        """
+        Calculate the flooded area and proportion of every GAUL level-2, level-1 and level-0 unit in the region of interest.
+
+        Args:
+            image (ee.Image): The flood water image.
+
+        Returns:
+            list: One dict per administrative unit and level, see zonal_stats.roll_up.
+        """
+        counts, units = zonal_counts_ee(image, self.roi.geometry(), self.resolution)
+        return roll_up(counts, units, (self.resolution / 1000) ** 2)
+
+    @traced
+    @profiled('reduction')
     def is_flooding_event(self, image):
         """
         Determine if the flood water proportion exceeds the threshold for a flooding event.
@@ -107,6 +128,8 @@ class FloodEvent:
             'is_flooding_event': is_flooding.getInfo()
         }
 
+    @traced
+    @profiled('export')
     def download_flood_map(self, image):
         """
         Download the flood map for a given date.
@@ -117,12 +140,16 @@ class FloodEvent:
         Returns:
             str: The path to the downloaded flood map.
         """
+        import geemap
         flood_map_path = self.folder_path + f"{self.EventID}_flood_map.tif"
         geemap.ee_export_image(
             image, filename=flood_map_path, scale=self.resolution, region=self.bbox
         )
+        # Store the 0/1 flood mask as a uint8 COG, masked pixels as 255
+        to_cog(flood_map_path, dtype='uint8', nodata=255)
         return flood_map_path
     
+    @traced
     def generate_flood_water(self):
         """
         Generate the flood water data.
@@ -133,11 +160,12 @@ class FloodEvent:
         try:
             # Call the individual methods to generate the maps
             flood_water = self.obtain_flood_water()
-            flood_occurrence = self.flood_occurrence(flood_water).getInfo()
+            with profile_stage('reduction'):
+                flood_occurrence = self.flood_occurrence(flood_water).getInfo()
             flood_map_path = self.download_flood_map(flood_water)
         except Exception as e:
             print(f"Error generating rainfall data: {e}")
-            sys.exit(1)  # Non-zero exit codes usually indicate that the program encountered an error
+            raise
 
         # Compile results into a dictionary
         result = {
@@ -150,28 +178,41 @@ class FloodEvent:
 
         return result
 
-    def to_sql(self, connection, table_name="FloodEvent"):
+    def parameter_hash(self):
+        """
+        Hashes the parameters the flood results depend on, stored as ParamHash with every row.
+
+        Returns:
+            str: The hash of bbox, water_area_asset_path, resolution and threshold.
         """
-        Insert the flood event data into a SQL database.
+        return param_hash(self.bbox, self.water_area_asset_path, self.resolution, self.threshold)
+
+    @traced
+    def to_sql(self, connection, table_name="FloodEvent", writer=None, pixel_writer=None):
+        """
+        Insert the flood event data into a SQL database, updating the row if it was written before.
 
         Args:
-            connection (sqlite3.Connection): The connection to the SQL database.
+            connection (duckdb.DuckDBPyConnection): The connection to the SQL database.
             table_name (str, optional): The name of the table to insert the data into. Defaults to "FloodEvent".
+            writer (BulkWriter, optional): Buffers the row for a batched write instead of writing it at once.
+            pixel_writer (PixelTableWriter, optional): Also writes the per-pixel values of the flood map.
+
+        Returns:
+            int: The ID of the row (EventID, or DayID for flood days).
         """
         try:
             # Try to generate the flood data
             data = self.generate_flood_water()
         except Exception as e:
             print(f"Error generating flood data: {e}")
-            sys.exit(1)  # Non-zero exit codes usually indicate that the program encountered an error
-
-        # Prepare the column names and corresponding values
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(['?'] * len(data))
-        values = tuple(data.values())
-
-        # Create the INSERT INTO statement
-        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-
-        # Execute the SQL command
-        connection.execute(sql, values)
\ No newline at end of file
+            raise
+        data['ParamHash'] = self.parameter_hash()
+        if pixel_writer is not None:
+            pixel_writer.add(data)
+
+        if writer is not None:
+            return writer.add(data)
+        # Without a shared writer the row is written on its own
+        with BulkWriter(connection, table_name, self.id_column, key_columns=[self.id_column, 'ParamHash']) as single_writer:
+            return single_writer.add(data)
\ No newline at end of file
@@ -0,0 +1,145 @@
+# Per-pixel flood recurrence from many *_flood_map.tif files (FloodEvent.download_flood_map).
+# The maps are streamed block by block, so memory is bounded by the block size and
+# the number of workers rather than by the number of maps.
+
+import os
+import re
+import itertools
+import numpy as np
+import rasterio
+from datetime import datetime
+from rasterio.windows import Window
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from flood_utils.flood_toolbox import to_cog
+
+# Bands of the frequency (float32) and duration (int32, dates as YYYYMMDD) rasters, in order
+FREQUENCY_BANDS = ['FloodCount','FloodFrequency']
+DURATION_BANDS = ['FloodDays','LongestRun','FirstFlooded','LastFlooded']
+# Day number standing for "never flooded"
+NEVER = np.iinfo(np.int32).min // 2
+
+
+def map_period(path):
+    """
+    Reads the period covered by a flood map from its EventID (yymmddyymmdd) file name.
+
+    The period is [start, end), like the filterDate of the extraction, and lasts at least one day.
+
+    Returns:
+        tuple: (start, end) as numpy datetime64 days.
+    """
+    match = re.match(r'(\d{6})(\d{6})', os.path.basename(path))
+    if match is None:
+        raise ValueError(f'No EventID in the file name {path}')
+    start,end = (np.datetime64(datetime.strptime(part, '%y%m%d').date(), 'D') for part in match.groups())
+    return start,max(end,start + 1)
+
+
+def _to_yyyymmdd(days):
+    """
+    Converts days since 1970-01-01 to YYYYMMDD integers, 0 for NEVER.
+    """
+    dates = np.where(days == NEVER, 0, days).astype('datetime64[D]')
+    years = dates.astype('datetime64[Y]')
+    months = dates.astype('datetime64[M]')
+    value = ((years.astype(np.int32) + 1970) * 10000 + ((months - years).astype(np.int32) + 1) * 100
+             + (dates - months).astype(np.int32) + 1)
+    return np.where(days == NEVER, 0, value).astype(np.int32)
+
+
+def accumulate_block(maps,window):
+    """
+    Accumulates one block of all flood maps, in chronological order.
+
+    A pixel is flooded on every day of a map's period where the map is 1. Consecutive or
+    overlapping flooded periods of a pixel form one run; overlapping days count once.
+
+    Args:
+        maps (list): (start, end, path) tuples sorted by start, with datetime64 days.
+        window (rasterio.windows.Window): The block to read from every map.
+
+    Returns:
+        np.ndarray: int32 array of shape (5, rows, cols) holding FloodCount and the DURATION_BANDS.
+    """
+    shape = (int(window.height),int(window.width))
+    count = np.zeros(shape,dtype=np.int32)
+    days = np.zeros(shape,dtype=np.int32)
+    run = np.zeros(shape,dtype=np.int32)
+    longest = np.zeros(shape,dtype=np.int32)
+    first = np.full(shape,NEVER,dtype=np.int32)
+    last_end = np.full(shape,NEVER,dtype=np.int32)
+    for start,end,path in maps:
+        with rasterio.open(path) as dataset:
+            flooded = dataset.read(1,window=window,masked=True).filled(0) == 1
+        start,end = start.astype(np.int32),end.astype(np.int32)
+        # Days of this period not already counted for the pixel (last_end is exclusive)
+        new_days = np.where(flooded,np.clip(end - np.maximum(start,last_end),0,None),0)
+        continues = flooded & (start <= last_end)
+        run = np.where(continues,run + new_days,np.where(flooded,end - start,run))
+        np.maximum(longest,run,out=longest)
+        count += flooded
+        days += new_days
+        first = np.where(flooded & (first == NEVER),start,first)
+        last_end = np.where(flooded,np.maximum(last_end,end),last_end)
+    # The last flooded day is the day before the exclusive end
+    last = np.where(last_end == NEVER,NEVER,last_end - 1)
+    return np.stack([count,days,longest,_to_yyyymmdd(first),_to_yyyymmdd(last)])
+
+
+def flood_frequency(map_paths,frequency_path,duration_path,block_rows=512,workers=4,periods=None):
+    """
+    Builds the flood frequency and duration rasters from many flood maps.
+
+    All maps must share the grid of the first one (same size and geotransform), as
+    they do when exported with the same scale and bbox.
+
+    Args:
+        map_paths (list): Paths of the *_flood_map.tif files.
+        frequency_path (str): The GeoTIFF to write with the FREQUENCY_BANDS; FloodFrequency is the percentage of maps flooded.
+        duration_path (str): The GeoTIFF to write with the DURATION_BANDS.
+        block_rows (int): Number of rows per block.
+        workers (int): Number of blocks processed concurrently.
+        periods (list, optional): (start, end) per map; read from the file names when not given.
+
+    Returns:
+        tuple: (frequency_path, duration_path)
+    """
+    if not map_paths:
+        raise ValueError('No flood maps')
+    if periods is None:
+        periods = [map_period(path) for path in map_paths]
+    maps = sorted(((np.datetime64(start,'D'),np.datetime64(end,'D'),path) for (start,end),path in zip(periods,map_paths)),
+                  key=lambda item: (item[0],item[1]))
+    with rasterio.open(maps[0][2]) as dataset:
+        profile = dataset.profile
+    for _,_,path in maps[1:]:
+        with rasterio.open(path) as dataset:
+            if (dataset.width,dataset.height,dataset.transform) != (profile['width'],profile['height'],profile['transform']):
+                raise ValueError(f'{path} is not on the grid of {maps[0][2]}')
+    profile.update(nodata=None,tiled=True,blockxsize=256,blockysize=256,compress='deflate')
+    windows = [Window(0,top,profile['width'],min(block_rows,profile['height'] - top))
+               for top in range(0,profile['height'],block_rows)]
+    with rasterio.open(frequency_path,'w',**dict(profile,count=len(FREQUENCY_BANDS),dtype='float32')) as frequency, \
+         rasterio.open(duration_path,'w',**dict(profile,count=len(DURATION_BANDS),dtype='int32')) as duration:
+        frequency.descriptions = tuple(FREQUENCY_BANDS)
+        duration.descriptions = tuple(DURATION_BANDS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # At most 2 * workers blocks are in flight, so memory follows block_rows, not the raster size
+            pending = {}
+            windows = iter(windows)
+            while True:
+                for window in itertools.islice(windows,2 * workers - len(pending)):
+                    pending[executor.submit(accumulate_block,maps,window)] = window
+                if not pending:
+                    break
+                done,_ = wait(pending,return_when=FIRST_COMPLETED)
+                # Blocks are written by this thread only, as they complete, and dropped once written
+                for future in done:
+                    block,window = future.result(),pending.pop(future)
+                    count = block[0].astype(np.float32)
+                    frequency.write(np.stack([count,100 * count / len(maps)]),window=window)
+                    duration.write(block[1:],window=window)
+    # Blocks are written as they complete, so overviews and the COG layout are added afterwards
+    to_cog(frequency_path,resampling='AVERAGE')
+    to_cog(duration_path)
+    return frequency_path,duration_path
@@ -1,9 +1,9 @@
-import ee
+from ee_session import ee
 from datetime import timedelta,datetime
 from flood_utils.flood_day import FloodDay
 from flood_utils.flood_event import FloodEvent
-from flood_utils.flood_toolbox import ininialize_database
-import duckdb
+from flood_utils.flood_toolbox import ininialize_database,generate_numeric_id,param_hash,finished_ids,BulkWriter,PixelTableWriter,register_pixel_views
+from tracing import traced
 
 class FloodPeriod:
     """
@@ -62,6 +62,7 @@ class FloodPeriod:
         self.threshold = threshold
         self.folder_path = folder_path
 
+    @traced
     def generate_flood_days(self):
         """
         Generates a list of flood days.
@@ -165,56 +166,92 @@ class FloodPeriod:
         return all_events_with_details
     
 
-    def process_flood_events(self,flood_events_with_details,db_path):
+    @traced
+    def process_flood_events(self,flood_events_with_details,db_path,pixel_dir=None):
         """
         Processes a series of flood events, obtains flood images, downloads flood maps, and stores event information in a database.
 
+        The flooded area of every administrative unit hit by an event is stored in FloodZonalStats.
+        Events and days already stored for the same parameters are skipped, so an interrupted run can be resumed.
+
         :param flood_events_with_details: list, list containing detailed information about flood events
-        :param con: database connection object
+        :param db_path: str, path of the database
+        :param pixel_dir: str, optional, also write the per-pixel flood flags as Parquet under this folder and register them as the FloodEventPixel and FloodDayPixel views
         """
+        import duckdb
         ininialize_database(db_path)
         con = duckdb.connect(database=db_path)
+        # 本次运行参数的哈希，与结果一起存储；已完成的事件和日期不再重复计算
+        run_hash = param_hash(self.bbox, self.water_area_asset_path, self.resolution, self.threshold)
+        done_events = finished_ids(con, 'FloodEvent', 'EventID', run_hash)
+        done_days = finished_ids(con, 'FloodDay', 'DayID', run_hash)
+        # 每个事件的结果一次性写入（重复写入时更新已有记录）；每日记录写入前先写入其所属的事件
+        event_writer = BulkWriter(con, 'FloodEvent', 'EventID', key_columns=['EventID', 'ParamHash'])
+        zonal_writer = BulkWriter(con, 'FloodZonalStats', 'EventID', after=event_writer, key_columns=['EventID', 'ParamHash', 'Level', 'Code'])
+        day_writer = BulkWriter(con, 'FloodDay', 'DayID', after=zonal_writer, key_columns=['DayID', 'ParamHash'])
+        # 可选：逐像素结果写入按年份和事件分区的 Parquet
+        event_pixel_writer = PixelTableWriter(pixel_dir, 'FloodEventPixel', 'EventID', {'Flooded': 'FloodExtentMapPath'}) if pixel_dir else None
+        day_pixel_writer = PixelTableWriter(pixel_dir, 'FloodDayPixel', 'DayID', {'Flooded': 'FloodExtentMapPath'}) if pixel_dir else None
 
-        for flood_event in flood_events_with_details:
-            # Create an instance of the flood event
-            event = FloodEvent(
-                start_date=ee.Date(flood_event['start_date']),
-                end_date=ee.Date(flood_event['end_date']),
-                roi= self.roi,
-                bbox=self.bbox,
-                water_area_asset_path=self.water_area_asset_path,
-                resolution=self.resolution,
-                threshold=self.threshold,
-                folder_path=self.folder_path
-            )
-            
-            # Obtain the water image for the flood event
-            event_image = event.obtain_flood_water()
-            # 下载洪水地图
-            event_download_path = event.download_flood_map(event_image)
+        # 出错时也写入已缓存的完整记录，下次运行从中断处继续
+        with day_writer:
+            for flood_event in flood_events_with_details:
+                event_id = generate_numeric_id(datetime.strptime(flood_event['start_date'], "%Y-%m-%d"),
+                                               datetime.strptime(flood_event['end_date'], "%Y-%m-%d"))
+                pending_days = [flood_day for flood_day in flood_event['event_days_str']
+                                if int(datetime.strptime(flood_day, "%Y-%m-%d").strftime('%y%m%d')) not in done_days]
+                if event_id in done_events and not pending_days:
+                    print(f"Skipping event from {flood_event['start_date']} to {flood_event['end_date']}, already in the database")
+                    continue
 
-            # 打印下载洪水地图的地址    
-            print(f"Downloaded flood map for event from {flood_event['start_date']} to {flood_event['end_date']}: {event_download_path}")
-            
-            # 将洪水事件信息存储到数据库
-            event.to_sql(con)
+                # Create an instance of the flood event
+                event = FloodEvent(
+                    start_date=ee.Date(flood_event['start_date']),
+                    end_date=ee.Date(flood_event['end_date']),
+                    roi= self.roi,
+                    bbox=self.bbox,
+                    water_area_asset_path=self.water_area_asset_path,
+                    resolution=self.resolution,
+                    threshold=self.threshold,
+                    folder_path=self.folder_path
+                )
             
-            # 从数据库中获取最新的事件ID
-            event_id = con.execute('SELECT EventID FROM FloodEvent ORDER BY EventID DESC LIMIT 1').fetchone()[0]
+                if event_id not in done_events:
+                    # Obtain the water image for the flood event
+                    event_image = event.obtain_flood_water()
+                    # 下载洪水地图
+                    event_download_path = event.download_flood_map(event_image)
+
+                    # 打印下载洪水地图的地址    
+                    print(f"Downloaded flood map for event from {flood_event['start_date']} to {flood_event['end_date']}: {event_download_path}")
+                
+                    # 各级行政区的洪水面积和比例
+                    zonal_rows = event.flood_zonal_stats(event_image)
+
+                    # 将洪水事件信息存储到数据库，直接得到事件ID
+                    event_id = event.to_sql(con, writer=event_writer, pixel_writer=event_pixel_writer)
+                    for row in zonal_rows:
+                        zonal_writer.add(dict(row, EventID=event_id, ParamHash=run_hash))
             
-            # 处理每一天的洪水数据
-            for flood_day in flood_event['event_days_str']:
-                # 创建每一天洪水的实例
-                day = FloodDay(
-                    date=ee.Date(flood_day),
-                    roi = self.roi,
-                    bbox = self.bbox,
-                    water_area_asset_path = self.water_area_asset_path,
-                    resolution = self.resolution,
-                    threshold = self.threshold,
-                    folder_path = self.folder_path,
-                    event_id = event_id
-                )
+                # 处理尚未存储的每一天的洪水数据
+                for flood_day in pending_days:
+                    # 创建每一天洪水的实例
+                    day = FloodDay(
+                        date=ee.Date(flood_day),
+                        roi = self.roi,
+                        bbox = self.bbox,
+                        water_area_asset_path = self.water_area_asset_path,
+                        resolution = self.resolution,
+                        threshold = self.threshold,
+                        folder_path = self.folder_path,
+                        event_id = event_id
+                    )
                 
-                # 将每天的洪水数据存储到数据库
-                day.to_sql(con)
+                    # 将每天的洪水数据存储到数据库
+                    day.to_sql(con, writer=day_writer, pixel_writer=day_pixel_writer)
+                # 每个事件完成后立即写入，出错时已完成的事件不会丢失
+                day_writer.flush()
+
+        if pixel_dir:
+            register_pixel_views(con, pixel_dir)
+        con.close()
@@ -1,7 +1,6 @@
 from datetime import datetime 
-import duckdb
-import ee
-import os
+from ee_session import ee
+from flood_utils.db_tools import param_hash,migrate_tables,finished_ids,BulkWriter,PixelTableWriter,register_pixel_views,to_cog
 
 def convert_ee_date_to_py_date(ee_date):
     """
@@ -41,7 +40,10 @@ def generate_numeric_id(start_date, end_date):
 
 def ininialize_database(db_path):
     """
-    Initialize a new DuckDB database at the specified path, creating FloodEvent and FloodDay tables.
+    Opens the DuckDB database at the specified path, creating or migrating the FloodEvent, FloodDay and FloodZonalStats tables.
+
+    Existing results are kept: rows are keyed on EventID/DayID plus the ParamHash of the
+    parameters they were computed with, and written with upserts.
     
     Args:
         db_path (str): The path where the database file will be located.
@@ -49,50 +51,55 @@ def ininialize_database(db_path):
     Returns:
         None
     """
-    # Check if the database file already exists at the path
-    if os.path.exists(db_path):
-        # If it exists, remove the database file
-        os.remove(db_path)
-        print(f"Removed existing database at {db_path}")
-
-    # Create SQL commands for creating the FloodEvent table
-    create_flood_event_sql = """
-        CREATE TABLE IF NOT EXISTS FloodEvent (
-            EventID BIGINT PRIMARY KEY,
-            StartDate DATE,
-            EndDate DATE,
-            FloodExtentValue FLOAT,
-            FloodExtentMapPath VARCHAR
-    )
-    """
+    tables = {
+        'FloodEvent': [
+            "EventID BIGINT",
+            "ParamHash VARCHAR DEFAULT ''",
+            "StartDate DATE",
+            "EndDate DATE",
+            "FloodExtentValue FLOAT",
+            "FloodExtentMapPath VARCHAR",
+            "PRIMARY KEY (EventID, ParamHash)"
+        ],
+        'FloodDay': [
+            "DayID INTEGER",
+            "ParamHash VARCHAR DEFAULT ''",
+            "EventID BIGINT",
+            "Date DATE",
+            "FloodExtentValue FLOAT",
+            "FloodExtentMapPath VARCHAR",
+            "PRIMARY KEY (DayID, ParamHash)",
+            "FOREIGN KEY (EventID, ParamHash) REFERENCES FloodEvent (EventID, ParamHash)"
+        ],
+        # Flooded area and proportion of every administrative unit hit by an event, see zonal_stats.roll_up
+        'FloodZonalStats': [
+            "EventID BIGINT",
+            "ParamHash VARCHAR DEFAULT ''",
+            "Level INTEGER",
+            "Code BIGINT",
+            "Name VARCHAR",
+            "ParentCode BIGINT",
+            "ValidPixels BIGINT",
+            "FloodedPixels BIGINT",
+            "FloodedArea DOUBLE",
+            "FloodProportion DOUBLE",
+            "PRIMARY KEY (EventID, ParamHash, Level, Code)",
+            "FOREIGN KEY (EventID, ParamHash) REFERENCES FloodEvent (EventID, ParamHash)"
+        ]
+    }
 
-    # Create SQL commands for creating the FloodDay table
-    create_flood_day_sql = """
-        CREATE TABLE IF NOT EXISTS FloodDay (
-            DayID INTEGER PRIMARY KEY,
-            EventID BIGINT,
-            Date DATE,
-            FloodExtentValue FLOAT,
-            FloodExtentMapPath VARCHAR,
-            FOREIGN KEY(EventID) REFERENCES FloodEvent(EventID)
-    )
-    """
-
-    # Connect to DuckDB
+    # Connect to DuckDB, creating the file if needed
+    import duckdb
     con = duckdb.connect(db_path)
 
-    # Execute the SQL command for creating the FloodEvent table
-    con.execute(create_flood_event_sql)
-
-    # Execute the SQL command for creating the FloodDay table
-    con.execute(create_flood_day_sql)
+    # Create the missing tables and bring existing ones to the current schema
+    migrate_tables(con, tables)
 
     # Close the database connection
     con.close()
     
     print(f"Database initialized at {db_path}")
 
-
 def format_db_path(start_date, end_date, folder_path_template):
     """
     Formats the database path using the start and end dates.
@@ -0,0 +1,182 @@
+# Local cache of the yearly JRC permanent-water layer (Public_methods.get_JRC_water).
+# Every year is fetched once over the working extent, in tiles, and stored bit-packed
+# (see bitmask), so the local flood masks of one year share it instead of downloading
+# it again: S1_water_extract_local and S2_water_extract_local take a JRCCache and
+# remove its permanent water from their result (local_toolbox.remove_permanent_water).
+#
+# The Earth Engine runs do not use it: TC_flood builds the JRC band on the server and
+# exports it with the satellite bands, and FloodPeriod masks with its own water asset.
+#
+# Layout: {cache_dir}/{year}/{tile_row}_{tile_col}.npy, one packed tile per file, on a
+# regular EPSG:4326 grid whose row 0 is the northern row.
+
+import os
+from ee_session import ee
+import numpy as np
+from flood_utils import bitmask
+from flood_utils.Public_methods import get_JRC_water,ee_rate_limiter
+
+
+class JRCCache:
+    """
+    Bit-packed, tiled cache of the yearly JRC permanent water over a fixed extent.
+
+    Attributes:
+        cache_dir (str): Root directory of the cache.
+        extent (tuple): (west, south, east, north) of the working extent in degrees.
+        resolution (float): Pixel size in degrees.
+        tile_size (int): Tile width and height in pixels, a multiple of 8.
+        rows (int): Number of pixel rows of the grid.
+        cols (int): Number of pixel columns of the grid.
+    """
+    def __init__(self, cache_dir, extent, resolution=0.0025, tile_size=4096):
+        if tile_size % 8:
+            raise ValueError('tile_size must be a multiple of 8')
+        self.cache_dir = cache_dir
+        self.extent = extent
+        self.resolution = resolution
+        self.tile_size = tile_size
+        west,south,east,north = extent
+        self.rows = int(np.ceil(round((north - south) / resolution, 6)))
+        self.cols = int(np.ceil(round((east - west) / resolution, 6)))
+
+    def tile_path(self, year, tile_row, tile_col):
+        return os.path.join(self.cache_dir, str(year), f'{tile_row}_{tile_col}.npy')
+
+    def tiles(self):
+        """
+        Yields:
+            tuple: (tile_row, tile_col, row offset, col offset, rows, cols) of every tile of the grid.
+        """
+        for row_off in range(0, self.rows, self.tile_size):
+            for col_off in range(0, self.cols, self.tile_size):
+                yield (row_off // self.tile_size, col_off // self.tile_size, row_off, col_off,
+                       min(self.tile_size, self.rows - row_off), min(self.tile_size, self.cols - col_off))
+
+    def download_tile(self, year, row_off, col_off, rows, cols):
+        """
+        Computes one tile of the permanent-water layer on Earth Engine.
+
+        The layer is cast to uint8 first, so a full 4096 x 4096 tile is 16 MB and stays
+        under the computePixels request size limit (the remapped band is wider otherwise).
+
+        Returns:
+            np.ndarray: Boolean array of shape (rows, cols).
+        """
+        west,_,_,north = self.extent
+        x0 = west + col_off * self.resolution
+        y0 = north - row_off * self.resolution
+        region = ee.Geometry.Rectangle([x0, y0 - rows * self.resolution, x0 + cols * self.resolution, y0], 'EPSG:4326', False)
+        ee_rate_limiter.acquire()
+        pixels = ee.data.computePixels({
+            'expression': get_JRC_water(year, region).toUint8(),
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': {
+                'dimensions': {'width': cols, 'height': rows},
+                'affineTransform': {'scaleX': self.resolution, 'shearX': 0, 'translateX': x0,
+                                    'shearY': 0, 'scaleY': -self.resolution, 'translateY': y0},
+                'crsCode': 'EPSG:4326',
+            },
+        })
+        return pixels['jrc_perm_yearly'] > 0
+
+    def fetch(self, year):
+        """
+        Downloads the tiles of a year that are not cached yet.
+
+        Args:
+            year (int): The year of the JRC layer.
+
+        Returns:
+            int: The number of tiles downloaded.
+        """
+        os.makedirs(os.path.join(self.cache_dir, str(year)), exist_ok=True)
+        downloaded = 0
+        for tile_row,tile_col,row_off,col_off,rows,cols in self.tiles():
+            path = self.tile_path(year, tile_row, tile_col)
+            if os.path.exists(path):
+                continue
+            packed = bitmask.pack(self.download_tile(year, row_off, col_off, rows, cols))
+            # Write then rename, so an interrupted download never leaves a partial tile
+            np.save(path + '.tmp.npy', packed)
+            os.replace(path + '.tmp.npy', path)
+            downloaded += 1
+        return downloaded
+
+    def read_packed(self, year, row_off, col_off, rows, cols):
+        """
+        Reads a window of the packed permanent-water layer, fetching the year if needed.
+
+        When col_off is a multiple of 8 the packed bytes are copied without unpacking.
+
+        Args:
+            year (int): The year of the JRC layer.
+            row_off, col_off (int): Offset of the window in the cache grid.
+            rows, cols (int): Size of the window.
+
+        Returns:
+            np.ndarray: The packed window, ceil(cols / 8) bytes per row.
+        """
+        if row_off < 0 or col_off < 0 or row_off + rows > self.rows or col_off + cols > self.cols:
+            raise ValueError('Window outside the cached extent')
+        self.fetch(year)
+        size = self.tile_size
+        aligned = col_off % 8 == 0
+        out = np.zeros((rows, (cols + 7) // 8), dtype=np.uint8) if aligned else np.zeros((rows, cols), dtype=bool)
+        for tile_row in range(row_off // size, (row_off + rows - 1) // size + 1):
+            for tile_col in range(col_off // size, (col_off + cols - 1) // size + 1):
+                tile = np.load(self.tile_path(year, tile_row, tile_col), mmap_mode='r')
+                # Window rows and columns covered by this tile, in window and in tile coordinates
+                r0,r1 = max(row_off, tile_row * size), min(row_off + rows, (tile_row + 1) * size)
+                c0,c1 = max(col_off, tile_col * size), min(col_off + cols, (tile_col + 1) * size)
+                tile_rows = slice(r0 - tile_row * size, r1 - tile_row * size)
+                if aligned:
+                    # Tiles are multiples of 8 wide, so both offsets fall on byte boundaries
+                    b0 = (c0 - tile_col * size) // 8
+                    nbytes = (c1 - c0 + 7) // 8
+                    out[r0 - row_off:r1 - row_off, (c0 - col_off) // 8:(c0 - col_off) // 8 + nbytes] = tile[tile_rows, b0:b0 + nbytes]
+                else:
+                    bits = np.unpackbits(tile[tile_rows], axis=-1).view(bool)
+                    out[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = bits[:, c0 - tile_col * size:c1 - tile_col * size]
+        if aligned:
+            # A window ending inside a byte keeps tile bits beyond it; clear them so padding stays 0
+            if cols % 8:
+                out[:, -1] &= np.uint8(0xFF << (8 - cols % 8) & 0xFF)
+            return out
+        return bitmask.pack(out)
+
+    def window(self, bounds):
+        """
+        Converts (west, south, east, north) bounds to the covering pixel window of the cache grid.
+
+        Returns:
+            tuple: (row_off, col_off, rows, cols)
+        """
+        west,south,east,north = bounds
+        x0,_,_,y0 = self.extent
+        # Rounding first keeps bounds that fall on pixel edges from slipping into the neighbouring pixel
+        col_off = max(0, int(np.floor(round((west - x0) / self.resolution, 6))))
+        row_off = max(0, int(np.floor(round((y0 - north) / self.resolution, 6))))
+        col_end = min(self.cols, int(np.ceil(round((east - x0) / self.resolution, 6))))
+        row_end = min(self.rows, int(np.ceil(round((y0 - south) / self.resolution, 6))))
+        return row_off, col_off, row_end - row_off, col_end - col_off
+
+    def read_mask(self, year, row_off, col_off, rows, cols):
+        """
+        Reads a window of the permanent-water layer as a BitMask, see read_packed.
+        """
+        return bitmask.BitMask(self.read_packed(year, row_off, col_off, rows, cols), (rows, cols))
+
+    def flood_extent(self, water, year, row_off, col_off):
+        """
+        Removes the permanent water of a year from a water mask on the cache grid.
+
+        Args:
+            water (BitMask): Detected water, e.g. BitMask.from_array(S1_water_extract_local(...)).
+            year (int): The year of the JRC layer.
+            row_off, col_off (int): Offset of the water mask in the cache grid.
+
+        Returns:
+            BitMask: The flood extent (water AND NOT permanent water), computed on the packed bits.
+        """
+        return water.and_not(self.read_mask(year, row_off, col_off, *water.shape))
@@ -0,0 +1,502 @@
+# Local NumPy counterparts of the Earth Engine image operations used by the
+# flood extraction methods. Images are arrays whose last two axes are rows
+# (row 0 is the northern row) and columns, optionally preceded by a band axis,
+# and masked pixels are NaN, mirroring masked pixels on the server.
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Kernels used by Sentinel1_extract_method.RefinedLee
+# Offsets (dy, dx) of the nine 3x3 sample windows picked by sample_kernel, in neighborhoodToBands order
+SAMPLE_OFFSETS = [(-2, -2), (-2, 0), (-2, 2), (0, -2), (0, 0), (0, 2), (2, -2), (2, 0), (2, 2)]
+BOX3_WEIGHTS = np.ones((3, 3), dtype=bool)
+RECT_WEIGHTS = np.array([[0] * 7] * 3 + [[1] * 7] * 4, dtype=bool)
+DIAG_WEIGHTS = np.tril(np.ones((7, 7), dtype=bool))
+# Number of rows a block needs on each side so that RefinedLee is exact inside it
+LEE_HALO = 3
+
+
+def kernel_lines(weights):
+    """
+    Splits a kernel into line sums of row prefix sums, when it has that form.
+
+    Every nonzero row of the kernel must be one run of cells, and the left and the
+    right ends of the runs must each stay in one column or move along one diagonal,
+    as for rectangles and the rotations of DIAG_WEIGHTS. The kernel sum is then the
+    sum over its rows of Q[y+dy, x+right] - Q[y+dy, x+left], Q being the row prefix
+    sums, i.e. two sums of Q along a column or a diagonal.
+
+    Args:
+        weights (np.ndarray): Boolean kernel with odd sides, centred on the pixel.
+
+    Returns:
+        list: (sign, slope, dy0, dy1, dx0) per line, the sum over dy0 <= dy <= dy1 of
+        Q[y+dy, x+dx0+slope*(dy-dy0)]; None when the kernel can not be split.
+    """
+    cy, cx = weights.shape[0] // 2, weights.shape[1] // 2
+    runs = [np.flatnonzero(row) for row in weights]
+    used = [i for i, cols in enumerate(runs) if cols.size]
+    if not used or used[-1] - used[0] + 1 != len(used):
+        return None
+    if any(runs[i][-1] - runs[i][0] + 1 != runs[i].size for i in used):
+        return None
+    lines = []
+    for sign, ends in ((1, [runs[i][-1] + 1 - cx for i in used]), (-1, [runs[i][0] - cx for i in used])):
+        slope = ends[1] - ends[0] if len(ends) > 1 else 0
+        if slope not in (-1, 0, 1) or ends != [ends[0] + slope * k for k in range(len(ends))]:
+            return None
+        lines.append((sign, slope, used[0] - cy, used[-1] - cy, ends[0]))
+    return lines
+
+
+def line_tables(planes):
+    """
+    Builds the cumulative sums of the row prefix sums Q[y, c] = planes[y, :c].sum() used by line sums.
+
+    Args:
+        planes (np.ndarray): Array of shape (..., H, W, k), summed along its rows and columns for each of the k planes.
+
+    Returns:
+        tuple: Float64 tables of shape (..., H+1, W+2, k), each with a zero first row:
+        along columns, C[y, c] = Q[:y, c].sum(); along diagonals, G1[y+1, c+1] = Q[y, c] + G1[y, c];
+        along anti-diagonals, G2[y+1, c] = Q[y, c] + G2[y, c+1].
+    """
+    H, W, k = planes.shape[-3:]
+    lead = planes.shape[:-3]
+    Q = np.zeros(lead + (H, W + 1, k))
+    np.cumsum(planes, axis=-2, dtype=np.float64, out=Q[..., 1:, :])
+    C = np.zeros(lead + (H + 1, W + 2, k))
+    np.cumsum(Q, axis=-3, out=C[..., 1:, :W + 1, :])
+    G1 = np.zeros_like(C)
+    G2 = np.zeros_like(C)
+    for y in range(H):
+        np.add(Q[..., y, :, :], G1[..., y, :W + 1, :], out=G1[..., y + 1, 1:, :])
+        np.add(Q[..., y, :, :], G2[..., y, 1:, :], out=G2[..., y + 1, :W + 1, :])
+    return C, G1, G2
+
+
+class Neighborhood:
+    """
+    Neighbourhood means and variances of one image, as reduceNeighborhood computes them.
+
+    The values, squared values and valid counts are kept as float32 planes. Their
+    line_tables (float64) are built once and shared by every kernel that kernel_lines
+    can split, i.e. the 3x3 box and all rotations of RECT_WEIGHTS and DIAG_WEIGHTS,
+    so that each of them costs four table lookups per pixel. Masked (NaN) pixels are
+    left out of the statistics, as on the server.
+
+    Attributes:
+        radius (int): The largest kernel radius that can be evaluated.
+        planes (np.ndarray): Values, squared values and valid counts on a last axis, zero-padded by radius.
+    """
+
+    def __init__(self, image, radius=LEE_HALO):
+        valid = ~np.isnan(image)
+        values = np.where(valid, image, 0).astype(np.float32)
+        self.radius = radius
+        self.shape = image.shape
+        pad_width = [(0, 0)] * (image.ndim - 2) + [(radius, radius)] * 2 + [(0, 0)]
+        self.planes = np.pad(np.stack([values, values * values, valid.astype(np.float32)], axis=-1), pad_width)
+        self._tables = None
+
+    def _sums(self, weights, index=None):
+        lines = kernel_lines(weights)
+        if lines is None or max(weights.shape) // 2 > self.radius:
+            return self._direct_sums(weights, index)
+        r = self.radius
+        H, W = self.shape[-2:]
+        width = W + 2 * r + 2
+        if self._tables is None:
+            self._tables = line_tables(self.planes)
+            # Flat position of every pixel in the tables
+            lead = np.arange(int(np.prod(self.shape[:-2]))).reshape(self.shape[:-2] + (1, 1))
+            self._base = (lead * (H + 2 * r + 1) + np.arange(r, r + H)[:, None]) * width + np.arange(r, r + W)
+        # Each line is the difference of two table entries, at (row, column) offsets from the padded pixel
+        lookups = []
+        for sign, slope, dy0, dy1, dx0 in lines:
+            dx1 = dx0 + slope * (dy1 - dy0)
+            if slope == 0:
+                lookups += [(0, dy1 + 1, dx0, sign), (0, dy0, dx0, -sign)]
+            elif slope == 1:
+                lookups += [(1, dy1 + 1, dx1 + 1, sign), (1, dy0, dx0, -sign)]
+            else:
+                lookups += [(2, dy1 + 1, dx1, sign), (2, dy0, dx0 + 1, -sign)]
+        if index is not None:
+            base = self._base.reshape(-1)[index]
+        total = 0
+        for kind, dy, dx, sign in lookups:
+            table = self._tables[kind]
+            if index is None:
+                term = table[..., r + dy:r + dy + H, r + dx:r + dx + W, :]
+            else:
+                term = table.reshape(-1, table.shape[-1]).take(base + (dy * width + dx), axis=0)
+            total = total + term if sign > 0 else total - term
+        return np.moveaxis(total, -1, 0)
+
+    def _direct_sums(self, weights, index=None):
+        r = self.radius
+        H, W = self.shape[-2:]
+        cy, cx = weights.shape[0] // 2, weights.shape[1] // 2
+        total = np.zeros(self.shape + self.planes.shape[-1:])
+        for i, j in zip(*np.nonzero(weights)):
+            y0, x0 = r + i - cy, r + j - cx
+            total += self.planes[..., y0:y0 + H, x0:x0 + W, :]
+        if index is not None:
+            total = total.reshape(-1, total.shape[-1])[index]
+        return np.moveaxis(total, -1, 0)
+
+    def moments(self, weights, index=None):
+        """
+        Computes the mean and population variance (as ee.Reducer.variance) of every neighbourhood.
+
+        Args:
+            weights (np.ndarray): Boolean kernel with odd sides, centred on the pixel.
+            index (np.ndarray, optional): Flat indices of the pixels to compute; only these are returned, as 1-D arrays.
+
+        Returns:
+            tuple: Float32 (mean, variance) arrays, NaN where the neighbourhood is empty.
+        """
+        s, s2, n = self._sums(weights, index)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s / n
+            var = np.maximum(s2 / n - mean * mean, 0)
+        mean[n == 0] = np.nan
+        var[n == 0] = np.nan
+        return mean.astype(np.float32), var.astype(np.float32)
+
+
+class DirectNeighborhood(Neighborhood):
+    """
+    Neighborhood that adds one shifted array per kernel cell.
+
+    This is the literal O(kernel size) form of reduceNeighborhood and serves as the
+    reference for the line-sum implementation.
+    """
+
+    def _sums(self, weights, index=None):
+        return self._direct_sums(weights, index)
+
+
+# Compare-exchanges that move the five smallest of nine values to positions 0-4
+# (a 25-comparator sorting network with the exchanges inside either group left out)
+SELECT5_OF_9 = [(0, 1), (3, 4), (6, 7), (1, 2), (4, 5), (7, 8), (0, 1), (3, 4), (6, 7),
+                (0, 3), (3, 6), (1, 4), (4, 7), (1, 4), (5, 8), (2, 5), (2, 6), (4, 6)]
+
+
+def _refined_lee_block(img, neighborhood):
+    """Applies RefinedLee to one float32 block, `neighborhood` is the Neighborhood class to use."""
+    stats = neighborhood(img, LEE_HALO)
+    H, W = img.shape[-2:]
+
+    mean3, variance3 = stats.moments(BOX3_WEIGHTS)
+    # Means of the nine 3x3 windows inside the 7x7 window, and their noise statistics,
+    # as views of the 3x3 statistics padded with NaN
+    pad_width = [(0, 0)] * (img.ndim - 2) + [(2, 2)] * 2
+    mean3 = np.pad(mean3, pad_width, constant_values=np.nan)
+    variance3 = np.pad(variance3, pad_width, constant_values=np.nan)
+    s = [mean3[..., 2 + dy:2 + dy + H, 2 + dx:2 + dx + W] for dy, dx in SAMPLE_OFFSETS]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sample_stats = [variance3[..., 2 + dy:2 + dy + H, 2 + dx:2 + dx + W] / (m * m)
+                        for (dy, dx), m in zip(SAMPLE_OFFSETS, s)]
+
+    # Four gradients; each of them gives two possible directions
+    pairs = [(1, 7), (6, 2), (3, 5), (0, 8)]
+    gradients = [np.abs(s[i] - s[j]) for i, j in pairs]
+    max_gradient = np.maximum(np.maximum(gradients[0], gradients[1]), np.maximum(gradients[2], gradients[3]))
+    directions = np.zeros(img.shape, dtype=np.uint8)
+    for k, ((i, j), gradient) in enumerate(zip(pairs, gradients)):
+        towards = (s[i] - s[4]) > (s[4] - s[j])
+        directions += (gradient == max_gradient) * np.where(towards, np.uint8(k + 1), np.uint8(k + 5))
+
+    # Local noise variance: mean of the five smallest sample statistics. NaN spreads
+    # through both outputs of every exchange, so a masked sample gives NaN as before.
+    for i, j in SELECT5_OF_9:
+        sample_stats[i], sample_stats[j] = np.minimum(sample_stats[i], sample_stats[j]), np.maximum(sample_stats[i], sample_stats[j])
+    sigmaV = (sample_stats[0] + sample_stats[1] + sample_stats[2] + sample_stats[3] + sample_stats[4]) / 5
+
+    # Directional statistics; odd directions use the rectangle, even ones the triangle.
+    # The pixels are grouped by direction once, each group is looked up in the shared tables.
+    dir_mean = np.full(img.shape, np.nan, dtype=np.float32)
+    dir_var = np.full(img.shape, np.nan, dtype=np.float32)
+    order = np.argsort(directions.reshape(-1), kind='stable')
+    bounds = np.cumsum(np.bincount(directions.reshape(-1), minlength=10))
+    for d in range(1, 9):
+        index = order[bounds[d - 1]:bounds[d]]
+        if not index.size:
+            continue
+        base = RECT_WEIGHTS if d % 2 else DIAG_WEIGHTS
+        # Kernel.rotate(i) turns the kernel clockwise, i.e. np.rot90(weights, -i)
+        mean, var = stats.moments(np.rot90(base, -((d - 1) // 2)), index=index)
+        dir_mean.reshape(-1)[index] = mean
+        dir_var.reshape(-1)[index] = var
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        varX = (dir_var - dir_mean * dir_mean * sigmaV) / (sigmaV + 1.0)
+        b = varX / dir_var
+        return dir_mean + b * (img - dir_mean)
+
+
+def refined_lee(img, block_rows=64, workers=None, exact=False):
+    """
+    Local Refined Lee speckle filter, equivalent to Sentinel1_extract_method.RefinedLee.
+
+    Each block builds one set of line tables (see Neighborhood) that the 3x3 window and
+    all eight directional windows read from, so every window costs O(1) per pixel, and
+    each pixel only looks up the window of its own direction. The image is processed in
+    row blocks with a LEE_HALO overlap, which bounds memory and lets blocks run in parallel.
+
+    A (bands, rows, cols) stack, e.g. VV and VH, is filtered in the same pass with
+    every band treated independently.
+
+    A thread filters about 3 million pixels per band and second (about 0.35 µs per
+    pixel), so a 10000 x 10000 VV/VH scene takes about 70 s of CPU time; blocks are
+    spread over all CPUs by default. A block holds about 200 bytes per pixel and band.
+
+    Args:
+        img (np.ndarray): 2-D backscatter array or band stack, NaN for masked pixels.
+        block_rows (int): Number of output rows per block.
+        workers (int, optional): Number of threads processing blocks concurrently, os.cpu_count() by default.
+        exact (bool): Use the kernel-by-kernel reference (DirectNeighborhood) instead.
+
+    Returns:
+        np.ndarray: The filtered image as float32.
+    """
+    img = np.asarray(img)
+    workers = workers or os.cpu_count() or 1
+    neighborhood = DirectNeighborhood if exact else Neighborhood
+    H = img.shape[-2]
+    out = np.empty(img.shape, dtype=np.float32)
+
+    def run(top):
+        bottom = min(top + block_rows, H)
+        lo, hi = max(top - LEE_HALO, 0), min(bottom + LEE_HALO, H)
+        filtered = _refined_lee_block(img[..., lo:hi, :].astype(np.float32), neighborhood)
+        out[..., top:bottom, :] = filtered[..., top - lo:bottom - lo, :]
+
+    tops = range(0, H, block_rows)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, tops))
+    else:
+        for top in tops:
+            run(top)
+    return out
+
+
+def histogram(values, max_buckets=10000, min_bucket_width=0.01):
+    """
+    Builds an equal-width histogram of every band, like ee.Reducer.histogram(max_buckets, min_bucket_width).
+
+    Args:
+        values (np.ndarray): Array whose first axis is the band axis, NaN for masked pixels.
+        max_buckets (int): The maximum number of buckets per band.
+        min_bucket_width (float): The minimum bucket width.
+
+    Returns:
+        tuple: (counts, bucket_means) arrays of shape (bands, buckets); bucket_means holds
+        the mean of the values in each bucket, or the bucket centre for empty buckets.
+    """
+    values = values.reshape(values.shape[0], -1)
+    low, high = np.nanmin(values, axis=1), np.nanmax(values, axis=1)
+    width = np.maximum((high - low) / max_buckets, min_bucket_width)
+    n_buckets = int(np.max(np.floor((high - low) / width))) + 1
+    counts = np.zeros((values.shape[0], n_buckets))
+    sums = np.zeros((values.shape[0], n_buckets))
+    for band, v in enumerate(values):
+        v = v[~np.isnan(v)]
+        index = np.minimum(((v - low[band]) / width[band]).astype(np.int64), n_buckets - 1)
+        counts[band] = np.bincount(index, minlength=n_buckets)
+        sums[band] = np.bincount(index, weights=v, minlength=n_buckets)
+    centres = low[:, None] + (np.arange(n_buckets) + 0.5) * width[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bucket_means = np.where(counts > 0, sums / counts, centres)
+    return counts, bucket_means
+
+
+def otsu(values, max_buckets=10000, min_bucket_width=0.01):
+    """
+    Applies the OTSU method to every band at once, like Public_methods.otsu.
+
+    The between-class variance of every split of every band's histogram is computed
+    from cumulative sums, instead of one reduction per split.
+
+    Args:
+        values (np.ndarray): Array whose first axis is the band axis, NaN for masked pixels.
+        max_buckets (int): The maximum number of histogram buckets per band.
+        min_bucket_width (float): The minimum histogram bucket width.
+
+    Returns:
+        np.ndarray: One threshold per band.
+    """
+    counts, means = histogram(values, max_buckets, min_bucket_width)
+    total = counts.sum(axis=1, keepdims=True)
+    total_sum = (means * counts).sum(axis=1, keepdims=True)
+    mean = total_sum / total
+    # Class A holds buckets 0..i, class B the rest
+    a_count = np.cumsum(counts, axis=1)
+    a_sum = np.cumsum(means * counts, axis=1)
+    b_count = total - a_count
+    # Empty classes give 0 * inf or 0 / 0, counted as no variance
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a_mean = a_sum / a_count
+        b_mean = (total_sum - a_sum) / b_count
+        bss = np.nan_to_num(a_count * (a_mean - mean) ** 2) + np.nan_to_num(b_count * (b_mean - mean) ** 2)
+    # The server sorts the bucket means by bss and takes the last, i.e. the last maximum
+    best = bss.shape[1] - 1 - np.argmax(bss[:, ::-1], axis=1)
+    return means[np.arange(means.shape[0]), best]
+
+
+def terrain_slope(dem, pixel_size):
+    """
+    Calculates the terrain slope in degrees, like ee.Terrain.slope.
+
+    Args:
+        dem (np.ndarray): 2-D elevation array in metres.
+        pixel_size (float): Pixel size of the grid in metres.
+
+    Returns:
+        np.ndarray: The slope in degrees.
+    """
+    dz_dy, dz_dx = np.gradient(np.asarray(dem, dtype=np.float64), pixel_size)
+    return np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+
+
+def final_mask(image, slope, max_slope=5):
+    """
+    Masks pixels on steep terrain, like Public_methods.final_mask.
+
+    Args:
+        image (np.ndarray): The image (or band stack) to mask.
+        slope (np.ndarray): Terrain slope in degrees on the image grid.
+        max_slope (float): Flooding is not considered to occur on slopes of this many degrees or more.
+
+    Returns:
+        np.ndarray: The image with NaN where the slope is too steep.
+    """
+    return np.where(slope < max_slope, image, np.nan)
+
+
+def fuse_water(satellite_water, slope=None, max_slope=5, min_votes=None):
+    """
+    Fuses the water masks of several satellites on packed bits, the local counterpart of thresholding All_water_detect.
+
+    Every mask is packed to one bit per pixel (bitmask.BitMask) and the votes are
+    counted with BitMask.majority, so the fusion never holds a per-pixel sum. Steep
+    terrain is removed on the packed bits as well, like final_mask.
+
+    Args:
+        satellite_water (list): 2-D water masks (bool or 0/1, NaN counts as no water) on a common grid,
+            e.g. the results of S1_water_extract_local and S2_water_extract_local.
+        slope (np.ndarray, optional): Terrain slope in degrees on the same grid.
+        max_slope (float): Flooding is not considered to occur on slopes of this many degrees or more.
+        min_votes (int, optional): Number of satellites that must detect water; a strict majority by default.
+
+    Returns:
+        BitMask: The fused water mask.
+    """
+    from flood_utils.bitmask import BitMask
+    fused = BitMask.majority([BitMask.from_array(water) for water in satellite_water], min_votes)
+    if slope is not None:
+        fused &= BitMask.from_array(slope < max_slope)
+    return fused
+
+
+def remove_permanent_water(water, jrc_cache, year, offset=(0, 0)):
+    """
+    Removes the JRC permanent water of a year from a water mask, see jrc_cache.JRCCache.flood_extent.
+
+    Args:
+        water (np.ndarray or BitMask): 2-D water mask, e.g. the result of fuse_water.
+        jrc_cache (JRCCache): The cache of the JRC layer.
+        year (int): The year of the JRC layer.
+        offset (tuple): (row_off, col_off) of the mask in the grid of jrc_cache.
+
+    Returns:
+        np.ndarray or BitMask: The flood extent, water that is not permanent water; a
+        boolean array for an array, a BitMask for a BitMask.
+    """
+    from flood_utils.bitmask import BitMask
+    if year is None:
+        raise ValueError('The year of the JRC layer is required with jrc_cache')
+    if isinstance(water, BitMask):
+        return jrc_cache.flood_extent(water, year, *offset)
+    return jrc_cache.flood_extent(BitMask.from_array(water), year, *offset).to_array()
+
+
+def raster_shape(path):
+    """
+    Returns the (rows, cols) shape of a GeoTIFF.
+
+    Args:
+        path (str): Path of the GeoTIFF.
+
+    Returns:
+        tuple: The number of rows and columns.
+    """
+    import rasterio
+    with rasterio.open(path) as dataset:
+        return dataset.height, dataset.width
+
+
+def read_chunks(path, band_names, chunk_rows=1024):
+    """
+    Reads the named bands of a GeoTIFF in row chunks, so that only one chunk is held in memory.
+
+    Bands are looked up by their descriptions, as written by Earth Engine exports, and
+    taken in file order when the file has no matching descriptions.
+
+    Args:
+        path (str): Path of the GeoTIFF.
+        band_names (list): Names of the bands to read.
+        chunk_rows (int): Number of rows per chunk.
+
+    Yields:
+        tuple: (row slice, float32 array of shape (bands, rows, cols)), NaN where nodata.
+    """
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(path) as dataset:
+        if all(name in dataset.descriptions for name in band_names):
+            indexes = [dataset.descriptions.index(name) + 1 for name in band_names]
+        else:
+            indexes = list(range(1, len(band_names) + 1))
+        for top in range(0, dataset.height, chunk_rows):
+            rows = min(chunk_rows, dataset.height - top)
+            data = dataset.read(indexes, window=Window(0, top, dataset.width, rows), masked=True)
+            yield slice(top, top + rows), data.astype(np.float32).filled(np.nan)
+
+
+def potential_flood_mask(total_precipitation, threshold, min_pixels=1):
+    """
+    Local counterpart of Public_methods.potential_flood_mask, with small areas removed.
+
+    The exceedance mask is split into 8-connected potential flood areas with
+    scipy.ndimage.label, and areas smaller than min_pixels are dropped.
+
+    Args:
+        total_precipitation (np.ndarray): 2-D total precipitation in mm, NaN where masked.
+        threshold (float): Precipitation above which a pixel may be flooded, e.g. 50 mm per day of the period.
+        min_pixels (int): Smallest potential flood area kept, in pixels.
+
+    Returns:
+        tuple: (boolean mask, label array with one label per kept area (0 outside), bounding box as a
+        (row slice, column slice) pair or None when no area is kept).
+    """
+    from scipy import ndimage
+    with np.errstate(invalid='ignore'):
+        exceedance = total_precipitation > threshold
+    labels, count = ndimage.label(exceedance, structure=np.ones((3, 3), dtype=bool))
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    keep = sizes >= min_pixels
+    keep[0] = False
+    # Renumber the kept areas 1..n so the labels stay contiguous
+    relabel = np.zeros(count + 1, dtype=labels.dtype)
+    relabel[keep] = np.arange(1, keep.sum() + 1)
+    labels = relabel[labels]
+    mask = labels > 0
+    if not mask.any():
+        return mask, labels, None
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    return mask, labels, (slice(int(rows[0]), int(rows[-1]) + 1), slice(int(cols[0]), int(cols[-1]) + 1))
@@ -1,6 +1,7 @@
-import ee,time
+from ee_session import ee
 from flood_utils import modis_toolbox
-from flood_utils.Public_methods import otsu,final_mask
+from flood_utils.Public_methods import otsu,final_mask,ee_rate_limiter
+from profiling import profile_stage
 
 def modis_water_detection(modis_collection, thresh_b1b2, thresh_b7,base_res):
     """
@@ -37,7 +38,38 @@ def modis_water_detection(modis_collection, thresh_b1b2, thresh_b7,base_res):
                                      'otsu_sample_res': base_res})
 
 
-def modis_main(start_date,end_date,roi):
+def modis_collection(start_date,end_date,roi):
+    """
+    Collects the pre-processed Terra and Aqua images covering the analysis period.
+
+    Args:
+        start_date (ee.Date): The start date for the analysis period.
+        end_date (ee.Date): The end date for the analysis period.
+        roi (ee.Geometry): The region of interest for water detection.
+
+    Returns:
+        ee.ImageCollection: Pan-sharpened Terra and Aqua images with b1b2_ratio and QA bands, sorted by time.
+    """
+    # Clip the range
+    date_range = ee.DateRange(start_date.advance(-2,"day"),
+                            end_date.advance(3,"day"))
+    # Collect Terra and Aqua satellite data
+    terra = modis_toolbox.get_terra(roi, date_range)
+    aqua = modis_toolbox.get_aqua(roi, date_range)
+    # Apply Pan-sharpen function to Terra and Auqa data
+    terra_sharp = terra.map(modis_toolbox.pan_sharpen)
+    aqua_sharp = aqua.map(modis_toolbox.pan_sharpen)
+    # Add NIR/RED ratio to the images band
+    terra_ratio = terra_sharp.map(modis_toolbox.b1b2_ratio)
+    aqua_ratio = aqua_sharp.map(modis_toolbox.b1b2_ratio)
+    # Apply QA Band Extract to Terra & Aqua
+    terra_final = terra_ratio.map(modis_toolbox.add_qa_bands)
+    aqua_final = aqua_ratio.map(modis_toolbox.add_qa_bands)
+    # Finally, combine Terra and Aqua into the same image collection
+    return ee.ImageCollection(terra_final.merge(aqua_final).sort("system:time_start", True))
+
+
+def modis_main(start_date,end_date,roi,mask=None):
     """
     The main function to execute the water detection process using MODIS data.
     
@@ -45,62 +77,53 @@ def modis_main(start_date,end_date,roi):
         start_date (ee.Date): The start date for the analysis period.
         end_date (ee.Date): The end date for the analysis period.
         roi (ee.Geometry): The region of interest for water detection.
+        mask (ee.Image, optional): Potential flood mask limiting the detection inside roi, see Public_methods.potential_flood_mask.
     
     Returns:
         ee.Image: An image representing detected water bodies or a constant image in case of failure.
     """
     try:
-        # Clip the range
-        date_range = ee.DateRange(start_date.advance(-2,"day"),
-                                end_date.advance(3,"day"))
-        # Collect Terra and Aqua satellite data
-        terra = modis_toolbox.get_terra(roi, date_range)
-        aqua = modis_toolbox.get_aqua(roi, date_range)
-        # Apply Pan-sharpen function to Terra and Auqa data
-        terra_sharp = terra.map(modis_toolbox.pan_sharpen)
-        aqua_sharp = aqua.map(modis_toolbox.pan_sharpen)
-        # Add NIR/RED ratio to the images band
-        terra_ratio = terra_sharp.map(modis_toolbox.b1b2_ratio)
-        aqua_ratio = aqua_sharp.map(modis_toolbox.b1b2_ratio)
-        # Apply QA Band Extract to Terra & Aqua
-        terra_final = terra_ratio.map(modis_toolbox.add_qa_bands)
-        aqua_final = aqua_ratio.map(modis_toolbox.add_qa_bands)
-        # Finally, combine Terra and Aqua into the same image collection
-        modis = ee.ImageCollection(terra_final.merge(aqua_final).sort("system:time_start", True))
-        time.sleep(2)
-        # Mask the image before OSTU extraction to exclude interference
-        modis_masked = modis.map(modis_toolbox.qa_mask)
-        sample_frame = modis_masked.median().clip(roi)
-        # Otsu histrograms require a "bi-modal histogram". We need to constrain
-        # the reflectance range that can be used in the histogram as it may
-        # include high-reflectance features (e.g. missed clouds) that will make
-        # the histogram "multi-modal". Below are the steps to constrain the
-        # histograms into a reasonable range that one might expect water/ land
-        swir_mask = sample_frame.select("swir").gt(-500)\
-                    .And(sample_frame.select("swir").lt(3000))
-        cleaned_swir = sample_frame.select("swir").updateMask(swir_mask)
+        with profile_stage('data load'):
+            modis = modis_collection(start_date,end_date,roi)
+        with profile_stage('compositing'):
+            # Mask the image before OSTU extraction to exclude interference
+            modis_masked = modis.map(modis_toolbox.qa_mask)
+            sample_frame = modis_masked.median().clip(roi)
+            if mask is not None:
+                sample_frame = sample_frame.updateMask(mask)
+            # Otsu histrograms require a "bi-modal histogram". We need to constrain
+            # the reflectance range that can be used in the histogram as it may
+            # include high-reflectance features (e.g. missed clouds) that will make
+            # the histogram "multi-modal". Below are the steps to constrain the
+            # histograms into a reasonable range that one might expect water/ land
+            swir_mask = sample_frame.select("swir").gt(-500)\
+                        .And(sample_frame.select("swir").lt(3000))
+            cleaned_swir = sample_frame.select("swir").updateMask(swir_mask)
 
-        # Merge all masks into the final sample image
-        sample_img = sample_frame.addBands(cleaned_swir, overwrite=True)
-        base_res = ee.Image(modis.first()).select("red_250m").projection().nominalScale().multiply(1).getInfo();
-        base_res = round(base_res,2)
-        # Apply otsu method to extract thresholds respectively
-        b1b2_thresh = otsu(sample_img.select("b1b2_ratio"),roi)
-        time.sleep(1)
-        swir_thresh = otsu(sample_img.select("swir"),roi)
-        time.sleep(1)
-        # Store each threshold in a dictionary
-        thresh_dict = {'b1b2': b1b2_thresh.getInfo(),
-                    'b7': swir_thresh.getInfo(),
-                    'base_res':base_res}
-        # Extract water bodies based on b1b2_ratio, b1 and b7 thresholds
-        modis_water_collection = modis_water_detection(modis, thresh_dict["b1b2"],thresh_dict["b7"],thresh_dict["base_res"])
-        time.sleep(1)
-        # Combine all images into one image
-        modis_water = modis_water_collection.mosaic().select(['sum'],['Modis_water']).clip(roi)
-        modis_water = final_mask(modis_water)
+            # Merge all masks into the final sample image
+            sample_img = sample_frame.addBands(cleaned_swir, overwrite=True)
+            base_res = ee.Image(modis.first()).select("red_250m").projection().nominalScale()
+        with profile_stage('thresholding'):
+            # Apply otsu method to extract thresholds respectively
+            b1b2_thresh = otsu(sample_img.select("b1b2_ratio"),roi)
+            swir_thresh = otsu(sample_img.select("swir"),roi)
+            # Fetch both thresholds and the base resolution in a single request
+            ee_rate_limiter.acquire()
+            thresh_dict = ee.Dictionary({'b1b2': b1b2_thresh,
+                                         'b7': swir_thresh,
+                                         'base_res': base_res}).getInfo()
+            thresh_dict['base_res'] = round(thresh_dict['base_res'],2)
+            # Extract water bodies based on b1b2_ratio, b1 and b7 thresholds
+            modis_water_collection = modis_water_detection(modis, thresh_dict["b1b2"],thresh_dict["b7"],thresh_dict["base_res"])
+        with profile_stage('compositing'):
+            # Combine all images into one image
+            modis_water = modis_water_collection.mosaic().select(['sum'],['Modis_water']).clip(roi)
+            modis_water = final_mask(modis_water)
+        if mask is not None:
+            modis_water = modis_water.updateMask(mask)
         return modis_water.unmask()
     except Exception as e:
         print("No image during this period")  
-        zero_image = ee.Image.constant(999).clip(roi).rename('Modis_water')
+        # 255 is the nodata value of the uint8 flood maps (flood_event.download_flood_map)
+        zero_image = ee.Image.constant(255).clip(roi).rename('Modis_water')
         return zero_image
@@ -9,7 +9,7 @@
 # NEED TO LOAD THESE TO RUN DFO AND OTSU SCRIPTS
 # NOTE: SOME OF THESE ARE SET UP SPECIFICALLY FOR THE DFO AND OTSU SCRIPTS
 
-import ee
+from ee_session import ee
 import math
 # Function that renames the bands in MODIS GQ (250-m) collections to
 # readable band names
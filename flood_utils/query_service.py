@@ -0,0 +1,263 @@
+# Read API over the databases written by process_rainfall_events / process_flood_events.
+# Queries run on a pool of read-only DuckDB cursors and their results are kept in an LRU
+# cache. The cache is tied to the version of the database file (size and mtime of the
+# file and of its WAL): when the writer commits, the version changes, the cache is
+# emptied and the pool reopened, so readers never see stale rows.
+#
+# DuckDB does not let a writer open a file that another process holds read-only, so the
+# pool is closed after idle_seconds without queries; cache hits only stat the file.
+#
+# In-process:   QueryService(db_path).events(start_date, end_date)
+# Local HTTP:   serve({'rainfall': QueryService(...), 'flood': QueryService(...)}, port=8765)
+#               GET /rainfall/events?start=2023-08-20&end=2023-09-10
+#               GET /rainfall/events/230820230822
+#               GET /rainfall/events/230820230822/days
+
+import os
+import json
+import queue
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse,parse_qs
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+import duckdb
+
+# The lookups, parameterised so DuckDB prepares them; {kind} is Rainfall or Flood.
+# Events overlap the range [start, end) when they start before its end and end after its start.
+QUERIES = {
+    'events': "SELECT * FROM {kind}Event WHERE StartDate < ? AND EndDate > ? AND (? IS NULL OR ParamHash = ?) ORDER BY StartDate, EventID",
+    'event': "SELECT * FROM {kind}Event WHERE EventID = ? AND (? IS NULL OR ParamHash = ?)",
+    'event_days': "SELECT * FROM {kind}Day WHERE EventID = ? AND (? IS NULL OR ParamHash = ?) ORDER BY Date",
+}
+
+
+class QueryService:
+    """
+    Cached, pooled read-only queries on one rainfall or flood database.
+
+    Attributes:
+        db_path (str): Path of the database.
+        kind (str): 'Rainfall' or 'Flood', found from the tables of the database.
+        pool_size (int): Number of read-only cursors, i.e. of queries running at once.
+        cache_size (int): Number of results kept in the cache.
+        idle_seconds (float): The pool is closed after this long without queries, releasing the file for writers.
+    """
+    def __init__(self, db_path, pool_size=4, cache_size=256, idle_seconds=5):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.idle_seconds = idle_seconds
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pool = None
+        self.retired = []
+        self.active = 0
+        self.idle_timer = None
+        self.version = self.file_version()
+        tables = {row['table_name'] for row in self.query_sql("SELECT table_name FROM information_schema.tables")}
+        self.kind = 'Rainfall' if 'RainfallEvent' in tables else 'Flood'
+
+    def file_version(self):
+        """
+        Returns:
+            tuple: Size and mtime of the database file and of its WAL; changes on every commit.
+        """
+        version = []
+        for path in (self.db_path, self.db_path + '.wal'):
+            try:
+                stat = os.stat(path)
+                version.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    def _check_version(self):
+        # Called with the lock held. A read-only connection does not see later commits,
+        # so a new version also closes the pool, which is reopened by the next query.
+        version = self.file_version()
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+            self._close_pool()
+
+    def _close_pool(self):
+        # Called with the lock held; a connection still running queries is closed when they finish
+        if self.connection is not None:
+            self.retired.append(self.connection)
+            self.connection = None
+            self.pool = None
+        if self.active == 0:
+            for connection in self.retired:
+                connection.close()
+            self.retired = []
+
+    def _release_if_idle(self):
+        with self.lock:
+            self._close_pool()
+
+    def query_sql(self, sql, params=None):
+        """
+        Runs a query on a pooled cursor, without caching.
+
+        Returns:
+            list: The rows as dicts.
+        """
+        with self.lock:
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+            if self.connection is None:
+                self.connection = duckdb.connect(self.db_path, read_only=True)
+                self.pool = queue.Queue()
+                for _ in range(self.pool_size):
+                    self.pool.put(self.connection.cursor())
+            pool = self.pool
+            self.active += 1
+        cursor = pool.get()
+        try:
+            result = cursor.execute(sql, params or [])
+            columns = [column[0] for column in result.description]
+            return [dict(zip(columns, row)) for row in result.fetchall()]
+        finally:
+            pool.put(cursor)
+            with self.lock:
+                self.active -= 1
+                if self.active == 0:
+                    for connection in self.retired:
+                        connection.close()
+                    self.retired = []
+                    self.idle_timer = threading.Timer(self.idle_seconds, self._release_if_idle)
+                    self.idle_timer.daemon = True
+                    self.idle_timer.start()
+
+    def _cached(self, name, params):
+        key = (name, tuple(params))
+        with self.lock:
+            self._check_version()
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+            version = self.version
+        rows = self.query_sql(QUERIES[name].format(kind=self.kind), list(params))
+        with self.lock:
+            # Results of a query that overlapped a commit are not kept
+            if version == self.version:
+                self.cache[key] = rows
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return rows
+
+    def events(self, start_date, end_date, param_hash=None):
+        """
+        Events overlapping [start_date, end_date), with their values and map paths.
+
+        Args:
+            start_date (str or datetime.date): Start of the range, e.g. '2023-08-20'.
+            end_date (str or datetime.date): End of the range (exclusive).
+            param_hash (str, optional): Only the rows of this ParamHash.
+
+        Returns:
+            list: One dict per event.
+        """
+        return self._cached('events', [str(end_date), str(start_date), param_hash, param_hash])
+
+    def event(self, event_id, param_hash=None):
+        """
+        Returns:
+            list: The rows of the event, one per ParamHash unless param_hash is given.
+        """
+        return self._cached('event', [int(event_id), param_hash, param_hash])
+
+    def event_days(self, event_id, param_hash=None):
+        """
+        Returns:
+            list: The day rows of the event, by date.
+        """
+        return self._cached('event_days', [int(event_id), param_hash, param_hash])
+
+    def stats(self):
+        """
+        Returns:
+            dict: Cache hits, misses and size.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'cached': len(self.cache)}
+
+    def close(self):
+        """
+        Closes the pool, releasing the database file.
+        """
+        with self.lock:
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+            self._close_pool()
+
+
+def make_handler(services):
+    """
+    Builds the HTTP request handler serving the given services.
+
+    Args:
+        services (dict): QueryService per name, the first part of the URL path.
+    """
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [part for part in url.path.split('/') if part]
+            query = {key: values[0] for key,values in parse_qs(url.query).items()}
+            try:
+                if not parts or parts[0] not in services:
+                    return self._send(404, {'error': f'Unknown database, expected one of {sorted(services)}'})
+                service = services[parts[0]]
+                param_hash = query.get('param_hash')
+                if parts[1:] == ['events']:
+                    body = service.events(query['start'], query['end'], param_hash)
+                elif len(parts) == 3 and parts[1] == 'events':
+                    body = service.event(parts[2], param_hash)
+                elif len(parts) == 4 and parts[1] == 'events' and parts[3] == 'days':
+                    body = service.event_days(parts[2], param_hash)
+                elif parts[1:] == ['stats']:
+                    body = service.stats()
+                else:
+                    return self._send(404, {'error': f'Unknown path {url.path}'})
+            except (KeyError, ValueError) as e:
+                return self._send(400, {'error': f'Bad request: {e}'})
+            except duckdb.IOException as e:
+                # The writer holds the database while it is extracting
+                return self._send(503, {'error': f'Database busy: {e}'})
+            self._send(200, body)
+
+        def _send(self, status, body):
+            data = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def serve(services, host='127.0.0.1', port=8765):
+    """
+    Serves the services over HTTP until interrupted.
+
+    Args:
+        services (dict): QueryService per name, e.g. {'rainfall': QueryService(rainfall_db_path)}.
+        host (str): Interface to listen on; local only by default.
+        port (int): Port to listen on.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(services))
+    print(f"Serving {sorted(services)} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,136 @@
+# Catalog of typhoon track files kept in a DuckDB table, so batch runs and flood
+# periods select typhoons with a query instead of listing and parsing the track
+# directory every time.
+
+import os
+from flood_utils.Public_methods import parse_TC_path
+from flood_utils.track_index import wgs84,densify,read_track
+
+CATALOG_COLUMNS = ['TC_ID','TC_name','start_date','end_date','TC_file','West','South','East','North','TrackLength','FileMtime']
+
+
+def initialize_catalog(connection):
+    """
+    Creates the TyphoonCatalog table if it does not exist.
+
+    Args:
+        connection (duckdb.DuckDBPyConnection): Connection to the catalog database.
+    """
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS TyphoonCatalog (
+            TC_ID VARCHAR PRIMARY KEY,
+            TC_name VARCHAR,
+            StartDate DATE,
+            EndDate DATE,
+            TC_file VARCHAR,
+            West DOUBLE,
+            South DOUBLE,
+            East DOUBLE,
+            North DOUBLE,
+            TrackLength DOUBLE,
+            FileMtime DOUBLE
+    )
+    """)
+
+
+def catalog_entry(TargetDir,TC_file):
+    """
+    Reads one track file into a catalog row.
+
+    The bounding box is that of the track itself, with longitudes unwrapped so that
+    tracks crossing the antimeridian have East beyond 180. The track length is geodesic, in km.
+
+    Returns:
+        tuple: The row values in CATALOG_COLUMNS order.
+    """
+    import numpy as np
+    from shapely.geometry import MultiLineString
+    path = os.path.join(TargetDir,TC_file)
+    TC_info = parse_TC_path(TC_file)
+    track = read_track(path)
+    lines = track.geoms if isinstance(track, MultiLineString) else [track]
+    points = np.array([point for line in lines for point in densify(line, np.inf)])
+    length = sum(wgs84().line_length(*np.array(line.coords).T) for line in lines) / 1000
+    return (TC_info['TC_ID'],TC_info['TC_name'],TC_info['start_date'],TC_info['end_date'],TC_file,
+            points[:,0].min(),points[:,1].min(),points[:,0].max(),points[:,1].max(),length,os.path.getmtime(path))
+
+
+def update_catalog(TargetDir,db_path=None):
+    """
+    Brings the catalog up to date with the track files of a directory.
+
+    Only new files and files modified since they were catalogued are read; rows of
+    files that no longer exist are removed. When several files share a TC_ID, only the
+    most recently modified one is catalogued.
+
+    Args:
+        TargetDir (str): Directory holding the typhoon track shapefiles.
+        db_path (str, optional): The catalog database. Defaults to TC_catalog.db in TargetDir.
+
+    Returns:
+        str: The path of the catalog database.
+    """
+    import duckdb
+    if db_path is None:
+        db_path = os.path.join(TargetDir,'TC_catalog.db')
+    files = {file: os.path.getmtime(os.path.join(TargetDir,file)) for file in os.listdir(TargetDir) if file.endswith('shp')}
+    # TC_ID is the key of the catalog: of several files of one typhoon only the most recently
+    # modified is catalogued, otherwise each would replace the other and be read again on every run
+    by_id = {}
+    for file in sorted(files, key=lambda file: (files[file], file)):
+        by_id.setdefault(parse_TC_path(file)['TC_ID'], []).append(file)
+    duplicates = [file for TC_files in by_id.values() for file in TC_files[:-1]]
+    for file in duplicates:
+        print(f'Typhoon catalog: {file} ignored, another track has the same TC_ID')
+        del files[file]
+    with duckdb.connect(db_path) as connection:
+        initialize_catalog(connection)
+        catalogued = dict(connection.execute('SELECT TC_file, FileMtime FROM TyphoonCatalog').fetchall())
+        changed = [file for file,mtime in files.items() if catalogued.get(file) != mtime]
+        removed = [file for file in catalogued if file not in files]
+        rows = [catalog_entry(TargetDir,file) for file in changed]
+        connection.begin()
+        if removed:
+            connection.executemany('DELETE FROM TyphoonCatalog WHERE TC_file = ?', [(file,) for file in removed])
+        if rows:
+            connection.executemany(f"INSERT OR REPLACE INTO TyphoonCatalog VALUES ({', '.join(['?'] * len(CATALOG_COLUMNS))})", rows)
+        connection.commit()
+    if changed or removed:
+        print(f'Typhoon catalog: {len(changed)} tracks added or updated, {len(removed)} removed')
+    return db_path
+
+
+def query_catalog(db_path,start_date=None,end_date=None,bbox=None):
+    """
+    Selects the typhoons whose period and track bounding box overlap the given ones.
+
+    Args:
+        db_path (str): The catalog database.
+        start_date (str, optional): First day of the period, 'YYYY-MM-DD'.
+        end_date (str, optional): Last day of the period, 'YYYY-MM-DD'.
+        bbox (tuple, optional): (west, south, east, north) in degrees.
+
+    Returns:
+        list: One dict per typhoon with the parse_TC_path fields and the other catalog columns, ordered by start date.
+    """
+    import duckdb
+    conditions,parameters = [],[]
+    if start_date is not None:
+        conditions.append('EndDate >= CAST(? AS DATE)')
+        parameters.append(start_date)
+    if end_date is not None:
+        conditions.append('StartDate <= CAST(? AS DATE)')
+        parameters.append(end_date)
+    if bbox is not None:
+        west,south,east,north = bbox
+        # Unwrapped tracks may extend beyond 180 degrees, so the box is also tried one turn east and west
+        conditions.append('South <= ? AND North >= ? AND (' +
+                          ' OR '.join(['(West <= ? AND East >= ?)'] * 3) + ')')
+        parameters += [north,south] + [value for xoff in (-360,0,360) for value in (east+xoff,west+xoff)]
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    with duckdb.connect(db_path, read_only=True) as connection:
+        rows = connection.execute(
+            'SELECT TC_ID, TC_name, strftime(StartDate, \'%Y-%m-%d\'), strftime(EndDate, \'%Y-%m-%d\'), '
+            'TC_file, West, South, East, North, TrackLength, FileMtime '
+            f'FROM TyphoonCatalog{where} ORDER BY StartDate, TC_ID', parameters).fetchall()
+    return [dict(zip(CATALOG_COLUMNS,row)) for row in rows]
@@ -0,0 +1,183 @@
+# Local index of typhoon tracks: every track shapefile is read once, buffered
+# geodesically on the client and kept in an STRtree, so the typhoons affecting a
+# region or period are found without any Earth Engine request. Geometries are
+# in longitude/latitude (EPSG:4326).
+
+import os,json
+from functools import lru_cache
+from ee_session import ee
+from flood_utils.Public_methods import parse_TC_path
+
+
+@lru_cache(maxsize=None)
+def wgs84():
+    """
+    Returns:
+        pyproj.Geod: The WGS84 ellipsoid, created on first use so importing the module stays fast.
+    """
+    from pyproj import Geod
+    return Geod(ellps='WGS84')
+
+
+def read_track(path):
+    """
+    Reads a typhoon track shapefile.
+
+    Args:
+        path (str): Path of the line (or point) shapefile of the track.
+
+    Returns:
+        shapely.geometry.LineString or MultiLineString: The track in longitude/latitude.
+    """
+    import shapefile
+    from shapely.geometry import LineString,MultiLineString
+    lines = []
+    with shapefile.Reader(path) as reader:
+        for shape in reader.shapes():
+            parts = list(shape.parts) + [len(shape.points)]
+            lines += [shape.points[start:end] for start,end in zip(parts[:-1],parts[1:]) if end > start]
+    if not lines:
+        raise ValueError(f'No track points in {path}')
+    # Point shapefiles give one point per part; join them in file order
+    if all(len(line) == 1 for line in lines):
+        lines = [[line[0] for line in lines]]
+    lines = [line if len(line) > 1 else line * 2 for line in lines]
+    return LineString(lines[0]) if len(lines) == 1 else MultiLineString(lines)
+
+
+def densify(line, max_distance):
+    """
+    Inserts geodesic intermediate points so consecutive vertices are at most max_distance apart.
+
+    Longitudes are unwrapped, so tracks crossing the antimeridian continue beyond 180 degrees
+    instead of jumping back to -180.
+
+    Returns:
+        list: (lon, lat) vertices of the densified line.
+    """
+    import numpy as np
+    geod = wgs84()
+    coords = list(line.coords)
+    points = [coords[0]]
+    for (lon1,lat1),(lon2,lat2) in zip(coords[:-1],coords[1:]):
+        distance = geod.inv(lon1,lat1,lon2,lat2)[2]
+        steps = int(distance // max_distance)
+        if steps:
+            points += geod.npts(lon1,lat1,lon2,lat2,steps)
+        points.append((lon2,lat2))
+    lons = np.degrees(np.unwrap(np.radians([lon for lon,_ in points])))
+    return [(lon,lat) for lon,(_,lat) in zip(lons,points)]
+
+
+def geodesic_circle(lon, lat, radius, segments=64):
+    """
+    Returns the polygon of the points at `radius` metres from (lon, lat).
+
+    Longitudes are unwrapped around `lon`, so circles crossing the antimeridian stay contiguous.
+    """
+    import numpy as np
+    from shapely.geometry import Polygon
+    azimuths = np.linspace(0, 360, segments, endpoint=False)
+    lons,lats,_ = wgs84().fwd(np.full(segments, lon), np.full(segments, lat), azimuths, np.full(segments, float(radius)))
+    lons = lon + (np.asarray(lons) - lon + 180) % 360 - 180
+    return Polygon(zip(lons,lats))
+
+
+def geodesic_buffer(track, radius, segments=64, max_distance=50000):
+    """
+    Buffers a track geodesically on the client, the local counterpart of Public_methods.Route2Roi.
+
+    The track is densified, a geodesic circle is drawn around every vertex and the
+    convex hulls of consecutive circles are merged.
+
+    Args:
+        track (shapely.geometry.LineString or MultiLineString): The track in longitude/latitude.
+        radius (float): The buffer distance in metres.
+        segments (int): Number of vertices per circle.
+        max_distance (float): Maximum distance between track vertices after densifying, in metres.
+
+    Returns:
+        shapely.geometry.Polygon or MultiPolygon: The buffered region of interest.
+    """
+    import shapely
+    from shapely.geometry import MultiLineString
+    lines = track.geoms if isinstance(track, MultiLineString) else [track]
+    pieces = []
+    for line in lines:
+        circles = [geodesic_circle(lon,lat,radius,segments) for lon,lat in densify(line,max_distance)]
+        pieces += [circles[0]] + [a.union(b).convex_hull for a,b in zip(circles[:-1],circles[1:])]
+    return shapely.union_all(pieces)
+
+
+class TrackIndex:
+    """
+    Buffered regions of interest of all typhoon tracks in a directory, indexed with an STRtree.
+
+    Attributes:
+        radius (float): The buffer distance around the tracks, in metres.
+        tracks (list): One dict per typhoon with the parse_TC_path fields, 'TC_file' and 'roi'.
+        tree (shapely.STRtree): Index over the regions of interest, in the order of tracks.
+    """
+    def __init__(self, TargetDir, radius=2000000, TC_files=None):
+        import shapely
+        self.radius = radius
+        self.tracks = []
+        # Without an explicit list (e.g. from tc_catalog.query_catalog) every track of the directory is indexed
+        if TC_files is None:
+            TC_files = [file for file in os.listdir(TargetDir) if file.endswith('shp')]
+        for TC_file in sorted(TC_files):
+            TC_info = parse_TC_path(TC_file)
+            TC_info['TC_file'] = TC_file
+            TC_info['roi'] = geodesic_buffer(read_track(os.path.join(TargetDir,TC_file)),radius)
+            self.tracks.append(TC_info)
+        self.by_id = {TC_info['TC_ID']: TC_info for TC_info in self.tracks}
+        self.tree = shapely.STRtree([TC_info['roi'] for TC_info in self.tracks])
+
+    def query(self, region=None, start_date=None, end_date=None):
+        """
+        Finds the typhoons whose region of interest and period overlap the given ones.
+
+        Args:
+            region (shapely geometry or tuple, optional): A geometry, or a (west, south, east, north) box.
+            start_date (str, optional): First day of the period, 'YYYY-MM-DD'.
+            end_date (str, optional): Last day of the period, 'YYYY-MM-DD'.
+
+        Returns:
+            list: The matching track dicts.
+        """
+        from shapely.affinity import translate
+        from shapely.geometry import box
+        if region is None:
+            candidates = range(len(self.tracks))
+        else:
+            if isinstance(region, tuple):
+                region = box(*region)
+            # Regions of interest may extend beyond 180 degrees, so the region is also tried one turn east and west
+            candidates = sorted(set().union(*(self.tree.query(translate(region, xoff=xoff), predicate='intersects')
+                                              for xoff in (-360, 0, 360))))
+        # Dates are ISO strings, so they compare in calendar order
+        return [self.tracks[i] for i in candidates
+                if (start_date is None or self.tracks[i]['end_date'] >= start_date)
+                and (end_date is None or self.tracks[i]['start_date'] <= end_date)]
+
+    def roi(self, TC_ID):
+        """
+        Returns:
+            shapely geometry: The region of interest of a typhoon.
+        """
+        return self.by_id[TC_ID]['roi']
+
+    def ee_roi(self, TC_ID, tolerance=0.01):
+        """
+        Converts the region of interest of a typhoon to an Earth Engine geometry.
+
+        Args:
+            TC_ID (str): The typhoon ID.
+            tolerance (float): Simplification tolerance in degrees, keeping the request small.
+
+        Returns:
+            ee.Geometry: The simplified region of interest.
+        """
+        import shapely
+        roi = self.roi(TC_ID).simplify(tolerance, preserve_topology=True)
+        return ee.Geometry(json.loads(shapely.to_geojson(roi)), None, False)
@@ -0,0 +1,125 @@
+# Flooded area and proportion per administrative unit (FAO GAUL 2015). The level-2
+# units are turned into one label raster, valid and flooded pixels are counted per
+# label in a single grouped pass, and levels 1 and 0 are summed from their children.
+
+from ee_session import ee
+from flood_utils.Public_methods import ee_rate_limiter
+
+GAUL_LEVEL2 = 'FAO/GAUL/2015/level2'
+# Columns describing a level-2 unit and its parents, from the finest level up
+UNIT_COLUMNS = ['ADM2_CODE','ADM2_NAME','ADM1_CODE','ADM1_NAME','ADM0_CODE','ADM0_NAME']
+
+
+def zonal_counts_ee(image,roi,resolution,band='Modis_water'):
+    """
+    Counts valid and flooded pixels of every GAUL level-2 unit in the ROI with one grouped reduction.
+
+    Args:
+        image (ee.Image): The flood water image, 1 where flooded.
+        roi (ee.Geometry): The typhoon footprint.
+        resolution (int): Scale of the reduction in metres.
+        band (str): The band holding the flood water.
+
+    Returns:
+        tuple: (counts, units) where counts maps ADM2_CODE to (valid, flooded) pixel counts and
+        units lists one dict per level-2 unit with the UNIT_COLUMNS.
+    """
+    zones = ee.FeatureCollection(GAUL_LEVEL2).filterBounds(roi)
+    labels = zones.reduceToImage(['ADM2_CODE'], ee.Reducer.first()).rename('ADM2_CODE')
+    water = image.select(band)
+    stack = water.mask().gt(0).rename('valid').addBands(water.eq(1).unmask(0).rename('flooded')).addBands(labels)
+    # Unweighted: partly covered edge pixels count as whole pixels, as in the local zonal_counts
+    grouped = stack.reduceRegion(
+        reducer=ee.Reducer.sum().unweighted().repeat(2).group(groupField=2, groupName='ADM2_CODE'),
+        geometry=roi,
+        scale=resolution,
+        maxPixels=1e13)
+    # The counts and the unit attributes come back in a single request
+    ee_rate_limiter.acquire()
+    result = ee.Dictionary({
+        'groups': grouped.get('groups'),
+        'units': zones.reduceColumns(ee.Reducer.toList(len(UNIT_COLUMNS)), UNIT_COLUMNS).get('list'),
+    }).getInfo()
+    counts = {int(group['ADM2_CODE']): tuple(int(count) for count in group['sum']) for group in result['groups']}
+    units = [dict(zip(UNIT_COLUMNS,unit)) for unit in result['units']]
+    return counts,units
+
+
+def rasterize_units(units,shape,transform):
+    """
+    Burns level-2 unit polygons into a label grid, the local counterpart of reduceToImage.
+
+    Args:
+        units (list): (geometry, ADM2_CODE) pairs; geometries as GeoJSON-like dicts or shapely objects.
+        shape (tuple): (rows, cols) of the grid.
+        transform (affine.Affine): Geotransform of the grid.
+
+    Returns:
+        np.ndarray: int32 grid holding the ADM2_CODE of every pixel, 0 outside all units.
+    """
+    from rasterio.features import rasterize
+    return rasterize(units, out_shape=shape, transform=transform, fill=0, dtype='int32')
+
+
+def zonal_counts(labels,valid,flooded):
+    """
+    Counts valid and flooded pixels per label in one pass over the grid.
+
+    Args:
+        labels (np.ndarray): Label grid from rasterize_units.
+        valid (np.ndarray or BitMask): Pixels with data.
+        flooded (np.ndarray or BitMask): Flooded pixels.
+
+    Returns:
+        dict: (valid, flooded) pixel counts per ADM2_CODE present in the grid.
+    """
+    import numpy as np
+    valid = valid.to_array() if hasattr(valid,'to_array') else np.asarray(valid,dtype=bool)
+    flooded = flooded.to_array() if hasattr(flooded,'to_array') else np.asarray(flooded,dtype=bool)
+    codes,index = np.unique(labels,return_inverse=True)
+    index = index.reshape(labels.shape)
+    valid_counts = np.bincount(index.ravel(),weights=valid.ravel(),minlength=len(codes))
+    flooded_counts = np.bincount(index.ravel(),weights=(flooded & valid).ravel(),minlength=len(codes))
+    return {int(code): (int(v),int(f)) for code,v,f in zip(codes,valid_counts,flooded_counts) if code != 0}
+
+
+def roll_up(counts,units,pixel_area):
+    """
+    Derives the statistics of levels 2, 1 and 0 from the level-2 pixel counts.
+
+    Parent units are sums of their children's counts; no pixel is reduced twice. A unit
+    listed more than once (GAUL has units split over several features) is counted once.
+
+    Args:
+        counts (dict): (valid, flooded) pixel counts per ADM2_CODE.
+        units (list): One dict per level-2 unit with the UNIT_COLUMNS.
+        pixel_area (float): Area of one pixel in km2, e.g. (resolution / 1000) ** 2.
+
+    Returns:
+        list: One dict per unit and level with Level, Code, Name, ParentCode, ValidPixels,
+        FloodedPixels, FloodedArea (km2) and FloodProportion (percent), ordered by level.
+    """
+    totals = {}
+    seen = set()
+    for unit in units:
+        if int(unit['ADM2_CODE']) in seen:
+            continue
+        seen.add(int(unit['ADM2_CODE']))
+        valid,flooded = counts.get(int(unit['ADM2_CODE']),(0,0))
+        if not valid:
+            continue
+        for level,parent_level in [(2,1),(1,0),(0,None)]:
+            key = (level,int(unit[f'ADM{level}_CODE']))
+            entry = totals.setdefault(key,{
+                'Level': level,
+                'Code': key[1],
+                'Name': unit[f'ADM{level}_NAME'],
+                'ParentCode': int(unit[f'ADM{parent_level}_CODE']) if parent_level is not None else None,
+                'ValidPixels': 0,
+                'FloodedPixels': 0})
+            entry['ValidPixels'] += valid
+            entry['FloodedPixels'] += flooded
+    for entry in totals.values():
+        entry['FloodedArea'] = entry['FloodedPixels'] * pixel_area
+        entry['FloodProportion'] = 100 * entry['FloodedPixels'] / entry['ValidPixels']
+    return sorted(totals.values(),key=lambda entry: (entry['Level'],entry['Code']))
@@ -0,0 +1,13 @@
+from flood_utils.event_linkage import refresh_links
+
+# Rainfall and flood databases written by rainfall_extract.py and flood_extract.py
+rainfall_db_paths = ['../../data/intermediate/Rainfall/rainfall_20230820_20230910.db']
+flood_db_paths = ['../../data/intermediate/Flood/flood_20230820_20230910.db']
+
+# The database holding the RainfallFloodLink table; rerunning only links the new events
+link_db_path = '../../data/intermediate/rainfall_flood_links.db'
+
+# Link rain to floods starting at most this many days after the rain ends
+max_lag_days = 3
+
+refresh_links(link_db_path, rainfall_db_paths, flood_db_paths, max_lag_days)
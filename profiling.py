@@ -0,0 +1,334 @@
+# Per-stage CPU and memory profiling of the rainfall and flood runs.
+#
+# Off by default; flood_extract.py and rainfall_extract.py switch it on with --profile
+# and write the report next to the database. The stages are the blocks wrapped in
+# profile_stage(...) or decorated with @profiled(...):
+#
+#   data load      building the input collections, reading cached scenes
+#   compositing    QA masking and median/min/max composites
+#   thresholding   Otsu thresholds, rainy-day classification and water flags
+#   filtering      speckle filtering of Sentinel-1 scenes
+#   reduction      reduceRegion statistics fetched with getInfo
+#   export         map downloads and their conversion to COG
+#   db write       DuckDB batches and Parquet pixel tables
+#
+# For every stage the report holds the calls, wall time, CPU time (of the whole process,
+# all threads included), the peak RSS seen while the stage ran, the peak of the memory
+# traced by tracemalloc (Python objects and NumPy arrays) and the allocation sites that
+# grew the most between the start and the end of a call. A tracemalloc snapshot takes
+# seconds on a large heap, so the sites are only taken from the first calls of a stage.
+# Earth Engine objects are lazy:
+# with the server the work of a stage shows in the one that fetches its result.
+# Stages may nest, the time of the outer one includes the inner one.
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import tracemalloc
+
+STAGES = ('data load', 'compositing', 'thresholding', 'filtering', 'reduction', 'export', 'db write')
+
+
+def _rss():
+    """
+    Returns:
+        int: The resident set size of the process in bytes, or its peak where the current one is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return _peak_rss()
+
+
+def _peak_rss():
+    """
+    Returns:
+        int: The peak resident set size of the process in bytes, None where unknown (Windows without psutil).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _short_path(filename):
+    """
+    The file of an allocation site relative to the sys.path entry holding it, e.g. numpy/_core/numeric.py.
+    """
+    for folder in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(folder + os.sep):
+            return filename[len(folder) + 1:]
+    return filename or '<unknown>'
+
+
+class Profiler:
+    """
+    Collects wall time, CPU time and memory of the stages.
+
+    Attributes:
+        enabled (bool): Whether anything is recorded.
+        path (str): JSON report written by finish, None to only print the summary.
+        top (int): Number of allocation sites kept per stage, 0 to skip the tracemalloc snapshots.
+        samples (int): Calls of every stage whose allocation sites are recorded.
+        interval (float): Seconds between two RSS samples.
+        stages (dict): Stage name -> totals, see report.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.top = 10
+        self.samples = 1
+        self.sampled = {}
+        self.interval = 0.01
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.active = []
+        self.sampler = None
+        self.finished = False
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _sample(self):
+        # Peak RSS of the running stages, sampled in the background
+        while self.enabled:
+            rss = _rss()
+            with self.lock:
+                for call in self.active:
+                    call.peak_rss = max(call.peak_rss, rss or 0)
+            time.sleep(self.interval)
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.sampler is None or not self.sampler.is_alive():
+            self.sampler = threading.Thread(target=self._sample, name='profiling-rss', daemon=True)
+            self.sampler.start()
+
+    def add(self, call):
+        """
+        Adds a finished call to the totals of its stage.
+        """
+        with self.lock:
+            s = self.stages.setdefault(call.name, {'stage': call.name, 'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                   'peak_rss': 0, 'rss_growth': 0, 'traced_peak': 0, 'sites': {}})
+            s['calls'] += 1
+            s['wall'] += call.wall
+            s['cpu'] += call.cpu
+            s['peak_rss'] = max(s['peak_rss'], call.peak_rss)
+            s['rss_growth'] = max(s['rss_growth'], call.peak_rss - call.start_rss)
+            s['traced_peak'] = max(s['traced_peak'], call.traced_peak)
+            for site,(size,count) in call.sites.items():
+                old = s['sites'].get(site, (0, 0))
+                if size > old[0]:
+                    s['sites'][site] = (size, count)
+
+    def report(self):
+        """
+        Returns:
+            list: One dict per stage ('stage', 'calls', 'wall', 'cpu', 'peak_rss', 'rss_growth', 'traced_peak' in
+                seconds and bytes, and 'top_allocations', the sites that grew the most in a call), in STAGES order.
+        """
+        with self.lock:
+            stages = [dict(s) for s in self.stages.values()]
+        order = {name: i for i,name in enumerate(STAGES)}
+        rows = []
+        for s in sorted(stages, key=lambda s: (order.get(s['stage'], len(order)), s['stage'])):
+            sites = sorted(s.pop('sites').items(), key=lambda item: -item[1][0])[:self.top]
+            s['top_allocations'] = [{'site': site, 'bytes': size, 'blocks': count} for site,(size,count) in sites]
+            rows.append(s)
+        return rows
+
+    def summary_table(self):
+        """
+        Returns:
+            str: The report as a fixed-width table, with the largest allocation site of every stage.
+        """
+        rows = self.report()
+        width = max([len(r['stage']) for r in rows] + [5])
+        header = f"{'Stage':<{width}}  {'Calls':>5}  {'Wall s':>8}  {'CPU s':>8}  {'Peak RSS MB':>11}  {'RSS growth MB':>13}  {'Traced peak MB':>14}  Top allocation"
+        lines = [header, '-' * len(header)]
+        for r in rows:
+            top = r['top_allocations'][0] if r['top_allocations'] else None
+            site = f"{top['site']} ({top['bytes'] / 2 ** 20:.1f} MB)" if top else ''
+            lines.append(f"{r['stage']:<{width}}  {r['calls']:>5}  {r['wall']:>8.2f}  {r['cpu']:>8.2f}  {r['peak_rss'] / 2 ** 20:>11.1f}  "
+                         f"{r['rss_growth'] / 2 ** 20:>13.1f}  {r['traced_peak'] / 2 ** 20:>14.1f}  {site}")
+        lines.append('-' * len(header))
+        peak = _peak_rss()
+        lines.append(f"Process peak RSS: {peak / 2 ** 20:.1f} MB" if peak else "Process peak RSS: unknown")
+        return '\n'.join(lines)
+
+    def write(self, path=None):
+        """
+        Writes the report as JSON.
+
+        Returns:
+            str: The path written.
+        """
+        path = path or self.path
+        document = {'stages': self.report(), 'process_peak_rss': _peak_rss(), 'cpus': os.cpu_count(),
+                    'tracemalloc_frames': tracemalloc.get_traceback_limit()}
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=1)
+        return path
+
+    def finish(self):
+        """
+        Writes the report and prints the summary table; called at exit when enabled.
+        """
+        if not self.enabled or self.finished:
+            return
+        self.finished = True
+        self.enabled = False
+        if self.path:
+            print(f"Profile written to {self.write()}")
+        print(self.summary_table())
+
+
+# Allocations of the profiler itself and of the import machinery are left out of the sites
+_IGNORED = (tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>', '')
+
+
+class _Call:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.recording = False
+
+    def __enter__(self):
+        profiler = self.profiler
+        if not profiler.enabled:
+            return self
+        stack = profiler._stack()
+        # A stage entered again inside itself, e.g. to_cog inside an export, is not nested
+        if stack and stack[-1].name == self.name:
+            return self
+        self.recording = True
+        # The traced peak is reset for this call; the outer call keeps the peak reached so far
+        current,peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].traced_peak = max(stack[-1].traced_peak, peak - stack[-1].traced_start)
+        tracemalloc.reset_peak()
+        self.traced_start = current
+        self.traced_peak = 0
+        self.snapshot = None
+        with profiler.lock:
+            if profiler.top and profiler.sampled.get(self.name, 0) < profiler.samples:
+                profiler.sampled[self.name] = profiler.sampled.get(self.name, 0) + 1
+                self.snapshot = True
+        if self.snapshot:
+            self.snapshot = tracemalloc.take_snapshot()
+        self.start_rss = self.peak_rss = _rss() or 0
+        stack.append(self)
+        with profiler.lock:
+            profiler.active.append(self)
+        self.start_cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.recording:
+            return False
+        profiler = self.profiler
+        self.wall = time.perf_counter() - self.start
+        self.cpu = time.process_time() - self.start_cpu
+        peak = tracemalloc.get_traced_memory()[1]
+        self.traced_peak = max(self.traced_peak, peak - self.traced_start)
+        self.peak_rss = max(self.peak_rss, _rss() or 0)
+        # Stop sampling first, the snapshot below takes memory of its own
+        with profiler.lock:
+            profiler.active.remove(self)
+        self.sites = {}
+        if self.snapshot is not None:
+            stats = [stat for stat in tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')
+                     if stat.size_diff > 0 and stat.traceback[0].filename not in _IGNORED]
+            for stat in stats[:profiler.top]:
+                frame = stat.traceback[0]
+                self.sites[f'{_short_path(frame.filename)}:{frame.lineno}'] = (stat.size_diff, stat.count_diff)
+            self.snapshot = None
+        stack = profiler._stack()
+        stack.pop()
+        if stack:
+            # The outer call saw this peak too
+            stack[-1].traced_peak = max(stack[-1].traced_peak, peak - stack[-1].traced_start)
+        profiler.add(self)
+        return False
+
+
+profiler = Profiler()
+
+
+def profile_stage(name):
+    """
+    Context manager profiling a block as a stage, e.g. with profile_stage('export'): ...
+
+    Args:
+        name (str): The stage, one of STAGES.
+    """
+    return _Call(profiler, name)
+
+
+def profiled(name):
+    """
+    Decorator profiling every call of a function as the given stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with _Call(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report_path(db_path):
+    """
+    The report written next to a database, e.g. flood_20220401_20220403_profile.json for flood_20220401_20220403.db.
+    """
+    return os.path.splitext(db_path)[0] + '_profile.json'
+
+
+def enable(path=None, top=10, samples=1, frames=1):
+    """
+    Starts profiling the stages; the report is written and printed at exit.
+
+    Args:
+        path (str, optional): File the JSON report is written to, see report_path.
+        top (int): Number of allocation sites kept per stage, 0 to skip the snapshots (faster).
+        samples (int): Calls of every stage whose allocation sites are recorded.
+        frames (int): Frames stored per allocation by tracemalloc; only the innermost is reported.
+
+    Returns:
+        Profiler: The shared profiler.
+    """
+    if not profiler.enabled:
+        atexit.register(profiler.finish)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    profiler.enabled = True
+    profiler.finished = False
+    profiler.path = path
+    profiler.top = top
+    profiler.samples = samples
+    profiler.start()
+    return profiler
@@ -1,7 +1,16 @@
-import ee
-import geemap
-geemap.set_proxy(port=7890)
-geemap.ee_initialize()
+import argparse
+from ee_session import initialize
+import profiling
+
+# --profile records the wall time, CPU time and memory of every stage (see profiling.py)
+# and writes the report next to the database
+parser = argparse.ArgumentParser(description='Extract the rainfall events of the period set below and store them in the database.')
+parser.add_argument('--profile', action='store_true', help='profile every stage and write {database}_profile.json')
+args = parser.parse_args()
+
+# Initialize Earth Engine now, as the dates below are Earth Engine objects
+# The project and proxy are set with EE_PROJECT and EE_PROXY_PORT; no proxy is used when EE_PROXY_PORT is unset
+ee = initialize()
 
 from rainfall_utils.rainfall_period import RainfallPeriod
 from rainfall_utils.rainfall_toolbox import format_db_path,get_bbox
@@ -37,6 +46,16 @@ db_path_template = '../../data/intermediate/Rainfall/rainfall_{start_date}_{end_
 # Assume that format_db_path is a pre-defined function used to format dates and insert them into the database path template
 db_path = format_db_path(start_date, end_date, db_path_template)  # Formatted database path
 
+# Profile the run when started with --profile
+if args.profile:
+    profiling.enable(profiling.report_path(db_path))
+
+# Optional folder for the per-pixel results (Parquet, registered as views in the database); None to skip
+pixel_dir = None  # e.g. '../../data/intermediate/Rainfall/pixels/'
+
+# Folder of the pre-rendered XYZ tiles of the event maps for the dashboard; None to skip
+tile_dir = '../../data/intermediate/Rainfall/tiles/'
+
 # Create a RainfallPeriod object
 period = RainfallPeriod(
     start_date=start_date,
@@ -53,4 +72,4 @@ period = RainfallPeriod(
 rainfall_events_with_details = period.rainfall_list()
 
 # Process rainfall events, download rainfall images, and store event information in the database
-period.process_rainfall_events(rainfall_events_with_details,db_path)
\ No newline at end of file
+period.process_rainfall_events(rainfall_events_with_details,db_path,pixel_dir,tile_dir)
\ No newline at end of file
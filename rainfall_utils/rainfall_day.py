@@ -1,15 +1,14 @@
-import geemap 
-import sys
-geemap.set_proxy(port=7890)
-geemap.ee_initialize()
 from rainfall_utils.rainfall_event import RainfallEvent
 from rainfall_utils.rainfall_toolbox import convert_ee_date_to_py_date
+from tracing import traced
 
 class RainfallDay(RainfallEvent):
     """
     A class that represents a single day's rainfall event, extending the functionality
     of the RainfallEvent class to handle daily rainfall data.
     """
+    id_column = 'DayID'
+
     def __init__(self, date, roi, bbox, threshold, folder_path, resolution, time_list,event_id):
         """
         Initializes a RainfallDay object with the specified parameters for a single day.
@@ -22,8 +21,10 @@ class RainfallDay(RainfallEvent):
                          threshold=threshold, folder_path=folder_path,
                          resolution=resolution, time_list=time_list)
         self.event_id = event_id # Unique identifier for the event
+        self.trace_label = f"RainfallDay {self.start_date_py}"
 
 
+    @traced
     def generate_rainfall(self):
         """
         Generates rainfall data for a single day by calling methods from the parent class.
@@ -40,9 +41,9 @@ class RainfallDay(RainfallEvent):
                 time_list= self.time_list
             )
         except Exception as e:
-            # If an error occurs, print the error and exit with status code 1
+            # If an error occurs, print it and pass it on to the caller
             print(f"Error generating rainfall data: {e}")
-            sys.exit(1)  # Create a DayID based on the date
+            raise
 
         start_date_py = convert_ee_date_to_py_date(self.start_date)
         DayID = int(f"{start_date_py.strftime('%y%m%d')}")
@@ -66,11 +67,15 @@ class RainfallDay(RainfallEvent):
         return result
     
     # 重写保存函数
-    def to_sql(self, connection):
+    @traced
+    def to_sql(self, connection, writer=None, pixel_writer=None):
         """
         Saves the generated rainfall data for a single day into a SQL database.
         
         Overrides the to_sql method of RainfallEvent to specify the table name for daily data.
+
+        Returns:
+            int: The DayID of the row.
         """
         # Use the parent class method to insert data into the 'RainfallDay' table
-        super().to_sql(connection, table_name="RainfallDay")
+        return super().to_sql(connection, table_name="RainfallDay", writer=writer, pixel_writer=pixel_writer)
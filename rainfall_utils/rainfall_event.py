@@ -1,9 +1,7 @@
-import ee
-import geemap 
-import sys
-geemap.set_proxy(port=7890)
-geemap.ee_initialize()
-from rainfall_utils.rainfall_toolbox import get_band_name, convert_ee_date_to_py_date,generate_numeric_id
+from ee_session import ee
+from rainfall_utils.rainfall_toolbox import get_band_name, convert_ee_date_to_py_date,generate_numeric_id,param_hash,to_cog,BulkWriter
+from tracing import traced
+from profiling import profile_stage
 
 class RainfallEvent:
     """
@@ -26,6 +24,9 @@ class RainfallEvent:
         max_precipitation (ee.Image): The maximum precipitation image.
         precipitation (ee.ImageCollection): Collection of precipitation images.
     """
+    # Column identifying the rows written by to_sql
+    id_column = 'EventID'
+
     def __init__(self, start_date, end_date, roi, bbox, threshold, folder_path, resolution,time_list):
         """Initialize the RainfallEvent class with the specified parameters."""
         self.start_date = start_date
@@ -40,14 +41,19 @@ class RainfallEvent:
         self.start_date_py = convert_ee_date_to_py_date(self.start_date)
         self.end_date_py = convert_ee_date_to_py_date(self.end_date)
         self.EventID = generate_numeric_id(self.start_date_py,self.end_date_py)
+        # Object of the stages in traces, see tracing.py
+        self.trace_label = f"RainfallEvent {self.start_date_py} to {self.end_date_py}"
 
         # Initialize the dataset with the specified date range and region of interest.
-        self.dataset = ee.ImageCollection('NASA/GPM_L3/IMERG_V06').filterDate(self.date_range).filterBounds(self.roi)
+        with profile_stage('data load'):
+            self.dataset = ee.ImageCollection('NASA/GPM_L3/IMERG_V06').filterDate(self.date_range).filterBounds(self.roi)
 
         # Calculate the maximum precipitation image and the collection of precipitation images.
-        self.max_precipitation = self.dataset.select('precipitationCal').max().clip(self.roi)
-        self.precipitation = self.dataset.select('precipitationCal').map(lambda image: image.divide(2).clip(self.roi))
+        with profile_stage('compositing'):
+            self.max_precipitation = self.dataset.select('precipitationCal').max().clip(self.roi)
+            self.precipitation = self.dataset.select('precipitationCal').map(lambda image: image.divide(2).clip(self.roi))
 
+    @traced
     def calculate_max_precipitation(self):
         """
         Calculates the maximum precipitation within the region of interest (ROI) and exports it to a TIF file.
@@ -58,6 +64,7 @@ class RainfallEvent:
         Returns:
             str: The file path to the exported maximum precipitation map TIF file.
         """
+        import geemap
         # Create a mask for values greater than the threshold
         mask = self.max_precipitation.gt(self.threshold)
         # Update the max precipitation image to only include values above the threshold
@@ -65,12 +72,16 @@ class RainfallEvent:
         # Define the path for the output TIF file
         max_precipitation_map_path = self.folder_path + str(self.EventID)  + '_max_precipitation.tif'
         # Export the masked image as a TIF file to the defined path
-        geemap.ee_export_image(
-            max_precipitation_mask, filename=max_precipitation_map_path, scale=self.resolution, region=self.bbox
-        )
+        with profile_stage('export'):
+            geemap.ee_export_image(
+                max_precipitation_mask, filename=max_precipitation_map_path, scale=self.resolution, region=self.bbox
+            )
+            # Store it as a COG (tiled, compressed, with overviews)
+            to_cog(max_precipitation_map_path, dtype='float32', resampling='AVERAGE')
         # Return the path to the output TIF file
         return max_precipitation_map_path
 
+    @traced
     def calculate_total_precipitation(self):
         """
         Calculates the total precipitation over the ROI and exports it as a TIF file.
@@ -81,22 +92,27 @@ class RainfallEvent:
         Returns:
             tuple: A tuple containing the file path to the exported total precipitation map TIF file and the mean total precipitation value.
         """
+        import geemap
         # Calculate the total precipitation by summing over the image collection
         total_precipitation = self.precipitation.sum()
         # Export the total precipitation map
         total_precipitation_map_path = self.folder_path + str(self.EventID)  + '_total_rainfall.tif'
-        geemap.ee_export_image(
-            total_precipitation, filename=total_precipitation_map_path, scale=self.resolution, region=self.bbox
-        )
+        with profile_stage('export'):
+            geemap.ee_export_image(
+                total_precipitation, filename=total_precipitation_map_path, scale=self.resolution, region=self.bbox
+            )
+            to_cog(total_precipitation_map_path, dtype='float32', resampling='AVERAGE')
         # Calculate the mean total precipitation over the ROI
-        total_precipitation = total_precipitation.reduceRegion(
-            reducer=ee.Reducer.mean(), 
-            geometry=self.roi, 
-            scale=self.resolution
-        ).get('precipitationCal').getInfo()
+        with profile_stage('reduction'):
+            total_precipitation = total_precipitation.reduceRegion(
+                reducer=ee.Reducer.mean(), 
+                geometry=self.roi, 
+                scale=self.resolution
+            ).get('precipitationCal').getInfo()
         # Return both the path to the exported map and the mean total precipitation value
         return total_precipitation_map_path, total_precipitation
 
+    @traced
     def calculate_max_intensity_precipitation(self):
         """
         Calculates the image with the maximum precipitation intensity over the event period and exports it.
@@ -107,6 +123,7 @@ class RainfallEvent:
         Returns:
             str: The file path to the exported maximum intensity precipitation map TIF file.
         """
+        import geemap
         # Sort the images by total precipitation in descending order
         total_precipitation_per_image = self.precipitation.map(lambda img: img.set('total_precipitation_per_image', img.reduceRegion(reducer=ee.Reducer.sum(), geometry=self.roi, scale=11132).get('precipitationCal')))
         # Get the first image from the sorted list, which has the maximum precipitation intensity
@@ -115,12 +132,15 @@ class RainfallEvent:
         max_intensity_precipitation = ee.Image(sorted_images.first())
         max_intensity_precipitation_map_path = self.folder_path + str(self.EventID)  + '_max_intensity_rainfall.tif'
         # Export the image with the maximum intensity precipitation to the defined path
-        geemap.ee_export_image(
-            max_intensity_precipitation, filename=max_intensity_precipitation_map_path, scale=self.resolution, region=self.bbox
-        )
+        with profile_stage('export'):
+            geemap.ee_export_image(
+                max_intensity_precipitation, filename=max_intensity_precipitation_map_path, scale=self.resolution, region=self.bbox
+            )
+            to_cog(max_intensity_precipitation_map_path, dtype='float32', resampling='AVERAGE')
         # Return the path to the output TIF file
         return max_intensity_precipitation_map_path
     
+    @traced
     def calculate_cumulative_precipitation(self, time_resolution, time_list):
         """
         Calculates and exports cumulative precipitation maps for specified time intervals.
@@ -133,6 +153,7 @@ class RainfallEvent:
             tuple: A tuple containing two dictionaries, one with paths to the exported cumulative precipitation maps,
                 and another with the calculated cumulative values for each time interval.
         """        
+        import geemap
         cumulative_precipitation_paths = {} # Stores the file paths to the exported maps
         cumulative_values = {}  # Stores the calculated cumulative values
 
@@ -155,11 +176,12 @@ class RainfallEvent:
             max_cumulative_precipitation = cumulative_precipitation_collection.max()
 
             # Calculate the mean cumulative value over the ROI
-            cumulative_value = max_cumulative_precipitation.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=self.roi,
-                scale=self.resolution
-            ).get(get_band_name(max_cumulative_precipitation)).getInfo()  # Note: getInfo() is still needed here to get a number
+            with profile_stage('reduction'):
+                cumulative_value = max_cumulative_precipitation.reduceRegion(
+                    reducer=ee.Reducer.mean(),
+                    geometry=self.roi,
+                    scale=self.resolution
+                ).get(get_band_name(max_cumulative_precipitation)).getInfo()  # Note: getInfo() is still needed here to get a number
 
             # Store the cumulative value
             cumulative_values[time_window] = cumulative_value
@@ -170,15 +192,18 @@ class RainfallEvent:
             print(cumulative_precipitation_path)
 
             # Export the cumulative precipitation map
-            geemap.ee_export_image(
-                max_cumulative_precipitation, filename=cumulative_precipitation_path, scale=self.resolution, region=self.bbox
-            )
+            with profile_stage('export'):
+                geemap.ee_export_image(
+                    max_cumulative_precipitation, filename=cumulative_precipitation_path, scale=self.resolution, region=self.bbox
+                )
+                to_cog(cumulative_precipitation_path, dtype='float32', resampling='AVERAGE')
 
             # Store the path to the exported map
             cumulative_precipitation_paths[time_window] = cumulative_precipitation_path
 
         return cumulative_precipitation_paths, cumulative_values
 
+    @traced
     def generate_rainfall(self):
         """
         Generates various rainfall metrics and maps including maximum, total, maximum intensity,
@@ -199,7 +224,7 @@ class RainfallEvent:
             )
         except Exception as e:
             print(f"Error generating rainfall data: {e}")
-            sys.exit(1)  # 非零退出码通常表示程序遇到了错误            
+            raise
 
         # Compile results into a dictionary
         result = {
@@ -219,35 +244,56 @@ class RainfallEvent:
 
         return result
 
-    def to_sql(self, connection,table_name='RainfallEvent'):
+    def parameter_hash(self):
+        """
+        Hashes the parameters the rainfall values depend on, stored as ParamHash with every row.
+
+        time_list is left out: it only decides which columns are filled, so a new
+        duration adds columns to the existing rows instead of starting a new run.
+
+        Returns:
+            str: The hash of bbox, resolution and threshold.
+        """
+        return param_hash(self.bbox, self.resolution, self.threshold)
+
+    @traced
+    def to_sql(self, connection,table_name='RainfallEvent',writer=None,pixel_writer=None,tile_dir=None):
         """
         Generates rainfall data and inserts it into a specified SQL table.
 
         This method invokes the rainfall data generation process, formats the resulting data,
-        and inserts it into a SQL table.
+        and inserts it into a SQL table, updating the row if it was written before.
 
         Args:
             connection: The database connection object to execute SQL commands.
             table_name (str): The name of the table where data will be inserted. Defaults to 'RainfallEvent'.
+            writer (BulkWriter, optional): Buffers the row for a batched write instead of writing it at once.
+            pixel_writer (PixelTableWriter, optional): Also writes the per-pixel values of the rainfall maps.
+            tile_dir (str, optional): Also renders the XYZ tile pyramids of the rainfall maps under this folder.
+
+        Returns:
+            int: The ID of the row (EventID, or DayID for rainfall days).
 
-        If an error occurs during the rainfall data generation, the program will exit with a status code of 1,
-        which indicates an error.
+        Errors of the rainfall data generation are printed and raised again.
         """
         try:
             # Attempt to generate rainfall data
             data = self.generate_rainfall()
         except Exception as e:
-            # Print the error message and exit the program if rainfall data generation fails
+            # Print the error message and pass it on if rainfall data generation fails
             print(f"Error generating rainfall data: {e}")
-            sys.exit(1)   # A non-zero exit code generally indicates an error
-        
-         # Prepare the column names and corresponding placeholders for the SQL INSERT statement
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(['?'] * len(data))
-        values = tuple(data.values())
-        
-        # Create the INSERT INTO statement
-        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+            raise
+        data['ParamHash'] = self.parameter_hash()
+        if pixel_writer is not None:
+            pixel_writer.add(data)
+        if tile_dir is not None:
+            # Pre-rendered for the dashboard; the cached pyramid of an unchanged map is reused
+            from rainfall_utils.tile_pyramid import render_event_maps
+            with profile_stage('export'):
+                render_event_maps([path for column,path in data.items() if 'MapPath' in column], tile_dir)
         
-        # Execute the SQL command
-        connection.execute(sql, values)
+        if writer is not None:
+            return writer.add(data)
+        # Without a shared writer the row is written on its own
+        with BulkWriter(connection, table_name, self.id_column, key_columns=[self.id_column, 'ParamHash']) as single_writer:
+            return single_writer.add(data)
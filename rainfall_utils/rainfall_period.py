@@ -1,9 +1,10 @@
-import ee
+from ee_session import ee
 from datetime import datetime, timedelta
-from rainfall_utils.rainfall_toolbox import initialize_database
+from rainfall_utils.rainfall_toolbox import initialize_database,generate_numeric_id,param_hash,finished_ids,BulkWriter,PixelTableWriter,register_pixel_views
 from rainfall_utils.rainfall_day import RainfallDay
 from rainfall_utils.rainfall_event import RainfallEvent
-import duckdb
+from tracing import traced
+from profiling import profile_stage
 
 class RainfallPeriod:
     """
@@ -77,6 +78,7 @@ class RainfallPeriod:
             'is_rainy_day': is_rainy_day
         })
 
+    @traced
     def rainy_days(self):
         """
         Determines the rainy days within the period.
@@ -87,7 +89,8 @@ class RainfallPeriod:
         n_days = self.end_date.difference(self.start_date, 'day')
         # Use a lambda function to pass self and day as parameters
         weather_days = ee.List.sequence(0, n_days.subtract(1)).map(lambda day: self.is_rainy_day(day))
-        weather_days_list = weather_days.getInfo()
+        with profile_stage('thresholding'):
+            weather_days_list = weather_days.getInfo()
         return [day['date'] for day in weather_days_list if day['is_rainy_day'] == 1]
 
     @staticmethod
@@ -151,40 +154,78 @@ class RainfallPeriod:
         # Return the list
         return all_events_with_details
     
-    def process_rainfall_events(self,rainfall_events_with_details,db_path):
+    @traced
+    def process_rainfall_events(self,rainfall_events_with_details,db_path,pixel_dir=None,tile_dir=None):
         """
         Processes a series of rainfall events, gets rainfall images, downloads rainfall maps, and stores event information to a database.
 
+        Events and days already stored for the same parameters, with a value for every
+        duration in time_list, are skipped; rows missing a newly added duration are
+        recomputed and updated in place.
+
         Args:
             rainfall_events_with_details (list): A list containing detailed information for each rainfall event.
             db_path (str): The path to the database where event information will be stored.
+            pixel_dir (str, optional): Also write the per-pixel total and cumulative rainfall as Parquet under
+                this folder and register it as the RainfallEventPixel and RainfallDayPixel views.
+            tile_dir (str, optional): Also render the event maps as XYZ PNG tile pyramids for the dashboard,
+                one folder per map under this folder (see tile_pyramid.render_event_maps).
         """       
+        import duckdb
         initialize_database(db_path,self.time_list)
         con = duckdb.connect(database=db_path)
-
-        for rainfall_event in rainfall_events_with_details:
-                event = RainfallEvent(
-                        start_date=ee.Date(rainfall_event['start_date']),
-                        end_date=ee.Date(rainfall_event['end_date']),
-                        roi = self.roi, 
-                        bbox = self.bbox,  
-                        threshold = self.rainy_day_threshold,
-                        folder_path = self.folder_path,
-                        resolution = self.resolution,
-                        time_list = self.time_list,
-                )
-                event.to_sql(con)
-                # Get the EventID
-                event_id = con.execute('SELECT EventID FROM RainfallEvent ORDER BY EventID DESC LIMIT 1').fetchone()[0]
-                for rainfall_day in rainfall_event['event_days_str']:
-                        day = RainfallDay(
-                                date=ee.Date(rainfall_day),
-                                roi = self.roi, 
-                                bbox = self.bbox,  
-                                threshold = self.rainy_day_threshold,
-                                folder_path = self.folder_path,
-                                resolution = self.resolution,
-                                time_list = self.time_list,
-                                event_id=event_id
-                        )
-                        day.to_sql(con)
\ No newline at end of file
+        # Hash of the run parameters, stored with every row; finished rows are not recomputed
+        run_hash = param_hash(self.bbox, self.resolution, self.rainy_day_threshold)
+        required_columns = [f'CumulativeRainfall{time_interval}' for time_interval in self.time_list]
+        done_events = finished_ids(con, 'RainfallEvent', 'EventID', run_hash, required_columns)
+        done_days = finished_ids(con, 'RainfallDay', 'DayID', run_hash, required_columns)
+        # The rows of every event are written in one batch as upserts; events are always written before the days referencing them
+        event_writer = BulkWriter(con, 'RainfallEvent', 'EventID', key_columns=['EventID', 'ParamHash'])
+        day_writer = BulkWriter(con, 'RainfallDay', 'DayID', after=event_writer, key_columns=['DayID', 'ParamHash'])
+        # Optional per-pixel values, partitioned by year and event
+        pixel_columns = {'TotalRainfall': 'TotalRainfallMapPath'}
+        pixel_columns.update({f'CumulativeRainfall{time_interval}': f'CumulativeRainfallMapPath{time_interval}' for time_interval in self.time_list})
+        event_pixel_writer = PixelTableWriter(pixel_dir, 'RainfallEventPixel', 'EventID', pixel_columns) if pixel_dir else None
+        day_pixel_writer = PixelTableWriter(pixel_dir, 'RainfallDayPixel', 'DayID', pixel_columns) if pixel_dir else None
+
+        # The rows buffered when an error occurs are complete and are written as well
+        with day_writer:
+            for rainfall_event in rainfall_events_with_details:
+                    event_id = generate_numeric_id(datetime.strptime(rainfall_event['start_date'], "%Y-%m-%d"),
+                                                   datetime.strptime(rainfall_event['end_date'], "%Y-%m-%d"))
+                    pending_days = [rainfall_day for rainfall_day in rainfall_event['event_days_str']
+                                    if int(datetime.strptime(rainfall_day, "%Y-%m-%d").strftime('%y%m%d')) not in done_days]
+                    if event_id in done_events and not pending_days:
+                            print(f"Skipping event from {rainfall_event['start_date']} to {rainfall_event['end_date']}, already in the database")
+                            continue
+                    event = RainfallEvent(
+                            start_date=ee.Date(rainfall_event['start_date']),
+                            end_date=ee.Date(rainfall_event['end_date']),
+                            roi = self.roi, 
+                            bbox = self.bbox,  
+                            threshold = self.rainy_day_threshold,
+                            folder_path = self.folder_path,
+                            resolution = self.resolution,
+                            time_list = self.time_list,
+                    )
+                    if event_id not in done_events:
+                            # to_sql returns the EventID directly
+                            event_id = event.to_sql(con, writer=event_writer, pixel_writer=event_pixel_writer, tile_dir=tile_dir)
+                    for rainfall_day in pending_days:
+                            day = RainfallDay(
+                                    date=ee.Date(rainfall_day),
+                                    roi = self.roi, 
+                                    bbox = self.bbox,  
+                                    threshold = self.rainy_day_threshold,
+                                    folder_path = self.folder_path,
+                                    resolution = self.resolution,
+                                    time_list = self.time_list,
+                                    event_id=event_id
+                            )
+                            day.to_sql(con, writer=day_writer, pixel_writer=day_pixel_writer)
+                    # Written after every event, so an error never loses the events already finished
+                    day_writer.flush()
+
+        if pixel_dir:
+            register_pixel_views(con, pixel_dir)
+        con.close()
\ No newline at end of file
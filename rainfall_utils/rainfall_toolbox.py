@@ -1,6 +1,6 @@
-import ee
+from ee_session import ee
+from flood_utils.db_tools import param_hash,migrate_tables,finished_ids,BulkWriter,PixelTableWriter,register_pixel_views,to_cog
 from datetime import datetime 
-import duckdb
 
 def get_band_name(precipitation):
     """Get the name of the band"""
@@ -27,18 +27,56 @@ def get_global_min(precipitation, roi):
     ).get(band_name)
     return ee.Number(min_value).getInfo()
 
-def get_vis_params(precipitation, roi):
-    """Get visualization parameters"""
-    palette = [
-        '000096', '0064ff', '00b4ff', '33db80', '9beb4a',
-        'ffeb00', 'ffb300', 'ff6400', 'eb1e00', 'af0000'
-    ]
-    min_value = get_global_min(precipitation, roi)
-    max_value = get_global_max(precipitation, roi)
+# Colour ramp of the rainfall maps, from low to high
+PALETTE = [
+    '000096', '0064ff', '00b4ff', '33db80', '9beb4a',
+    'ffeb00', 'ffb300', 'ff6400', 'eb1e00', 'af0000'
+]
+
+def get_display_range(precipitation, roi, scale=1000, percentiles=None):
+    """
+    Computes the display range of the first band in a single reduceRegion and getInfo.
+
+    Min, max and the percentiles are reduced together from one pass over the pixels
+    (the percentiles come from the same histogram), at one scale.
+
+    Args:
+        precipitation (ee.Image): The image to display.
+        roi (ee.FeatureCollection): The region of interest.
+        scale (int): Scale of the reduction in metres.
+        percentiles (tuple, optional): (low, high) percentiles to use instead of min and max, e.g. (2, 98).
+
+    Returns:
+        dict: 'min' and 'max', plus 'p{low}' and 'p{high}' when percentiles are given.
+    """
+    reducer = ee.Reducer.minMax()
+    if percentiles is not None:
+        reducer = reducer.combine(ee.Reducer.percentile(list(percentiles)), sharedInputs=True)
+    # Renaming the band avoids a getInfo for its name
+    stats = precipitation.select([0], ['value']).reduceRegion(
+        reducer=reducer,
+        geometry=roi.geometry(),
+        scale=scale,
+        maxPixels=1e13
+    ).getInfo()
+    return {key[len('value_'):]: value for key,value in stats.items()}
+
+def get_vis_params(precipitation, roi, scale=1000, percentiles=None):
+    """
+    Get visualization parameters
+
+    Args:
+        precipitation (ee.Image): The image to display.
+        roi (ee.FeatureCollection): The region of interest.
+        scale (int): Scale of the statistics in metres.
+        percentiles (tuple, optional): Stretch between these percentiles, e.g. (2, 98), instead of min and max.
+    """
+    stats = get_display_range(precipitation, roi, scale, percentiles)
+    low,high = ('min','max') if percentiles is None else (f'p{percentiles[0]}', f'p{percentiles[1]}')
     vis_params = {
-        'min': min_value,
-        'max': max_value,
-        'palette': palette,
+        'min': stats[low],
+        'max': stats[high],
+        'palette': PALETTE,
         'opacity': 1.0
     }
     return vis_params
@@ -73,7 +111,9 @@ def initialize_database(db_path,time_lists):
     """
     Initialize a database with two tables: RainfallEvent and RainfallDay.
     Each table contains cumulative rainfall data for different time intervals.
-    The database is created at the specified path.
+    The database is created at the specified path if it does not exist. Existing tables
+    are migrated in place (e.g. new columns for new time intervals) and keep their rows,
+    which are keyed on EventID/DayID plus the ParamHash of the run parameters.
 
     Args:
     - db_path (str): The path where the database will be created.
@@ -85,7 +125,8 @@ def initialize_database(db_path,time_lists):
     # Define base fields
     base_fields = {
         'RainfallEvent': [
-            "EventID BIGINT PRIMARY KEY",
+            "EventID BIGINT",
+            "ParamHash VARCHAR DEFAULT ''",
             "StartDate DATE",
             "EndDate DATE",
             "TotalRainfall FLOAT",
@@ -94,7 +135,8 @@ def initialize_database(db_path,time_lists):
             "MaxIntensityRainfallMapPath VARCHAR"
         ],
         'RainfallDay': [
-            "DayID INTEGER PRIMARY KEY",
+            "DayID INTEGER",
+            "ParamHash VARCHAR DEFAULT ''",
             "EventID BIGINT",  
             "Date DATE",
             "TotalRainfall FLOAT",
@@ -110,29 +152,20 @@ def initialize_database(db_path,time_lists):
         map_path_fields = [f"CumulativeRainfallMapPath{interval} VARCHAR" for interval in time_lists]
         return base_fields[table_name] + cumulative_fields + map_path_fields
 
-    # Create SQL command for RainfallEvent table
-    rainfall_event_fields = build_cumulative_fields('RainfallEvent')
+    # Fields and keys of the RainfallEvent table
+    rainfall_event_fields = build_cumulative_fields('RainfallEvent') + ["PRIMARY KEY (EventID, ParamHash)"]
 
-    # Create SQL command for RainfallDay table
-    rainfall_day_fields = build_cumulative_fields('RainfallDay')
-
-    # Define a new line variable to avoid using backslashes in f-strings
-    new_line = "\n"
-
-    # Create SQL command for RainfallEvent table
-    rainfall_event_sql = f"CREATE TABLE IF NOT EXISTS RainfallEvent ({new_line}    {f',{new_line}    '.join(rainfall_event_fields)}{new_line})"
-
-    # Create SQL command for RainfallDay table
-    rainfall_day_sql = f"CREATE TABLE IF NOT EXISTS RainfallDay ({new_line}    {f',{new_line}    '.join(rainfall_day_fields)},{new_line}    FOREIGN KEY(EventID) REFERENCES RainfallEvent(EventID){new_line})"
+    # Fields and keys of the RainfallDay table
+    rainfall_day_fields = build_cumulative_fields('RainfallDay') + [
+        "PRIMARY KEY (DayID, ParamHash)",
+        "FOREIGN KEY (EventID, ParamHash) REFERENCES RainfallEvent (EventID, ParamHash)"]
 
     # Connect to DuckDB
+    import duckdb
     con = duckdb.connect(db_path)
     
-    # Execute SQL command for creating RainfallEvent table
-    con.execute(rainfall_event_sql)
-
-    # Execute SQL command for creating RainfallDay table
-    con.execute(rainfall_day_sql)
+    # Create the missing tables and bring existing ones to the current schema
+    migrate_tables(con, {'RainfallEvent': rainfall_event_fields, 'RainfallDay': rainfall_day_fields})
 
     # Close database connection
     con.close()
@@ -0,0 +1,241 @@
+# Pre-rendered XYZ PNG tiles of the event maps for the dashboard.
+#
+# The display range of a map comes from one pass over its blocks: min, max and a
+# histogram of the float32 values, from which any percentile is read. The values are
+# coloured through a 256-entry lookup table built from the palette of get_vis_params,
+# and the tiles are cached as {tile_dir}/{z}/{x}/{y}.png next to a tiles.json holding
+# what they were rendered from; a pyramid is only rendered again when that changes.
+
+import os
+import json
+import shutil
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rainfall_utils.rainfall_toolbox import PALETTE
+
+TILE_SIZE = 256
+# Half the width of the Web Mercator world in metres
+ORIGIN = 20037508.342789244
+
+
+def _order_key(values):
+    """
+    Maps float32 values to uint32 keys with the same order.
+    """
+    bits = np.asarray(values, dtype=np.float32).view(np.uint32)
+    return np.where(bits >> 31, ~bits, bits | np.uint32(0x80000000))
+
+
+def _from_key(keys):
+    """
+    Inverse of _order_key.
+    """
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.where(keys >> 31, keys & np.uint32(0x7FFFFFFF), ~keys).view(np.float32)
+
+
+def display_range(path, percentiles=(2, 98), band=1):
+    """
+    Computes min, max and percentiles of a raster band in one pass over its blocks.
+
+    Every valid value falls in one of 65536 bins given by the top 16 bits of its
+    order-preserving float32 key, i.e. bins about 1 % wide whatever the range of the
+    data, so no first pass is needed to fix the bin edges.
+
+    Args:
+        path (str): The GeoTIFF, e.g. a *_total_rainfall.tif.
+        percentiles (tuple): Percentiles to compute.
+        band (int): Index of the band, starting at 1.
+
+    Returns:
+        dict: 'min', 'max' and 'p{q}' for every percentile, None when there is no valid pixel.
+    """
+    histogram = np.zeros(1 << 16, dtype=np.int64)
+    low,high = np.inf,-np.inf
+    with rasterio.open(path) as dataset:
+        for _,window in dataset.block_windows(band):
+            data = dataset.read(band, window=window, masked=True)
+            values = data.compressed()
+            values = values[np.isfinite(values)]
+            if values.size == 0:
+                continue
+            low,high = min(low, values.min()),max(high, values.max())
+            histogram += np.bincount(_order_key(values) >> 16, minlength=1 << 16)
+    total = histogram.sum()
+    if total == 0:
+        return None
+    result = {'min': float(low), 'max': float(high)}
+    cumulative = np.cumsum(histogram)
+    for q in percentiles:
+        bin_index = int(np.searchsorted(cumulative, q / 100 * total))
+        # Middle of the bin, kept inside the data range
+        value = _from_key((bin_index << 16) + (1 << 15))
+        result[f'p{q:g}'] = float(np.clip(value, low, high))
+    return result
+
+
+def colormap_lut(palette=PALETTE, size=256):
+    """
+    Interpolates a palette of hex colours linearly into an RGBA lookup table, like Earth Engine palettes.
+
+    Returns:
+        np.ndarray: uint8 array of shape (size, 4).
+    """
+    stops = np.array([[int(colour[i:i + 2], 16) for i in (0, 2, 4)] for colour in palette], dtype=np.float64)
+    positions = np.linspace(0, 1, len(stops))
+    x = np.linspace(0, 1, size)
+    lut = np.empty((size, 4), dtype=np.uint8)
+    for channel in range(3):
+        lut[:, channel] = np.round(np.interp(x, positions, stops[:, channel]))
+    lut[:, 3] = 255
+    return lut
+
+
+def colorize(data, vmin, vmax, lut, opacity=1.0):
+    """
+    Colours a masked array through the lookup table; masked pixels are transparent.
+
+    Returns:
+        np.ndarray: uint8 RGBA array of shape (4, rows, cols).
+    """
+    scale = (len(lut) - 1) / (vmax - vmin) if vmax > vmin else 0
+    index = np.clip((data.filled(vmin).astype(np.float64) - vmin) * scale, 0, len(lut) - 1).astype(np.intp)
+    rgba = lut[index]
+    rgba[..., 3] = np.where(np.ma.getmaskarray(data) | ~np.isfinite(data.filled(0)), 0, round(255 * opacity))
+    return np.moveaxis(rgba, -1, 0)
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns:
+        tuple: (west, south, east, north) of an XYZ tile in Web Mercator metres.
+    """
+    size = 2 * ORIGIN / (1 << z)
+    return (-ORIGIN + x * size, ORIGIN - (y + 1) * size, -ORIGIN + (x + 1) * size, ORIGIN - y * size)
+
+
+def tiles_covering(bounds, z):
+    """
+    Yields the (x, y) of the XYZ tiles of zoom z covering (west, south, east, north) in degrees.
+    """
+    west,south,east,north = bounds
+    n = 1 << z
+    def tile_xy(lon, lat):
+        lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n)
+        return min(max(x, 0), n - 1),min(max(y, 0), n - 1)
+    x0,y0 = tile_xy(west, north)
+    x1,y1 = tile_xy(east, south)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x,y
+
+
+def native_zoom(dataset):
+    """
+    The zoom level whose tile pixels are closest to the pixels of the dataset (in degrees or metres).
+    """
+    west,south,east,north = transform_bounds(dataset.crs, 'EPSG:3857', *dataset.bounds)
+    pixel = (east - west) / dataset.width
+    return int(max(0, round(np.log2(2 * ORIGIN / (TILE_SIZE * pixel)))))
+
+
+def render_tiles(path, tile_dir, vis_params=None, min_zoom=None, max_zoom=None, percentiles=(2, 98), resampling=Resampling.nearest):
+    """
+    Renders the XYZ PNG tile pyramid of a map, reusing the cached tiles when nothing changed.
+
+    Args:
+        path (str): The GeoTIFF to render (a COG renders faster, its overviews are used for the low zooms).
+        tile_dir (str): Folder of the pyramid.
+        vis_params (dict, optional): 'min', 'max', 'palette' and 'opacity' as returned by get_vis_params;
+            by default the percentiles of display_range and PALETTE.
+        min_zoom (int, optional): Lowest zoom, by default 5 levels below max_zoom.
+        max_zoom (int, optional): Highest zoom, by default the native resolution of the map.
+        percentiles (tuple): Stretch used without vis_params.
+        resampling (rasterio.enums.Resampling): Resampling from the map to the tiles.
+
+    Returns:
+        int: The number of tiles written, 0 when the cached pyramid is current.
+    """
+    if vis_params is None:
+        stats = display_range(path, percentiles)
+        if stats is None:
+            print(f"No valid pixel in {path}, no tiles rendered")
+            return 0
+        vis_params = {'min': stats[f'p{percentiles[0]:g}'], 'max': stats[f'p{percentiles[1]:g}'], 'palette': PALETTE, 'opacity': 1.0}
+    with rasterio.open(path) as dataset:
+        if max_zoom is None:
+            max_zoom = native_zoom(dataset)
+        if min_zoom is None:
+            min_zoom = max(0, max_zoom - 5)
+        bounds = transform_bounds(dataset.crs, 'EPSG:4326', *dataset.bounds)
+        metadata = {
+            'source': os.path.abspath(path),
+            'source_mtime': os.path.getmtime(path),
+            'vis_params': vis_params,
+            'zooms': [min_zoom, max_zoom],
+            'resampling': resampling.name,
+            'bounds': bounds,
+        }
+        metadata_path = os.path.join(tile_dir, 'tiles.json')
+        if os.path.exists(metadata_path):
+            with open(metadata_path, encoding='utf-8') as f:
+                if json.load(f) == json.loads(json.dumps(metadata)):
+                    return 0
+            os.remove(metadata_path)
+        # Tiles of an outdated pyramid may now be empty, so the old zoom levels are removed
+        if os.path.isdir(tile_dir):
+            for name in os.listdir(tile_dir):
+                if name.isdigit():
+                    shutil.rmtree(os.path.join(tile_dir, name))
+        os.makedirs(tile_dir, exist_ok=True)
+        lut = colormap_lut(vis_params.get('palette', PALETTE))
+        written = 0
+        with rasterio.Env(GDAL_PAM_ENABLED='NO'):
+            for z in range(min_zoom, max_zoom + 1):
+                for x,y in tiles_covering(bounds, z):
+                    transform = from_bounds(*tile_bounds(z, x, y), TILE_SIZE, TILE_SIZE)
+                    # GDAL reads from the overview closest to the tile resolution. Without a nodata
+                    # value an alpha band marks the pixels outside the map, so they are masked too
+                    with WarpedVRT(dataset, crs='EPSG:3857', transform=transform, width=TILE_SIZE, height=TILE_SIZE,
+                                   resampling=resampling, add_alpha=dataset.nodata is None) as vrt:
+                        data = vrt.read(1, masked=True)
+                    if np.ma.getmaskarray(data).all():
+                        continue
+                    rgba = colorize(data, vis_params['min'], vis_params['max'], lut, vis_params.get('opacity', 1.0))
+                    tile_path = os.path.join(tile_dir, str(z), str(x), f'{y}.png')
+                    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+                    with rasterio.open(tile_path, 'w', driver='PNG', width=TILE_SIZE, height=TILE_SIZE, count=4, dtype='uint8',
+                                       crs='EPSG:3857', transform=transform) as tile:
+                        tile.write(rgba)
+                    written += 1
+    # Written last, so an interrupted run is rendered again
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+    return written
+
+
+def render_event_maps(map_paths, tile_root, **kwargs):
+    """
+    Renders the pyramid of every map to {tile_root}/{map name}, e.g. tiles/230820230822_total_rainfall/{z}/{x}/{y}.png.
+
+    Args:
+        map_paths (list): The GeoTIFFs, e.g. the map paths stored in RainfallEvent.
+        tile_root (str): Root folder of the pyramids.
+        **kwargs: Passed to render_tiles.
+
+    Returns:
+        dict: Number of tiles written per map.
+    """
+    written = {}
+    for path in map_paths:
+        if not path or not os.path.exists(path):
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        written[path] = render_tiles(path, os.path.join(tile_root, name), **kwargs)
+    return written
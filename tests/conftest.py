@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tests import the toolkits from the repository root and run Earth Engine code on the offline stand-in
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('EE_MODULE', 'fake_ee')
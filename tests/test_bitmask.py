@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from flood_utils import bitmask
+from flood_utils.bitmask import BitMask
+from flood_utils import local_toolbox
+
+
+def random_mask(shape, seed, p=0.5):
+    return np.random.default_rng(seed).random(shape) < p
+
+
+@pytest.mark.parametrize('cols', [1, 7, 8, 9, 13, 17, 64, 70])
+def test_pack_round_trip(cols):
+    mask = random_mask((5, cols), cols)
+    packed = bitmask.pack(mask)
+    assert packed.shape == (5, (cols + 7) // 8)
+    np.testing.assert_array_equal(bitmask.unpack(packed, cols), mask)
+    np.testing.assert_array_equal(BitMask.from_array(mask).to_array(), mask)
+    # 0/1 values with NaN for masked pixels pack like the boolean mask
+    values = np.where(mask, 1.0, 0.0)
+    values[0, 0] = np.nan
+    expected = mask.copy()
+    expected[0, 0] = False
+    np.testing.assert_array_equal(BitMask.from_array(values).to_array(), expected)
+
+
+@pytest.mark.parametrize('cols', [5, 8, 11])
+def test_invert_keeps_padding_zero(cols):
+    mask = random_mask((4, cols), 1)
+    inverted = ~BitMask.from_array(mask)
+    np.testing.assert_array_equal(inverted.to_array(), ~mask)
+    assert inverted.count() == mask.size - mask.sum()
+    # Padding bits stay 0, so the packed bytes equal those packed from the array
+    np.testing.assert_array_equal(inverted.packed, bitmask.pack(~mask))
+    assert (~BitMask.zeros((4, cols))).count() == 4 * cols
+
+
+def test_operators():
+    a, b = random_mask((6, 21), 2), random_mask((6, 21), 3)
+    A, B = BitMask.from_array(a), BitMask.from_array(b)
+    np.testing.assert_array_equal((A & B).to_array(), a & b)
+    np.testing.assert_array_equal((A | B).to_array(), a | b)
+    np.testing.assert_array_equal((A ^ B).to_array(), a ^ b)
+    np.testing.assert_array_equal(A.and_not(B).to_array(), a & ~b)
+    with pytest.raises(ValueError):
+        A & BitMask.zeros((6, 20))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 5])
+def test_majority_matches_vote_sum(n):
+    masks = [random_mask((7, 19), 10 + i) for i in range(n)]
+    votes = np.sum(masks, axis=0)
+    packed = [BitMask.from_array(mask) for mask in masks]
+    for min_votes in range(0, n + 2):
+        fused = BitMask.majority(packed, min_votes)
+        np.testing.assert_array_equal(fused.to_array(), votes >= min_votes)
+        np.testing.assert_array_equal(fused.packed, bitmask.pack(votes >= min_votes))
+    np.testing.assert_array_equal(BitMask.majority(packed).to_array(), votes > n // 2)
+
+
+def test_count_area_and_occurrence():
+    mask = random_mask((9, 23), 4)
+    valid = random_mask((9, 23), 5, p=0.8)
+    M = BitMask.from_array(mask)
+    assert M.count() == mask.sum()
+    assert bitmask.POPCOUNT[bitmask.pack(mask)].sum() == mask.sum()
+    assert M.area(0.0625) == mask.sum() * 0.0625
+    assert M.occurrence() == pytest.approx(100 * mask.mean())
+    assert M.occurrence(BitMask.from_array(valid)) == pytest.approx(100 * (mask & valid).sum() / valid.sum())
+    assert np.isnan(M.occurrence(BitMask.zeros(mask.shape)))
+
+
+@pytest.mark.parametrize('window', [(0, 0, 9, 23), (2, 8, 5, 11), (1, 16, 8, 7), (3, 5, 4, 13), (0, 22, 9, 1)])
+def test_window(window):
+    mask = random_mask((9, 23), 6)
+    row_off, col_off, rows, cols = window
+    cut = BitMask.from_array(mask).window(*window)
+    expected = mask[row_off:row_off + rows, col_off:col_off + cols]
+    assert cut.shape == (rows, cols)
+    np.testing.assert_array_equal(cut.to_array(), expected)
+    np.testing.assert_array_equal(cut.packed, bitmask.pack(expected))
+
+
+def test_fuse_water():
+    masks = [random_mask((8, 13), 20 + i).astype(np.uint8) for i in range(3)]
+    slope = np.random.default_rng(7).uniform(0, 10, (8, 13))
+    fused = local_toolbox.fuse_water(masks, slope)
+    np.testing.assert_array_equal(fused.to_array(), (np.sum(masks, axis=0) >= 2) & (slope < 5))
+    np.testing.assert_array_equal(local_toolbox.fuse_water(masks, min_votes=1).to_array(), np.any(masks, axis=0))
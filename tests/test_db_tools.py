@@ -0,0 +1,86 @@
+import duckdb
+import pytest
+
+from flood_utils.db_tools import BulkWriter, finished_ids, migrate_tables, to_cog
+
+
+def test_bulk_writer_keeps_rows_after_error():
+    con = duckdb.connect()
+    con.execute('CREATE TABLE Result (ID INTEGER, ParamHash VARCHAR, Value DOUBLE, PRIMARY KEY (ID, ParamHash))')
+    writer = BulkWriter(con, 'Result', 'ID', key_columns=['ID', 'ParamHash'])
+    with pytest.raises(RuntimeError):
+        with writer:
+            writer.add({'ID': 1, 'ParamHash': 'a', 'Value': 1.0})
+            writer.add({'ID': 2, 'ParamHash': 'a', 'Value': 2.0})
+            raise RuntimeError('event 3 failed')
+    assert finished_ids(con, 'Result', 'ID', 'a') == {1, 2}
+
+    # Rewriting a row updates it
+    with writer:
+        writer.add({'ID': 2, 'ParamHash': 'a', 'Value': 5.0})
+    assert con.execute('SELECT Value FROM Result WHERE ID = 2').fetchone() == (5.0,)
+
+
+def legacy_database():
+    con = duckdb.connect()
+    con.execute('CREATE TABLE FloodEvent (EventID BIGINT PRIMARY KEY, FloodExtentValue FLOAT)')
+    con.execute('CREATE TABLE FloodDay (DayID INTEGER PRIMARY KEY, EventID BIGINT REFERENCES FloodEvent (EventID), FloodExtentValue FLOAT)')
+    con.execute('INSERT INTO FloodEvent VALUES (230829230901, 7.5)')
+    con.execute('INSERT INTO FloodDay VALUES (230829, 230829230901, 2.5), (230830, 230829230901, 3.5)')
+    return con
+
+
+TABLES = {
+    'FloodEvent': ["EventID BIGINT", "ParamHash VARCHAR DEFAULT ''", "FloodExtentValue FLOAT",
+                   "PRIMARY KEY (EventID, ParamHash)"],
+    'FloodDay': ["DayID INTEGER", "ParamHash VARCHAR DEFAULT ''", "EventID BIGINT", "FloodExtentValue FLOAT",
+                 "PRIMARY KEY (DayID, ParamHash)",
+                 "FOREIGN KEY (EventID, ParamHash) REFERENCES FloodEvent (EventID, ParamHash)"],
+}
+
+
+def test_migrate_legacy_tables():
+    con = legacy_database()
+    migrate_tables(con, TABLES)
+    assert con.execute('SELECT DayID, ParamHash, FloodExtentValue FROM FloodDay ORDER BY DayID').fetchall() == [
+        (230829, '', 2.5), (230830, '', 3.5)]
+    assert finished_ids(con, 'FloodEvent', 'EventID', '') == {230829230901}
+
+
+def test_failed_migration_keeps_rows():
+    con = legacy_database()
+    tables = dict(TABLES, FloodDay=TABLES['FloodDay'] + ["Date DATE NOT NULL"])
+    with pytest.raises(duckdb.Error):
+        migrate_tables(con, tables)
+    assert 'ParamHash' not in {row[0] for row in con.execute('DESCRIBE FloodDay').fetchall()}
+    assert con.execute('SELECT count(*) FROM FloodDay').fetchone() == (2,)
+    assert con.execute('SELECT FloodExtentValue FROM FloodEvent').fetchone() == (7.5,)
+
+
+def write_map(path, values):
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_origin
+    values = np.asarray(values, dtype='float32')
+    with rasterio.open(path, 'w', driver='GTiff', width=values.shape[1], height=values.shape[0], count=1,
+                       dtype='float32', transform=from_origin(113.5, 23.0, 0.01, 0.01), crs='EPSG:4326') as dst:
+        dst.write(values, 1)
+
+
+def test_to_cog_casts_and_checks_range(tmp_path):
+    import rasterio
+    path = str(tmp_path / 'flood_map.tif')
+    write_map(path, [[0, 1], [254, 1]])
+    to_cog(path, dtype='uint8', nodata=255)
+    with rasterio.open(path) as src:
+        assert src.dtypes[0] == 'uint8' and src.nodata == 255
+        assert src.read(1, masked=True).tolist() == [[0, 1], [254, 1]]
+
+    write_map(path, [[0, 1], [999, 1]])
+    with pytest.raises(ValueError, match='do not fit'):
+        to_cog(path, dtype='uint8', nodata=255)
+
+    # A valid pixel equal to the new nodata would be masked silently
+    write_map(path, [[0, 1], [255, 1]])
+    with pytest.raises(ValueError, match='nodata'):
+        to_cog(path, dtype='uint8', nodata=255)
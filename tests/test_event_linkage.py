@@ -0,0 +1,34 @@
+import datetime
+
+import duckdb
+
+from flood_utils.event_linkage import refresh_links, LINK_TABLE
+
+
+def write_events(path, table, value_column, rows):
+    with duckdb.connect(path) as con:
+        con.execute(f"CREATE TABLE IF NOT EXISTS {table} (EventID BIGINT, ParamHash VARCHAR, StartDate DATE, "
+                    f"EndDate DATE, {value_column} FLOAT, PRIMARY KEY (EventID, ParamHash))")
+        con.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, 'h', ?, ?, ?)", rows)
+
+
+def day(d):
+    return datetime.date(2023, 8, d)
+
+
+def test_refresh_links(tmp_path):
+    folder = tmp_path / "o'neill"
+    folder.mkdir()
+    rain_db, flood_db, link_db = str(folder / 'rainfall.db'), str(folder / 'flood.db'), str(folder / 'links.db')
+    write_events(rain_db, 'RainfallEvent', 'TotalRainfall', [(230801230803, day(1), day(3), 40.0),
+                                                              (230820230821, day(20), day(21), 10.0)])
+    write_events(flood_db, 'FloodEvent', 'FloodExtentValue', [(230804230806, day(4), day(6), 2.5)])
+    assert refresh_links(link_db, rain_db, flood_db, max_lag_days=3) == 1
+    assert refresh_links(link_db, rain_db, flood_db, max_lag_days=3) == 0
+
+    # A rerun rewrites the rain of the linked event
+    write_events(rain_db, 'RainfallEvent', 'TotalRainfall', [(230801230803, day(1), day(3), 55.0)])
+    assert refresh_links(link_db, rain_db, flood_db, max_lag_days=3) == 1
+    with duckdb.connect(link_db) as con:
+        assert con.execute(f"SELECT RainfallEventID, TotalRainfall, GapDays FROM {LINK_TABLE}").fetchall() == [
+            (230801230803, 55.0, 1)]
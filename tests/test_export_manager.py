@@ -0,0 +1,116 @@
+import os
+import json
+
+from flood_utils.export_manager import ExportManager, FakeTaskService, ACTIVE_STATES
+from flood_utils import ALL_TC_extracted, Water_extract_main
+
+
+def export(name):
+    return {'image': None, 'description': name, 'assetId': 'users/test/' + name, 'scale': 250}
+
+
+def test_retry_and_throttling(tmp_path):
+    service = FakeTaskService(outcomes={'b': ['FAILED', 'COMPLETED'], 'c': ['FAILED'] * 3}, running_polls=2)
+    manager = ExportManager(str(tmp_path / 'exports.db'), service=service, max_running=2, max_attempts=3)
+    for name in 'abcde':
+        manager.submit('users/test/' + name, export(name))
+    assert service.started == ['a', 'b']
+
+    most_running = 0
+    while manager.pending():
+        manager.poll()
+        most_running = max(most_running, sum(1 for task in manager.tasks.values() if task['state'] in ACTIVE_STATES))
+    assert most_running == 2
+    assert manager.summary() == {'COMPLETED': 4, 'FAILED': 1}
+    assert service.started.count('b') == 2
+    assert service.started.count('c') == 3
+    assert manager.con.execute("SELECT Attempts, ErrorMessage FROM ExportTask WHERE AssetID = 'users/test/c'").fetchone() == (3, 'Fake failure')
+
+
+def test_reload(tmp_path):
+    path = str(tmp_path / 'exports.db')
+    manager = ExportManager(path, service=FakeTaskService(), max_running=1)
+    manager.submit('users/test/a', export('a'))
+    manager.describe('users/test/a', {'TC_file': 'a.shp'})
+    manager.submit('users/test/b', export('b'))
+    manager.poll()
+    manager.con.close()
+
+    # a was running and b queued when the first batch stopped
+    service = FakeTaskService()
+    manager = ExportManager(path, service=service)
+    assert manager.source('users/test/a') == {'TC_file': 'a.shp'}
+    assert manager.state('users/test/b') == 'QUEUED'
+    manager.submit('users/test/a', export('a'))
+    manager.submit('users/test/b', export('b'))
+    assert service.started == ['b']
+    # The task of a is not listed by the new service, so it can not be followed
+    manager.poll()
+    assert manager.state('users/test/a') == 'FAILED'
+
+
+class LosingTaskService(FakeTaskService):
+    """FakeTaskService that never lists the tasks of the given exports."""
+
+    def __init__(self, lost, **kwargs):
+        super().__init__(**kwargs)
+        self.lost = lost
+        self.lost_ids = set()
+
+    def start(self, export):
+        task_id = super().start(export)
+        if export['description'] in self.lost:
+            self.lost_ids.add(task_id)
+        return task_id
+
+    def states(self):
+        return {task_id: state for task_id,state in super().states().items() if task_id not in self.lost_ids}
+
+
+def test_lost_task_fails_after_missing_polls(tmp_path):
+    service = LosingTaskService(lost={'a'})
+    manager = ExportManager(str(tmp_path / 'exports.db'), service=service, max_attempts=2, max_missing_polls=3)
+    manager.submit('users/test/a', export('a'))
+    manager.submit('users/test/b', export('b'))
+    polls = 0
+    while manager.pending():
+        manager.poll()
+        polls += 1
+        assert polls < 20, 'wait() would never return'
+    # Two attempts of three missing polls each
+    assert polls == 6
+    assert service.started.count('a') == 2
+    assert manager.summary() == {'COMPLETED': 1, 'FAILED': 1}
+    assert manager.con.execute("SELECT ErrorMessage FROM ExportTask WHERE AssetID = 'users/test/a'").fetchone() == ('Task not found',)
+
+
+def test_run_batch_records_completed_exports(tmp_path, monkeypatch):
+    import shapefile
+    for name in ('2201_AAA_20220801_20220803', '2202_BBB_20220805_20220806'):
+        writer = shapefile.Writer(str(tmp_path / name), shapeType=shapefile.POLYLINE)
+        writer.field('id', 'N')
+        writer.line([[[113.6, 22.3], [114.8, 22.9]]])
+        writer.record(1)
+        writer.close()
+
+    extracted = []
+    def TC_flood(TargetDir, TC_file, radius, asset_path, export_manager, track_index=None):
+        extracted.append(TC_file)
+        asset = Water_extract_main.TC_asset_id(ALL_TC_extracted.parse_TC_path(TC_file), asset_path)
+        export_manager.submit(asset, export(asset.split('/')[-1]))
+    monkeypatch.setattr(Water_extract_main, 'TC_flood', TC_flood)
+
+    # The export of AAA fails every attempt, so only BBB is recorded
+    service = FakeTaskService(outcomes={'2201AAA': ['FAILED'] * 3})
+    manifest = ALL_TC_extracted.run_batch(str(tmp_path), export_service=service, poll_interval=0)
+    assert sorted(manifest) == ['2202']
+    assert manifest['2202']['TC_file'] == '2202_BBB_20220805_20220806.shp'
+    with open(tmp_path / 'TC_manifest.json', encoding='utf-8') as f:
+        assert sorted(json.load(f)) == ['2202']
+
+    # The next run extracts AAA again and leaves BBB alone
+    extracted.clear()
+    manifest = ALL_TC_extracted.run_batch(str(tmp_path), export_service=FakeTaskService(), poll_interval=0)
+    assert extracted == ['2201_AAA_20220801_20220803.shp']
+    assert sorted(manifest) == ['2201', '2202']
+    assert os.path.exists(tmp_path / 'TC_exports.db')
@@ -0,0 +1,97 @@
+# The flood and rainfall runs of flood_extract.py and rainfall_extract.py on fake_ee,
+# with the number of Earth Engine round trips they make.
+
+import os
+
+import duckdb
+import pytest
+
+from ee_session import ee
+import fake_ee
+
+
+@pytest.fixture
+def shenzhen():
+    fake_ee.configure(world=fake_ee.World(), latency=0)
+    fake_ee.reset()
+    return ee.FeatureCollection('FAO/GAUL_SIMPLIFIED_500m/2015/level2').filter(ee.Filter.eq('ADM2_NAME', 'Shenzhen'))
+
+
+def test_flood_period(shenzhen, tmp_path):
+    from flood_utils.flood_period import FloodPeriod
+    from flood_utils.flood_toolbox import format_db_path, get_bbox
+    start_date, end_date = ee.Date('2022-04-01'), ee.Date('2022-04-03')
+    folder = str(tmp_path) + '/'
+    db_path = format_db_path(start_date, end_date, folder + 'flood_{start_date}_{end_date}.db')
+    period = FloodPeriod(start_date, end_date, shenzhen, get_bbox(shenzhen),
+                         'projects/x/assets/shenzhen_water_area', 1000, 2, folder)
+    period.process_flood_events(period.flood_list(), db_path)
+    assert fake_ee.round_trips('getInfo') == 25
+    assert fake_ee.round_trips('download') == 0
+
+    with duckdb.connect(db_path) as con:
+        assert con.execute('SELECT count(*) FROM FloodEvent').fetchone() == (0,)
+
+
+def test_flood_period_resumes(shenzhen, tmp_path):
+    from flood_utils.flood_period import FloodPeriod
+    from flood_utils.flood_toolbox import get_bbox
+    folder = str(tmp_path) + '/'
+    db_path = folder + 'flood.db'
+    period = FloodPeriod(ee.Date('2023-08-20'), ee.Date('2023-09-10'), shenzhen, get_bbox(shenzhen),
+                         'projects/x/assets/shenzhen_water_area', 1000, 2, folder)
+    events = period.flood_list()
+    period.process_flood_events(events, db_path)
+    assert fake_ee.round_trips('download') == 5
+    with duckdb.connect(db_path) as con:
+        assert con.execute('SELECT count(*) FROM FloodEvent').fetchone() == (1,)
+        assert con.execute('SELECT count(*) FROM FloodDay').fetchone() == (3,)
+        # Shenzhen and its province and country, the province and country summed from Shenzhen alone
+        units = con.execute('SELECT Level, Name, ParentCode, ValidPixels, FloodedPixels FROM FloodZonalStats ORDER BY Level').fetchall()
+        assert [unit[:3] for unit in units] == [(0, 'China', None), (1, 'Guangdong', 53), (2, 'Shenzhen', 899)]
+        assert len({unit[3:] for unit in units}) == 1 and 0 < units[0][4] < units[0][3]
+
+    fake_ee.reset()
+    period.process_flood_events(events, db_path)
+    assert fake_ee.round_trips() == 0
+
+
+def test_rainfall_period(shenzhen, tmp_path):
+    from rainfall_utils.rainfall_period import RainfallPeriod
+    from rainfall_utils.rainfall_toolbox import format_db_path, get_bbox
+    start_date, end_date = ee.Date('2023-08-20'), ee.Date('2023-09-10')
+    folder = str(tmp_path) + '/'
+    db_path = format_db_path(start_date, end_date, folder + 'rainfall_{start_date}_{end_date}.db')
+    period = RainfallPeriod(start_date=start_date, end_date=end_date, roi=shenzhen, bbox=get_bbox(shenzhen),
+                            resolution=1000, time_list=[30, 60, 120, 240, 480, 960, 1440],
+                            rainy_day_threshold=5, folder_path=folder)
+    period.process_rainfall_events(period.rainfall_list(), db_path, tile_dir=folder + 'tiles')
+    assert fake_ee.round_trips('getInfo') == 109
+    assert fake_ee.round_trips('download') == 60
+
+    with duckdb.connect(db_path) as con:
+        events, days = con.execute('SELECT (SELECT count(*) FROM RainfallEvent), (SELECT count(*) FROM RainfallDay)').fetchone()
+        assert con.execute('SELECT count(*) FROM RainfallDay WHERE CumulativeRainfall1440 IS NULL').fetchone() == (0,)
+        maps = con.execute('SELECT TotalRainfallMapPath FROM RainfallEvent').fetchall()
+    assert events > 0 and days > 0
+    # The maps of every event are pre-rendered for the dashboard
+    for (path,) in maps:
+        name = os.path.splitext(os.path.basename(path))[0]
+        assert os.path.exists(os.path.join(folder, 'tiles', name, 'tiles.json'))
+
+    # A second run finds every event in the database and downloads nothing
+    fake_ee.reset()
+    period.process_rainfall_events(period.rainfall_list(), db_path)
+    assert fake_ee.round_trips('download') == 0
+
+
+def test_potential_flood_mask_without_exceedance(shenzhen):
+    from flood_utils.Public_methods import potential_flood_mask
+    roi = shenzhen.geometry()
+    mask, bbox = potential_flood_mask(ee.Date('2022-04-01'), ee.Date('2022-04-03'), roi)
+    assert mask.reduceRegion(ee.Reducer.count(), roi, 10000).getInfo() == {'potential_flood': 0}
+    # The extent of the whole ROI instead of a rectangle of nulls
+    west, south, east, north = fake_ee.Geometry(bbox.getInfo())._bounds()
+    roi_west, roi_south, roi_east, roi_north = fake_ee.Geometry(roi.bounds().getInfo())._bounds()
+    assert abs(west - roi_west) < 0.1 and abs(south - roi_south) < 0.1
+    assert abs(east - roi_east) < 0.1 and abs(north - roi_north) < 0.1
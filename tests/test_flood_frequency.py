@@ -0,0 +1,34 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from flood_utils.flood_frequency import flood_frequency
+
+
+def write_maps(folder, n_maps=6, shape=(37, 23)):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(n_maps):
+        path = str(folder / f'2208{i + 1:02d}2208{i + 2:02d}_flood_map.tif')
+        with rasterio.open(path, 'w', driver='GTiff', width=shape[1], height=shape[0], count=1, dtype='uint8',
+                           nodata=255, crs='EPSG:4326', transform=from_origin(113.5, 23.0, 0.01, 0.01)) as dst:
+            dst.write((rng.random(shape) < 0.4).astype(np.uint8), 1)
+        paths.append(path)
+    return paths
+
+
+def read(path):
+    with rasterio.open(path) as dataset:
+        return dataset.read()
+
+
+def test_blocks_match_a_single_block(tmp_path):
+    paths = write_maps(tmp_path)
+    whole = flood_frequency(paths, str(tmp_path / 'f1.tif'), str(tmp_path / 'd1.tif'), block_rows=1000, workers=1)
+    # Many more blocks than the 2 * workers kept in flight
+    blocks = flood_frequency(paths, str(tmp_path / 'f2.tif'), str(tmp_path / 'd2.tif'), block_rows=2, workers=2)
+    for a,b in zip(whole, blocks):
+        np.testing.assert_array_equal(read(a), read(b))
+    count = read(blocks[0])[0]
+    stacked = np.stack([read(path)[0] for path in paths])
+    np.testing.assert_array_equal(count, stacked.sum(axis=0))
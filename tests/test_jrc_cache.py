@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from flood_utils.bitmask import BitMask
+from flood_utils.jrc_cache import JRCCache
+
+
+class StubCache(JRCCache):
+    """JRCCache whose tiles are cut from a known permanent-water array instead of Earth Engine."""
+
+    def __init__(self, cache_dir, water):
+        # One degree pixels, 16 x 16 tiles
+        super().__init__(cache_dir, (100, 20 - water.shape[0], 100 + water.shape[1], 20), resolution=1, tile_size=16)
+        self.water = water
+        self.downloads = 0
+
+    def download_tile(self, year, row_off, col_off, rows, cols):
+        self.downloads += 1
+        return self.water[row_off:row_off + rows, col_off:col_off + cols]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    water = np.random.default_rng(3).random((37, 45)) < 0.4
+    return StubCache(str(tmp_path), water)
+
+
+@pytest.mark.parametrize('window', [
+    (0, 0, 37, 45),    # the whole grid, 3 x 3 tiles with partial ones at the end
+    (5, 8, 20, 24),    # byte-aligned, across a tile corner
+    (14, 16, 4, 13),   # byte-aligned start, width inside a byte at the end
+    (3, 13, 30, 21),   # unaligned, across tile columns
+    (15, 31, 2, 1),    # one pixel either side of a tile edge
+    (36, 44, 1, 1),    # the last pixel
+])
+def test_read_windows(cache, window):
+    row_off, col_off, rows, cols = window
+    expected = cache.water[row_off:row_off + rows, col_off:col_off + cols]
+    packed = cache.read_packed(2020, *window)
+    assert packed.shape == (rows, (cols + 7) // 8)
+    # Padding bits past the window are 0
+    np.testing.assert_array_equal(packed, np.packbits(expected, axis=-1))
+    mask = cache.read_mask(2020, *window)
+    np.testing.assert_array_equal(mask.to_array(), expected)
+    assert mask.count() == expected.sum()
+
+
+def test_tiles_are_downloaded_once(cache):
+    cache.read_packed(2020, 0, 0, 5, 5)
+    assert cache.downloads == 9
+    cache.read_packed(2020, 10, 10, 20, 30)
+    assert cache.downloads == 9
+    cache.read_packed(2021, 0, 0, 5, 5)
+    assert cache.downloads == 18
+
+
+def test_window_outside_extent(cache):
+    with pytest.raises(ValueError):
+        cache.read_packed(2020, 30, 40, 10, 10)
+    assert cache.window((101.5, 0, 110, 18)) == (2, 1, 18, 9)
+
+
+def test_flood_extent(cache):
+    water = np.random.default_rng(4).random((12, 19)) < 0.5
+    flood = cache.flood_extent(BitMask.from_array(water), 2020, 9, 11)
+    np.testing.assert_array_equal(flood.to_array(), water & ~cache.water[9:21, 11:30])
+
+
+def test_local_extraction_removes_permanent_water(cache):
+    from flood_utils.Sentinel1_extract_method import S1_water_extract_local
+    rng = np.random.default_rng(5)
+    # Dark (water) left half, bright land right half
+    scene = rng.normal(-10, 1, (2, 20, 30)).astype(np.float32)
+    scene[:, :, :15] -= 12
+    slope = np.zeros((20, 30))
+    water = S1_water_extract_local([scene], slope, workers=1)
+    flood = S1_water_extract_local([scene], slope, workers=1, jrc_cache=cache, year=2020, offset=(4, 9))
+    # Refined Lee leaves the outer pixels masked
+    assert water[4:-4, 4:12].all() and not water[4:-4, 18:-4].any()
+    np.testing.assert_array_equal(flood, water & ~cache.water[4:24, 9:39])
@@ -0,0 +1,109 @@
+import warnings
+
+import numpy as np
+
+from flood_utils import local_toolbox
+
+
+def test_otsu_splits_two_classes_without_warnings():
+    rng = np.random.default_rng(0)
+    band = np.concatenate([rng.normal(-20, 1, 5000), rng.normal(-8, 1, 5000), [np.nan] * 100])
+    values = np.stack([band, band + 5])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        thresholds = local_toolbox.otsu(values)
+    assert -17 < thresholds[0] < -11
+    assert -12 < thresholds[1] < -6
+
+
+def test_refined_lee_matches_exact():
+    rng = np.random.default_rng(1)
+    img = rng.gamma(4, 0.025, (2, 70, 90)).astype(np.float32)
+    img[:, 30:34, 40:50] = np.nan
+    img[1, 60:, :5] = np.nan
+    exact = local_toolbox.refined_lee(img, block_rows=1000, workers=1, exact=True)
+    fast = local_toolbox.refined_lee(img, block_rows=16, workers=2)
+    assert np.array_equal(np.isnan(fast), np.isnan(exact))
+    np.testing.assert_allclose(fast, exact, rtol=1e-4, atol=1e-6, equal_nan=True)
+    # A single band gives the same result as in the stack
+    np.testing.assert_allclose(local_toolbox.refined_lee(img[0]), fast[0], rtol=1e-6, equal_nan=True)
+
+
+# RefinedLee as Sentinel1_extract_method builds it on the server, transcribed cell by cell:
+# every reduceNeighborhood visits the unmasked pixels under the kernel, masked inputs
+# and pixels outside the image are left out, and an empty neighbourhood is masked (NaN).
+WEIGHTS3 = [[1] * 3] * 3
+RECT = [[0] * 7] * 3 + [[1] * 7] * 4
+DIAG = [[1, 0, 0, 0, 0, 0, 0], [1, 1, 0, 0, 0, 0, 0], [1, 1, 1, 0, 0, 0, 0], [1, 1, 1, 1, 0, 0, 0],
+        [1, 1, 1, 1, 1, 0, 0], [1, 1, 1, 1, 1, 1, 0], [1, 1, 1, 1, 1, 1, 1]]
+
+
+def rotate(weights, turns):
+    # ee.Kernel.rotate: quarter turns clockwise
+    for _ in range(turns):
+        n = len(weights)
+        weights = [[weights[n - 1 - j][i] for j in range(n)] for i in range(n)]
+    return weights
+
+
+def neighbours(band, y, x, weights):
+    c = len(weights) // 2
+    values = []
+    for i, row in enumerate(weights):
+        for j, w in enumerate(row):
+            yy, xx = y + i - c, x + j - c
+            if w and 0 <= yy < band.shape[0] and 0 <= xx < band.shape[1] and not np.isnan(band[yy, xx]):
+                values.append(band[yy, xx])
+    return values
+
+
+def mean_variance(band, weights):
+    mean, variance = np.full(band.shape, np.nan), np.full(band.shape, np.nan)
+    for y in range(band.shape[0]):
+        for x in range(band.shape[1]):
+            values = neighbours(band, y, x, weights)
+            if values:
+                mean[y, x] = sum(values) / len(values)
+                variance[y, x] = sum(v * v for v in values) / len(values) - mean[y, x] ** 2
+    return mean, variance
+
+
+def server_refined_lee(band):
+    mean3, variance3 = mean_variance(band, WEIGHTS3)
+    offsets = [(-2, -2), (-2, 0), (-2, 2), (0, -2), (0, 0), (0, 2), (2, -2), (2, 0), (2, 2)]
+    dir_stats = [mean_variance(band, rotate(kernel, i)) for i in range(4) for kernel in (RECT, DIAG)]
+    out = np.full(band.shape, np.nan)
+    for y in range(band.shape[0]):
+        for x in range(band.shape[1]):
+            inside = [0 <= y + dy < band.shape[0] and 0 <= x + dx < band.shape[1] for dy, dx in offsets]
+            if not all(inside):
+                continue
+            m = [mean3[y + dy, x + dx] for dy, dx in offsets]
+            v = [variance3[y + dy, x + dx] for dy, dx in offsets]
+            if np.isnan(m).any():
+                continue
+            direction = 0
+            gradients = [abs(m[i] - m[j]) for i, j in [(1, 7), (6, 2), (3, 5), (0, 8)]]
+            for k, (i, j) in enumerate([(1, 7), (6, 2), (3, 5), (0, 8)]):
+                if gradients[k] == max(gradients):
+                    direction += k + 1 if m[i] - m[4] > m[4] - m[j] else k + 5
+            if not 1 <= direction <= 8:
+                continue
+            sigmaV = sum(sorted(vi / (mi * mi) for mi, vi in zip(m, v))[:5]) / 5
+            dir_mean, dir_var = dir_stats[direction - 1][0][y, x], dir_stats[direction - 1][1][y, x]
+            varX = (dir_var - dir_mean * dir_mean * sigmaV) / (sigmaV + 1.0)
+            out[y, x] = dir_mean + varX / dir_var * (band[y, x] - dir_mean)
+    return out
+
+
+def test_refined_lee_matches_server_kernels():
+    rng = np.random.default_rng(2)
+    img = rng.gamma(4, 0.025, (2, 18, 23))
+    # A bright edge so that every direction is taken, and masked pixels inside and on the border
+    img[:, :, 12:] *= 4
+    img[0, 5:7, 8:11] = np.nan
+    img[1, 15:, :3] = np.nan
+    expected = np.stack([server_refined_lee(band) for band in img])
+    result = local_toolbox.refined_lee(img.astype(np.float32), block_rows=5, workers=1)
+    assert np.array_equal(np.isnan(result), np.isnan(expected))
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-6, equal_nan=True)
@@ -0,0 +1,84 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import duckdb
+import pytest
+
+from flood_utils.query_service import QueryService, make_handler
+
+
+def write_events(db_path, rows):
+    with duckdb.connect(db_path) as con:
+        con.execute('CREATE TABLE IF NOT EXISTS RainfallEvent (EventID BIGINT, ParamHash VARCHAR, StartDate DATE, EndDate DATE, '
+                    'MaxPrecipitation FLOAT, PRIMARY KEY (EventID, ParamHash))')
+        con.execute('CREATE TABLE IF NOT EXISTS RainfallDay (DayID INTEGER, ParamHash VARCHAR, EventID BIGINT, Date DATE, '
+                    'PRIMARY KEY (DayID, ParamHash))')
+        con.executemany('INSERT INTO RainfallEvent VALUES (?, ?, ?, ?, ?)', rows)
+        con.executemany('INSERT INTO RainfallDay VALUES (?, ?, ?, ?)',
+                        [(int(start.replace('-', '')[2:]), param_hash, event_id, start) for event_id,param_hash,start,_,_ in rows])
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'rainfall.db')
+    write_events(path, [(230820230822, 'a', '2023-08-20', '2023-08-22', 80.0)])
+    return path
+
+
+def test_cache_invalidated_after_commit(db_path):
+    service = QueryService(db_path)
+    assert [row['EventID'] for row in service.events('2023-08-01', '2023-09-01')] == [230820230822]
+    service.events('2023-08-01', '2023-09-01')
+    assert service.stats() == {'hits': 1, 'misses': 1, 'cached': 1}
+
+    # The writer commits a new event once the readers have released the file
+    service.close()
+    write_events(db_path, [(230901230903, 'a', '2023-09-01', '2023-09-03', 120.0)])
+    assert [row['EventID'] for row in service.events('2023-08-01', '2023-09-02')] == [230820230822, 230901230903]
+    assert [row['EventID'] for row in service.events('2023-08-01', '2023-09-01')] == [230820230822]
+    assert service.stats() == {'hits': 1, 'misses': 3, 'cached': 2}
+    service.close()
+
+
+def test_lru_eviction_order(db_path):
+    service = QueryService(db_path, cache_size=2)
+    service.event(1)
+    service.event(2)
+    # A hit makes event 1 the most recently used, so event 2 is evicted by event 3
+    service.event(1)
+    service.event(3)
+    assert list(service.cache) == [('event', (1, None, None)), ('event', (3, None, None))]
+    service.event(2)
+    assert list(service.cache) == [('event', (3, None, None)), ('event', (2, None, None))]
+    assert service.stats() == {'hits': 1, 'misses': 4, 'cached': 2}
+    service.close()
+
+
+def test_http_status(db_path):
+    service = QueryService(db_path)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler({'rainfall': service}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}{path}') as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+    try:
+        status, body = get('/rainfall/events?start=2023-08-01&end=2023-09-01')
+        assert status == 200 and [row['EventID'] for row in body] == [230820230822]
+        status, body = get('/rainfall/events/230820230822/days')
+        assert status == 200 and [row['Date'] for row in body] == ['2023-08-20']
+        # A missing parameter or an event ID that is not a number
+        assert get('/rainfall/events?start=2023-08-01')[0] == 400
+        assert get('/rainfall/events/latest')[0] == 400
+        assert get('/flood/events?start=2023-08-01&end=2023-09-01')[0] == 404
+        assert get('/rainfall/maps')[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
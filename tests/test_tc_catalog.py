@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from flood_utils import tc_catalog
+from flood_utils.tc_catalog import query_catalog, update_catalog
+
+
+def write_track(folder, name, points):
+    import shapefile
+    writer = shapefile.Writer(str(folder / name), shapeType=shapefile.POLYLINE)
+    writer.field('id', 'N')
+    writer.line([points])
+    writer.record(1)
+    writer.close()
+    return name + '.shp'
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    files = []
+    catalog_entry = tc_catalog.catalog_entry
+    def counting_entry(TargetDir, TC_file):
+        files.append(TC_file)
+        return catalog_entry(TargetDir, TC_file)
+    monkeypatch.setattr(tc_catalog, 'catalog_entry', counting_entry)
+    return files
+
+
+def test_update_reads_only_changed_files(tmp_path, reads):
+    write_track(tmp_path, '2201_AAA_20220801_20220803', [[113.6, 22.3], [114.8, 22.9]])
+    second = write_track(tmp_path, '2202_BBB_20220805_20220806', [[120.0, 20.0], [121.0, 21.0]])
+    db_path = update_catalog(str(tmp_path))
+    assert sorted(reads) == ['2201_AAA_20220801_20220803.shp', second]
+
+    reads.clear()
+    update_catalog(str(tmp_path))
+    assert reads == []
+
+    # A modified file is read again, a deleted one leaves the catalog
+    os.utime(tmp_path / second, (0, os.path.getmtime(tmp_path / second) + 10))
+    os.remove(tmp_path / '2201_AAA_20220801_20220803.shp')
+    update_catalog(str(tmp_path))
+    assert reads == [second]
+    assert [TC['TC_ID'] for TC in query_catalog(db_path)] == ['2202']
+
+
+def test_query_across_antimeridian(tmp_path):
+    write_track(tmp_path, '2301_EAST_20230801_20230805', [[178.5, 15.0], [-178.5, 16.0]])
+    write_track(tmp_path, '2302_WEST_20230810_20230812', [[120.0, 20.0], [121.0, 21.0]])
+    db_path = update_catalog(str(tmp_path))
+    east = query_catalog(db_path, bbox=(170.0, 10.0, 179.0, 20.0))
+    # Unwrapped, the track ends beyond 180 instead of spanning the whole globe
+    assert [TC['TC_ID'] for TC in east] == ['2301']
+    assert east[0]['West'] == 178.5 and east[0]['East'] == pytest.approx(181.5)
+
+    def found(**kwargs):
+        return [TC['TC_ID'] for TC in query_catalog(db_path, **kwargs)]
+    assert found(bbox=(-180.0, 10.0, -178.0, 20.0)) == ['2301']
+    assert found(bbox=(-170.0, 10.0, -160.0, 20.0)) == []
+    assert found(bbox=(100.0, 0.0, 180.0, 30.0)) == ['2301', '2302']
+    assert found(bbox=(100.0, 0.0, 180.0, 30.0), start_date='2023-08-06') == ['2302']
+    assert found(start_date='2023-08-05', end_date='2023-08-10') == ['2301', '2302']
+    assert found(end_date='2023-07-31') == []
+
+
+def test_duplicate_TC_IDs(tmp_path, reads):
+    old = write_track(tmp_path, '2201_AAA_20220801_20220803', [[113.6, 22.3], [114.8, 22.9]])
+    new = write_track(tmp_path, '2201_AAA_20220801_20220804', [[113.6, 22.3], [115.8, 23.9]])
+    os.utime(tmp_path / old, (0, os.path.getmtime(tmp_path / new) - 10))
+    db_path = update_catalog(str(tmp_path))
+    # The most recently modified file is catalogued
+    assert reads == [new]
+    assert [(TC['TC_ID'], TC['TC_file']) for TC in query_catalog(db_path)] == [('2201', new)]
+
+    # The ignored file does not replace it on the next run, nothing is read again
+    reads.clear()
+    update_catalog(str(tmp_path))
+    assert reads == []
+    assert [TC['TC_file'] for TC in query_catalog(db_path)] == [new]
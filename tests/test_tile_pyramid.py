@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from rainfall_utils.tile_pyramid import _from_key, _order_key, display_range, render_event_maps, render_tiles
+
+
+def write_map(path, values, nodata=None):
+    with rasterio.open(path, 'w', driver='GTiff', width=values.shape[1], height=values.shape[0], count=1,
+                       dtype='float32', transform=from_origin(113.7, 22.9, 0.01, 0.01), crs='EPSG:4326',
+                       nodata=nodata, tiled=True, blockxsize=128, blockysize=128) as dst:
+        dst.write(values.astype('float32'), 1)
+
+
+def bin_width(value):
+    """Width of the histogram bin of display_range holding value."""
+    bin_index = int(_order_key(value)) >> 16
+    return abs(float(_from_key((bin_index + 1) << 16)) - float(_from_key(bin_index << 16)))
+
+
+def test_display_range_matches_percentiles(tmp_path):
+    rng = np.random.default_rng(0)
+    # Negative values too, and masked pixels spread over several blocks
+    values = rng.gamma(2.0, 10.0, size=(300, 400)) - 5
+    values[rng.random(values.shape) < 0.1] = -9999
+    values[:10] = np.nan
+    path = str(tmp_path / 'total_rainfall.tif')
+    write_map(path, values, nodata=-9999)
+
+    stats = display_range(path, percentiles=(2, 50, 98))
+    valid = values[(values != -9999) & np.isfinite(values)].astype(np.float32)
+    assert stats['min'] == valid.min() and stats['max'] == valid.max()
+    for q in (2, 50, 98):
+        expected = np.percentile(valid, q)
+        assert abs(stats[f'p{q}'] - expected) <= bin_width(expected)
+
+    write_map(path, np.full((20, 20), -9999.0), nodata=-9999)
+    assert display_range(path) is None
+
+
+def tile_files(tile_dir):
+    return {os.path.relpath(os.path.join(root, name), tile_dir): os.path.getmtime(os.path.join(root, name))
+            for root,_,names in os.walk(tile_dir) for name in names if name.endswith('.png')}
+
+
+def test_render_tiles_reuses_cache(tmp_path):
+    path = str(tmp_path / '230820230822_total_rainfall.tif')
+    write_map(path, np.linspace(0, 200, 64 * 96).reshape(64, 96))
+    tile_dir = str(tmp_path / 'tiles')
+    written = render_tiles(path, tile_dir, max_zoom=8)
+    tiles = tile_files(tile_dir)
+    assert written == len(tiles) > 0 and any(tile.startswith('8' + os.sep) for tile in tiles)
+
+    # Nothing changed: no tile is written again
+    assert render_tiles(path, tile_dir, max_zoom=8) == 0
+    assert tile_files(tile_dir) == tiles
+
+    # Other parameters render the pyramid again, without the zoom levels no longer wanted
+    vis_params = {'min': 0, 'max': 100, 'palette': ['ffffff', '0000ff'], 'opacity': 0.8}
+    assert render_tiles(path, tile_dir, vis_params=vis_params, max_zoom=7) > 0
+    assert not os.path.exists(os.path.join(tile_dir, '8'))
+
+    # A rewritten map too
+    assert render_tiles(path, tile_dir, vis_params=vis_params, max_zoom=7) == 0
+    write_map(path, np.linspace(0, 100, 64 * 96).reshape(64, 96))
+    os.utime(path, (0, os.path.getmtime(path) + 10))
+    assert render_tiles(path, tile_dir, vis_params=vis_params, max_zoom=7) > 0
+
+
+def test_render_event_maps(tmp_path):
+    path = str(tmp_path / '230820230822_total_rainfall.tif')
+    write_map(path, np.linspace(0, 200, 64 * 96).reshape(64, 96))
+    written = render_event_maps([path, None, str(tmp_path / 'missing.tif')], str(tmp_path / 'tiles'), max_zoom=6)
+    assert list(written) == [path] and written[path] > 0
+    assert os.path.exists(tmp_path / 'tiles' / '230820230822_total_rainfall' / 'tiles.json')
@@ -0,0 +1,58 @@
+import pytest
+from shapely.geometry import LineString
+
+from flood_utils.track_index import TrackIndex, densify, geodesic_buffer, wgs84
+
+
+def write_track(folder, name, points):
+    import shapefile
+    writer = shapefile.Writer(str(folder / name), shapeType=shapefile.POLYLINE)
+    writer.field('id', 'N')
+    writer.line([points])
+    writer.record(1)
+    writer.close()
+    return name + '.shp'
+
+
+def test_densify_across_antimeridian():
+    points = densify(LineString([(179.0, 10.0), (-179.0, 10.0)]), 50000)
+    lons = [lon for lon,_ in points]
+    # Unwrapped: the track continues east beyond 180 instead of jumping back to -180
+    assert lons[0] == 179.0 and lons[-1] == pytest.approx(181.0)
+    assert all(a < b < 181.0 + 1e-9 for a,b in zip(lons[:-1], lons[1:]))
+    distances = [wgs84().inv(lon1, lat1, lon2, lat2)[2] for (lon1,lat1),(lon2,lat2) in zip(points[:-1], points[1:])]
+    assert len(points) > 2 and max(distances) <= 50000
+
+
+def test_geodesic_buffer_radius():
+    geod = wgs84()
+    radius = 200000
+    # Around a single point every vertex is at the radius
+    circle = geodesic_buffer(LineString([(120.0, 45.0), (120.0, 45.0)]), radius)
+    for lon,lat in circle.exterior.coords:
+        assert geod.inv(120.0, 45.0, lon, lat)[2] == pytest.approx(radius, rel=1e-6)
+
+    # Beside a north-south track the buffer reaches the radius on both sides of the middle
+    roi = geodesic_buffer(LineString([(120.0, 30.0), (120.0, 32.0)]), radius)
+    across = roi.intersection(LineString([(110.0, 31.0), (130.0, 31.0)]))
+    west, _, east, _ = across.bounds
+    assert geod.inv(120.0, 31.0, east, 31.0)[2] == pytest.approx(radius, rel=0.01)
+    assert geod.inv(120.0, 31.0, west, 31.0)[2] == pytest.approx(radius, rel=0.01)
+
+
+def test_query_across_antimeridian(tmp_path):
+    crossing = write_track(tmp_path, '2301_EAST_20230801_20230805', [[178.5, 15.0], [-178.5, 16.0]])
+    write_track(tmp_path, '2302_WEST_20230810_20230812', [[120.0, 20.0], [121.0, 21.0]])
+    index = TrackIndex(str(tmp_path), radius=300000)
+    # One polygon extending beyond 180
+    assert index.roi('2301').geom_type == 'Polygon' and index.roi('2301').bounds[2] > 180
+
+    def found(*args, **kwargs):
+        return [TC['TC_ID'] for TC in index.query(*args, **kwargs)]
+    # Boxes on either side of the antimeridian, in -180..180
+    assert found((-178.0, 10.0, -170.0, 20.0)) == ['2301']
+    assert found((170.0, 10.0, 179.0, 20.0)) == ['2301']
+    assert found((-170.0, 10.0, -160.0, 20.0)) == []
+    assert found((100.0, 0.0, 180.0, 30.0)) == ['2301', '2302']
+    assert found((100.0, 0.0, 180.0, 30.0), start_date='2023-08-06') == ['2302']
+    assert found(end_date='2023-08-05') == ['2301']
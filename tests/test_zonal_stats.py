@@ -0,0 +1,26 @@
+import numpy as np
+
+from flood_utils.zonal_stats import zonal_counts, roll_up
+
+
+def unit(code, name, adm1, adm0=1):
+    return {'ADM2_CODE': code, 'ADM2_NAME': name, 'ADM1_CODE': adm1, 'ADM1_NAME': f'P{adm1}',
+            'ADM0_CODE': adm0, 'ADM0_NAME': 'C'}
+
+
+def test_roll_up_counts_duplicate_units_once():
+    labels = np.array([[11, 11, 12], [12, 21, 0]])
+    valid = np.array([[1, 1, 1], [0, 1, 1]], dtype=bool)
+    flooded = np.array([[1, 0, 1], [1, 1, 1]], dtype=bool)
+    counts = zonal_counts(labels, valid, flooded)
+    assert counts == {11: (2, 1), 12: (1, 1), 21: (1, 1)}
+
+    # Unit 11 is made of two GAUL features
+    units = [unit(11, 'A', 1), unit(11, 'A', 1), unit(12, 'B', 1), unit(21, 'C', 2)]
+    rows = {(row['Level'], row['Code']): row for row in roll_up(counts, units, pixel_area=0.25)}
+    assert rows[(2, 11)]['ValidPixels'] == 2
+    assert rows[(1, 1)]['ValidPixels'] == 3
+    assert rows[(1, 1)]['FloodedPixels'] == 2
+    assert rows[(0, 1)]['ValidPixels'] == 4
+    assert rows[(0, 1)]['FloodedArea'] == 0.75
+    assert rows[(0, 1)]['FloodProportion'] == 75
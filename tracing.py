@@ -0,0 +1,310 @@
+# Round-trip and stage instrumentation for the rainfall and flood runs.
+#
+# Off by default. When enabled, every getInfo, reduceRegion, geemap download, batch
+# export and task listing is counted and timed, with the bytes transferred (size of
+# the getInfo result as JSON, size of the downloaded file), and attributed to the
+# stage it ran in, e.g. "FloodDay 2022-04-02 / obtain_flood_water". The stages are the
+# methods decorated with @traced; the object is the trace_label of the instance.
+# A reduceRegion only builds the request, its server time shows in the getInfo or
+# download that evaluates it.
+#
+# Enable it before the run with enable(path) or from the environment:
+#
+#   EE_TRACE          File the trace is written to at exit, e.g. ../../data/trace.json
+#   EE_TRACE_FORMAT   json (events and summary, the default) or chrome (trace-event
+#                     format, for chrome://tracing or https://ui.perfetto.dev)
+#
+# At exit the trace is written and a summary table printed, one row per stage.
+
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+import ee_session
+
+# Kinds of round trips, the columns of the summary
+KINDS = ('getInfo', 'reduceRegion', 'download', 'export', 'tasks')
+
+
+class Tracer:
+    """
+    Collects stage spans and round trips.
+
+    Attributes:
+        enabled (bool): Whether anything is recorded.
+        path (str): File written by finish, None to only print the summary.
+        format (str): 'json' or 'chrome'.
+        events (list): The recorded spans and round trips, as dicts.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.format = 'json'
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        self.finished = False
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+            self.local.depth = 0
+        return self.local.stack
+
+    def _add(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def current(self):
+        """
+        Returns:
+            tuple: (label, group, stage, path) of the innermost stage of this thread, Nones outside any stage.
+        """
+        stack = self._stack()
+        if not stack:
+            return None,None,None,None
+        label,group,stage = stack[-1]
+        return label,group,stage,' / '.join(f'{l} / {s}' for l,_,s in stack)
+
+    def span(self, stage, label=None, group=None):
+        """
+        Context manager timing a stage of an object; a stage entered again by the same object is not nested.
+
+        Args:
+            stage (str): The stage, e.g. 'obtain_flood_water'.
+            label (str): The object, e.g. 'FloodDay 2022-04-02'.
+            group (str): What the summary groups the object under, e.g. 'FloodDay'.
+        """
+        return _Span(self, stage, label or group or '', group or label or '')
+
+    def record(self, kind, name, start, duration, size=None):
+        label,group,stage,path = self.current()
+        self._add({'kind': kind, 'name': name, 'object': label, 'group': group, 'stage': stage, 'path': path,
+                   'start': start - self.origin, 'duration': duration, 'bytes': size,
+                   'thread': threading.current_thread().name})
+
+    def summary(self):
+        """
+        Returns:
+            list: One dict per stage ('stage', 'calls', 'wall', one count per kind, 'round_trip_seconds', 'bytes'),
+                the stages with the most round-trip time first.
+        """
+        rows = {}
+        def row(key):
+            if key not in rows:
+                rows[key] = {'stage': key, 'calls': 0, 'wall': 0.0, **{kind: 0 for kind in KINDS}, 'round_trip_seconds': 0.0, 'bytes': 0}
+            return rows[key]
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            key = f"{event['group']} / {event['stage']}" if event['stage'] else '(outside any stage)'
+            if event['kind'] == 'stage':
+                row(key)['calls'] += 1
+                row(key)['wall'] += event['duration']
+            else:
+                r = row(key)
+                r[event['kind']] += 1
+                if event['kind'] != 'reduceRegion':
+                    r['round_trip_seconds'] += event['duration']
+                r['bytes'] += event['bytes'] or 0
+        return sorted(rows.values(), key=lambda r: (-r['round_trip_seconds'], -r['wall']))
+
+    def summary_table(self):
+        """
+        Returns:
+            str: The summary as a fixed-width table with a total line.
+        """
+        rows = self.summary()
+        width = max([len(r['stage']) for r in rows] + [5])
+        header = f"{'Stage':<{width}}  {'Calls':>5}  {'Wall s':>8}  {'getInfo':>7}  {'reduceRegion':>12}  {'Download':>8}  {'Export':>6}  {'Tasks':>5}  {'Round trip s':>12}  {'MB':>8}"
+        lines = [header, '-' * len(header)]
+        for r in rows:
+            lines.append(f"{r['stage']:<{width}}  {r['calls']:>5}  {r['wall']:>8.2f}  {r['getInfo']:>7}  {r['reduceRegion']:>12}  {r['download']:>8}  "
+                         f"{r['export']:>6}  {r['tasks']:>5}  {r['round_trip_seconds']:>12.2f}  {r['bytes'] / 2 ** 20:>8.2f}")
+        lines.append('-' * len(header))
+        lines.append(f"{'Total':<{width}}  {'':>5}  {'':>8}  {sum(r['getInfo'] for r in rows):>7}  {sum(r['reduceRegion'] for r in rows):>12}  "
+                     f"{sum(r['download'] for r in rows):>8}  {sum(r['export'] for r in rows):>6}  {sum(r['tasks'] for r in rows):>5}  "
+                     f"{sum(r['round_trip_seconds'] for r in rows):>12.2f}  {sum(r['bytes'] for r in rows) / 2 ** 20:>8.2f}")
+        return '\n'.join(lines)
+
+    def write(self, path=None, format=None):
+        """
+        Writes the trace as JSON (events and summary) or in Chrome trace-event format.
+
+        Returns:
+            str: The path written.
+        """
+        path = path or self.path
+        format = format or self.format
+        with self.lock:
+            events = list(self.events)
+        if format == 'chrome':
+            pid = os.getpid()
+            threads = {}
+            trace = []
+            for event in events:
+                tid = threads.setdefault(event['thread'], len(threads) + 1)
+                name = f"{event['object']} / {event['name']}" if event['kind'] == 'stage' else f"{event['kind']} {event['name']}"
+                trace.append({'name': name, 'cat': event['kind'], 'ph': 'X', 'pid': pid, 'tid': tid,
+                              'ts': round(event['start'] * 1e6, 1), 'dur': round(event['duration'] * 1e6, 1),
+                              'args': {'stage': event['path'], 'bytes': event['bytes']}})
+            trace.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}} for name,tid in threads.items())
+            document = {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+        else:
+            document = {'events': events, 'summary': self.summary()}
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(document, f, default=str)
+        return path
+
+    def finish(self):
+        """
+        Writes the trace and prints the summary table; called at exit when enabled.
+        """
+        if not self.enabled or self.finished:
+            return
+        self.finished = True
+        if self.path:
+            print(f"Trace written to {self.write()}")
+        print(self.summary_table())
+
+
+class _Span:
+    def __init__(self, tracer, stage, label, group):
+        self.tracer = tracer
+        self.entry = (label, group, stage)
+        self.pushed = False
+
+    def __enter__(self):
+        if not self.tracer.enabled:
+            return self
+        stack = self.tracer._stack()
+        if stack and stack[-1][0] == self.entry[0] and stack[-1][2] == self.entry[2]:
+            return self
+        stack.append(self.entry)
+        self.pushed = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.pushed:
+            duration = time.perf_counter() - self.start
+            label,group,stage = self.entry
+            path = self.tracer.current()[3]
+            self.tracer._stack().pop()
+            self.tracer._add({'kind': 'stage', 'name': stage, 'object': label, 'group': group, 'stage': stage, 'path': path,
+                              'start': self.start - self.tracer.origin, 'duration': duration, 'bytes': None,
+                              'thread': threading.current_thread().name})
+        return False
+
+
+tracer = Tracer()
+
+
+def traced(method):
+    """
+    Decorator making a method a stage of its object, labelled with self.trace_label (the class name by default).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not tracer.enabled:
+            return method(self, *args, **kwargs)
+        with tracer.span(method.__name__, getattr(self, 'trace_label', type(self).__name__), type(self).__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _json_size(value):
+    try:
+        return len(json.dumps(value, default=str).encode())
+    except (TypeError, ValueError):
+        return None
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+def _wrap(owner, attr, kind, name, size=None):
+    """
+    Replaces owner.attr with a function recording a round trip of the given kind.
+    Round trips made inside another one (e.g. the getInfo calls of a download) are not counted again.
+
+    Args:
+        name (callable): Name of the call from its arguments.
+        size (callable, optional): Bytes transferred from the arguments and the result.
+    """
+    original = getattr(owner, attr, None)
+    if original is None or getattr(original, 'traced', False):
+        return
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        tracer._stack()
+        if not tracer.enabled or tracer.local.depth:
+            return original(*args, **kwargs)
+        tracer.local.depth += 1
+        start = time.perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        finally:
+            tracer.local.depth -= 1
+        duration = time.perf_counter() - start
+        tracer.record(kind, name(*args, **kwargs), start, duration, size(result, *args, **kwargs) if size else None)
+        return result
+    wrapper.traced = True
+    setattr(owner, attr, wrapper)
+
+
+def instrument(module):
+    """
+    Wraps the round trips of an initialised Earth Engine module (or of its offline stand-in) and of geemap.
+    """
+    for value in list(vars(module).values()):
+        if isinstance(value, type) and 'getInfo' in vars(value):
+            _wrap(value, 'getInfo', 'getInfo', lambda self,*a,**k: f'{type(self).__name__}.getInfo',
+                  lambda result,*a,**k: _json_size(result))
+    _wrap(module.Image, 'reduceRegion', 'reduceRegion', lambda self,*a,**k: 'Image.reduceRegion')
+    _wrap(module.batch.Task, 'start', 'export',
+          lambda task,*a,**k: f"{getattr(task, 'task_type', 'EXPORT')} {(getattr(task, 'config', None) or {}).get('description', '')}")
+    _wrap(module.data, 'getTaskList', 'tasks', lambda *a,**k: 'getTaskList')
+    try:
+        import geemap
+    except ImportError:
+        return
+    _wrap(geemap, 'ee_export_image', 'download',
+          lambda image,filename=None,*a,**k: os.path.basename(str(filename)),
+          lambda result,image,filename=None,*a,**k: _file_size(filename))
+
+
+def enable(path=None, format='json'):
+    """
+    Starts recording; the round trips are wrapped once the Earth Engine session is initialised.
+
+    Args:
+        path (str, optional): File the trace is written to at exit.
+        format (str): 'json' or 'chrome'.
+
+    Returns:
+        Tracer: The shared tracer.
+    """
+    if format not in ('json', 'chrome'):
+        raise ValueError(f"Unknown trace format {format!r}, expected 'json' or 'chrome'")
+    if not tracer.enabled:
+        atexit.register(tracer.finish)
+    tracer.enabled = True
+    tracer.finished = False
+    tracer.path = path
+    tracer.format = format
+    ee_session.session.add_hook(instrument)
+    return tracer
+
+
+if os.environ.get('EE_TRACE'):
+    enable(os.environ['EE_TRACE'], os.environ.get('EE_TRACE_FORMAT', 'json'))